@@ -1,14 +1,8 @@
 import pandas as pd
 import uuid
-import os
+from storage import DB_FILE, get_default_store
 
-DATA_FILE = os.path.join(os.getcwd(), 'logistics_prototype', 'data', 'orders.csv')
-
-# Load existing data or create a new DataFrame if the file doesn't exist
-try:
-    orders_df = pd.read_csv(DATA_FILE)
-except FileNotFoundError:
-    orders_df = pd.DataFrame(columns=['id', 'pickup_address', 'delivery_address', 'assigned_to', 'status', 'lat_pick', 'lon_pick', 'lat_drop', 'lon_drop', 'eta'])
+store = get_default_store()
 
 new_orders_data = [
     {
@@ -37,10 +31,10 @@ new_orders_data = [
     }
 ]
 
-for order_data in new_orders_data:
-    # Calculate distance and ETA (using dummy values for now, actual calculation will happen in app)
-    # For this script, we'll just put N/A for ETA as it's calculated in the app
-    new_order = pd.DataFrame([{
+# Calculate distance and ETA (using dummy values for now, actual calculation will happen in app)
+# For this script, we'll just put N/A for ETA as it's calculated in the app
+new_orders = pd.DataFrame([
+    {
         'id': str(uuid.uuid4()),
         'pickup_address': order_data['pickup_address'],
         'delivery_address': order_data['delivery_address'],
@@ -51,8 +45,10 @@ for order_data in new_orders_data:
         'lat_drop': order_data['lat_drop'],
         'lon_drop': order_data['lon_drop'],
         'eta': 'N/A' # Will be calculated by the app
-    }])
-    orders_df = pd.concat([orders_df, new_order], ignore_index=True)
+    }
+    for order_data in new_orders_data
+])
 
-orders_df.to_csv(DATA_FILE, index=False)
-print(f"Successfully added new orders to {DATA_FILE}")
+# Insert all new orders in one transaction
+store.insert_orders(new_orders)
+print(f"Successfully added new orders to {DB_FILE}")
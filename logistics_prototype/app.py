@@ -1,366 +1,463 @@
 
 import streamlit as st
 import pandas as pd
-from utils import get_lat_lon, update_order_status, get_estimated_delivery_time, haversine_distance
-from optimizer import optimize_route
+from utils import ORDER_COLUMNS, get_lat_lon, get_lat_lon_batch, get_estimated_delivery_time, haversine_distance
+from ingestion import MissingColumnsError, ingest_orders_csv, append_orders
+from storage import get_default_store
+from optimizer import set_matrix_provider
+from road_network import load_distance_cache
+from eta import DEFAULT_SERVICE_MINUTES, DEFAULT_SHIFT_START, shift_start_time
+from jobs import JobRunner
+from planning import route_stops
+from dispatch import dispatch_new_order, dispatch_status_changes
+from spatial_index import SpatialIndex
+from assignment import auto_assign
+from instrumentation import metrics
 import uuid
 import os
 
-DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'orders.csv')
+delivery_partners = ["Partner A", "Partner B", "Partner C"] # Replace with your actual list
+
+ORDER_STATUSES = ["Pending", "Picked Up", "Delivered"]
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+# Solver budget when quickly re-optimizing from the last plan: stop at the
+# first solution, which is the last routes with the changed orders inserted
+# at their cheapest places (milliseconds), or after a second at most
+QUICK_REOPTIMIZE_SECONDS = 1
+QUICK_REOPTIMIZE_SOLUTIONS = 1
 
-st.set_page_config(layout="wide")
 
 # Load custom CSS
 def load_css(file_name):
     with open(file_name) as f:
         st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
 
-css_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'style.css')
-load_css(css_file_path)
-
-st.title("AI Logistics Platform for MSMEs")
-
-# Initialize session state for orders_df
-if 'orders_df' not in st.session_state:
-    try:
-        st.session_state.orders_df = pd.read_csv(DATA_FILE)
-        if 'eta' not in st.session_state.orders_df.columns:
-            st.session_state.orders_df['eta'] = 'N/A'
-    except FileNotFoundError:
-        st.session_state.orders_df = pd.DataFrame(columns=['id', 'pickup_address', 'delivery_address', 'assigned_to', 'status', 'lat_pick', 'lon_pick', 'lat_drop', 'lon_drop', 'eta'])
-
-# Ensure all IDs are unique and valid UUIDs in session_state
-existing_ids = set()
-ids_changed = False
-for index, row in st.session_state.orders_df.iterrows():
-    current_id = str(row['id'])
-    try:
-        # Check if it's a valid UUID and not already seen
-        uuid.UUID(current_id)
-        if current_id in existing_ids:
-            raise ValueError("Duplicate ID")
-        existing_ids.add(current_id)
-    except (ValueError, AttributeError):
-        # If not a valid UUID or duplicate, generate a new one
-        new_id = str(uuid.uuid4())
-        st.session_state.orders_df.at[index, 'id'] = new_id
-        existing_ids.add(new_id)
-        ids_changed = True
-
-# Save changes if any IDs were regenerated
-if ids_changed:
-    st.session_state.orders_df.to_csv(DATA_FILE, index=False)
-    st.rerun() # Rerun to load the cleaned data
-
-# MSME Dashboard
-st.header("MSME Dashboard")
-
-# --- Layout for Data Loading and Creation ---
-col1, col2 = st.columns(2)
-
-with col1:
-    with st.container():
-        st.subheader("Quick Actions")
-        # Load Sample Data Button
-        SAMPLE_DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'sample_dataset.csv')
-        if st.button("Load Sample Data"):
-            try:
-                sample_df = pd.read_csv(SAMPLE_DATA_FILE)
-                # Clean up column names (strip whitespace and convert to lowercase)
-                sample_df.columns = sample_df.columns.str.strip().str.lower()
-
-                pickup_col = 'pickupaddress'
-                delivery_col = 'deliveryaddress'
-
-                if pickup_col in sample_df.columns and delivery_col in sample_df.columns:
-                    processed_orders = 0
-                    failed_addresses = []
-                    for index, row in sample_df.iterrows():
-                        pickup_address_str = row[pickup_col]
-                        delivery_address_str = row[delivery_col]
-
-                        lat_pick, lon_pick, lat_drop, lon_drop = None, None, None, None
-
-                        # Try to get coordinates from CSV first
-                        if 'lat_pick' in sample_df.columns and 'lon_pick' in sample_df.columns and \
-                           pd.notna(row.get('lat_pick')) and pd.notna(row.get('lon_pick')):
-                            lat_pick = float(row['lat_pick'])
-                            lon_pick = float(row['lon_pick'])
-                        
-                        if 'lat_drop' in sample_df.columns and 'lon_drop' in sample_df.columns and \
-                           pd.notna(row.get('lat_drop')) and pd.notna(row.get('lon_drop')):
-                            lat_drop = float(row['lat_drop'])
-                            lon_drop = float(row['lon_drop'])
-
-                        # If coordinates not provided in CSV, try geocoding
-                        if lat_pick is None or lon_pick is None:
-                            temp_pickup_address = pickup_address_str + ", Delhi, India"
-                            lat_pick, lon_pick = get_lat_lon(temp_pickup_address)
-                            if lat_pick is None:
-                                failed_addresses.append(pickup_address_str)
-                                continue
-
-                        if lat_drop is None or lon_drop is None:
-                            temp_delivery_address = delivery_address_str + ", Delhi, India"
-                            lat_drop, lon_drop = get_lat_lon(temp_delivery_address)
-                            if lat_drop is None:
-                                failed_addresses.append(delivery_address_str)
-                                continue
-
-                        distance = haversine_distance(lat_pick, lon_pick, lat_drop, lon_drop)
-                        eta = get_estimated_delivery_time(distance)
-                        new_order = pd.DataFrame([{\
-                            'id': str(uuid.uuid4()),
-                            'pickup_address': pickup_address_str,
-                            'delivery_address': delivery_address_str,
-                            'assigned_to': 'N/A',
-                            'status': 'Pending',
-                            'lat_pick': lat_pick,
-                            'lon_pick': lon_pick,
-                            'lat_drop': lat_drop,
-                            'lon_drop': lon_drop,
-                            'eta': eta
-                        }])
-                        st.session_state.orders_df = pd.concat([st.session_state.orders_df, new_order], ignore_index=True)
-                        processed_orders += 1
-                    
+def geocode_with_progress(addresses):
+    """Geocode a batch of addresses concurrently, showing a progress bar."""
+    progress = st.progress(0.0, text="Geocoding addresses...")
+    def show_progress(done, total):
+        progress.progress(done / total, text=f"Geocoded {done} of {total} addresses")
+    geocoded = get_lat_lon_batch(addresses, progress_callback=show_progress)
+    progress.empty()
+    return geocoded
+
+def paginate(key, total):
+    """Page size and page number controls; returns the (limit, offset) of the current page."""
+    size_col, page_col, info_col = st.columns(3)
+    with size_col:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{key}_page_size")
+    num_pages = max(1, -(-total // page_size))
+    with page_col:
+        page = st.number_input("Page", min_value=1, max_value=num_pages, value=1, key=f"{key}_page")
+    with info_col:
+        st.caption(f"{total} orders, page {page} of {num_pages}")
+    return page_size, (page - 1) * page_size
+
+def save_edits(store, original, edited, columns):
+    """
+    Write the cells changed in a data editor back to the store in one transaction,
+    each only if the order still holds the value the page showed. Returns the
+    number of orders saved and the ids of those another session changed meanwhile.
+    """
+    before = original.set_index('id')[columns].astype(object)
+    after = edited.set_index('id')[columns].astype(object)
+    # Missing values are compared and written as NULL
+    before, after = before.where(before.notna(), None), after.where(after.notna(), None)
+    changed = before.fillna('N/A') != after.fillna('N/A')
+    updates = []
+    for order_id, row in changed[changed.any(axis=1)].iterrows():
+        cells = row.index[row].tolist()
+        updates.append((order_id, after.loc[order_id, cells].to_dict(), before.loc[order_id, cells].to_dict()))
+    conflicts = store.update_orders(updates) if updates else []
+    saved = [(order_id, values) for order_id, values, _ in updates if order_id not in conflicts]
+    statuses = {order_id: values['status'] for order_id, values in saved if 'status' in values}
+    if statuses:
+        # Take finished stops off the current routes and refresh the ETAs after them
+        dispatch_status_changes(store, statuses)
+    return len(saved), conflicts
+
+def show_save_result(saved, conflicts):
+    """Report saved edits, and the orders whose edits lost to another session's change."""
+    st.success(f"Updated {saved} orders.")
+    if conflicts:
+        st.warning(f"{len(conflicts)} orders were changed by someone else since this page loaded and were not saved; "
+                   "review them and save again: " + ", ".join(conflicts))
+
+@st.cache_resource
+def get_job_runner():
+    """Worker process running route optimization off the UI thread, shared by every session."""
+    return JobRunner()
+
+@st.cache_resource
+def get_pickup_index():
+    """Pickups of unassigned pending orders, shared by every session and synced with the store."""
+    return SpatialIndex()
+
+def show_plan_progress(runner, job_id):
+    """Progress and best distance so far of a running optimization; reloads the page when it ends."""
+    job = runner.jobs.get(job_id)
+    if job['status'] not in ('queued', 'running'):
+        st.rerun()
+    progress = job['progress'] or {}
+    message = f"Optimizing routes for {job['params']['orders']} orders ({job['status']}"
+    if progress.get('elapsed_seconds') is not None:
+        message += f", {progress['elapsed_seconds']:.0f}s"
+    message += ")"
+    if progress.get('distance_km') is not None:
+        message += f" - best so far {progress['distance_km']:.2f} km after {progress['solutions']} improvements"
+    st.info(message)
+    if progress.get('clusters_total'):
+        st.progress(progress['clusters_done'] / progress['clusters_total'],
+                    text=f"{progress['clusters_done']} of {progress['clusters_total']} areas solved")
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_orders(version):
+    """
+    The orders table with compact dtypes, from its Parquet snapshot, once per
+    store version. Every session shares this one read-only copy.
+    """
+    return get_default_store().snapshot(version)
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def sync_pickup_index(version):
+    """
+    Bring the shared pickup index up to date with the store, once per store
+    version: only orders added, assigned or finished since the last version
+    are added to or removed from it.
+    """
+    orders_df = load_orders(version)
+    # Compare without filling: the snapshot's categorical column has no 'N/A' category to fill with
+    unassigned = orders_df[(orders_df['status'] == 'Pending')
+                           & (orders_df['assigned_to'].isna() | orders_df['assigned_to'].eq('N/A'))]
+    pickup_index = get_pickup_index()
+    pickup_index.sync(unassigned['id'], unassigned[['lat_pick', 'lon_pick']].to_numpy())
+    return pickup_index
+
+def main():
+    st.set_page_config(layout="wide")
+
+    css_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'style.css')
+    load_css(css_file_path)
+
+    st.title("AI Logistics Platform for MSMEs")
+
+    # Orders live in the SQLite store; every write goes through it one change at a time
+    store = get_default_store()
+
+    # Distances are computed once per location pair, and a repeat click over the
+    # same pending orders and settings returns the stored plan
+    distance_cache = st.cache_resource(load_distance_cache)()
+    set_matrix_provider(distance_cache.matrix)
+    # Locations added during the last run are written out once here, not on every lookup
+    distance_cache.flush()
+
+    runner = get_job_runner()
+
+    # Order ids are checked when written (primary key, and ensure_valid_ids on import),
+    # so a rerun only re-reads the table when some session has changed it
+    orders_version = store.version()
+    st.session_state.orders_df = load_orders(orders_version)
+
+    # MSME Dashboard
+    st.header("MSME Dashboard")
+
+    # --- Layout for Data Loading and Creation ---
+    col1, col2 = st.columns(2)
+
+    with col1:
+        with st.container():
+            st.subheader("Quick Actions")
+            # Load Sample Data Button
+            SAMPLE_DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'sample_dataset.csv')
+            if st.button("Load Sample Data"):
+                try:
+                    new_orders, failed_addresses = ingest_orders_csv(SAMPLE_DATA_FILE, geocode_batch=geocode_with_progress)
+                    processed_orders = len(new_orders)
+
                     if processed_orders > 0:
-                        st.session_state.orders_df.to_csv(DATA_FILE, index=False)
+                        store.insert_orders(new_orders)
+                        st.session_state.orders_df = append_orders(st.session_state.orders_df, new_orders)
                         st.success(f"Successfully processed {processed_orders} new orders from sample data!")
                         st.rerun()
 
                     if failed_addresses:
                         st.warning("The following addresses from sample data could not be found via geocoding and were skipped:")
-                        for address in set(failed_addresses):
+                        for address in failed_addresses:
                             st.write(f"- {address}")
 
-                else:
+                except MissingColumnsError:
                     st.error("The sample data CSV must have 'pickupaddress' and 'deliveryaddress' columns. Optionally, you can include 'lat_pick', 'lon_pick', 'lat_drop', 'lon_drop' for direct coordinate input.")
-            except Exception as e:
-                st.error(f"An error occurred while loading sample data: {e}")
-
-        # Bulk upload
-        st.subheader("Upload a CSV with multiple orders")
-        uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
-        if uploaded_file is not None:
-            try:
-                new_orders_df = pd.read_csv(uploaded_file)
-                # Clean up column names (strip whitespace and convert to lowercase)
-                new_orders_df.columns = new_orders_df.columns.str.strip().str.lower()
-
-                # Use the correct column names from the user's CSV
-                pickup_col = 'pickupaddress'
-                delivery_col = 'deliveryaddress'
-
-                if pickup_col in new_orders_df.columns and delivery_col in new_orders_df.columns:
-                    processed_orders = 0
-                    failed_addresses = []
-                    for index, row in new_orders_df.iterrows():
-                        pickup_address_str = row[pickup_col]
-                        delivery_address_str = row[delivery_col]
-
-                        lat_pick, lon_pick, lat_drop, lon_drop = None, None, None, None
-
-                        # Try to get coordinates from CSV first
-                        if 'lat_pick' in new_orders_df.columns and 'lon_pick' in new_orders_df.columns and \
-                           pd.notna(row.get('lat_pick')) and pd.notna(row.get('lon_pick')):
-                            lat_pick = float(row['lat_pick'])
-                            lon_pick = float(row['lon_pick'])
-                        
-                        if 'lat_drop' in new_orders_df.columns and 'lon_drop' in new_orders_df.columns and \
-                           pd.notna(row.get('lat_drop')) and pd.notna(row.get('lon_drop')):
-                            lat_drop = float(row['lat_drop'])
-                            lon_drop = float(row['lon_drop'])
-
-                        # If coordinates not provided in CSV, try geocoding
-                        if lat_pick is None or lon_pick is None:
-                            temp_pickup_address = pickup_address_str + ", Delhi, India"
-                            lat_pick, lon_pick = get_lat_lon(temp_pickup_address)
-                            if lat_pick is None:
-                                failed_addresses.append(pickup_address_str)
-                                continue
-
-                        if lat_drop is None or lon_drop is None:
-                            temp_delivery_address = delivery_address_str + ", Delhi, India"
-                            lat_drop, lon_drop = get_lat_lon(temp_delivery_address)
-                            if lat_drop is None:
-                                failed_addresses.append(delivery_address_str)
-                                continue
-
-                        distance = haversine_distance(lat_pick, lon_pick, lat_drop, lon_drop)
-                        eta = get_estimated_delivery_time(distance)
-                        new_order = pd.DataFrame([{
-                            'id': str(uuid.uuid4()),
-                            'pickup_address': pickup_address_str,
-                            'delivery_address': delivery_address_str,
-                            'assigned_to': 'N/A',
-                            'status': 'Pending',
-                            'lat_pick': lat_pick,
-                            'lon_pick': lon_pick,
-                            'lat_drop': lat_drop,
-                            'lon_drop': lon_drop,
-                            'eta': eta
-                        }])
-                        st.session_state.orders_df = pd.concat([st.session_state.orders_df, new_order], ignore_index=True)
-                        processed_orders += 1
-                    
+                except Exception as e:
+                    st.error(f"An error occurred while loading sample data: {e}")
+
+            # Bulk upload
+            st.subheader("Upload a CSV with multiple orders")
+            uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
+            if uploaded_file is not None:
+                try:
+                    # Large files are read and prepared in bounded-size chunks
+                    new_orders, failed_addresses = ingest_orders_csv(uploaded_file, geocode_batch=geocode_with_progress)
+                    processed_orders = len(new_orders)
+
                     if processed_orders > 0:
-                        st.session_state.orders_df.to_csv(DATA_FILE, index=False)
+                        store.insert_orders(new_orders)
+                        st.session_state.orders_df = append_orders(st.session_state.orders_df, new_orders)
                         st.success(f"Successfully processed {processed_orders} new orders!")
 
                     if failed_addresses:
                         st.warning("The following addresses could not be found via geocoding and were skipped. Consider adding 'lat_pick', 'lon_pick', 'lat_drop', 'lon_drop' columns to your CSV for these entries:")
-                        for address in set(failed_addresses):
+                        for address in failed_addresses:
                             st.write(f"- {address}")
 
-                else:
+                except MissingColumnsError:
                     st.error("The uploaded CSV must have 'pickupaddress' and 'deliveryaddress' columns. Optionally, you can include 'lat_pick', 'lon_pick', 'lat_drop', 'lon_drop' for direct coordinate input.")
-            except Exception as e:
-                st.error(f"An error occurred while processing the file: {e}")
-
-with col2:
-    with st.container():
-        st.subheader("Create New Shipment")
-        with st.form("new_shipment_form"):
-            pickup_address = st.text_input("Pickup Address")
-            delivery_address = st.text_input("Delivery Address")
-            submitted = st.form_submit_button("Create Shipment")
-
-            if submitted:
-                if pickup_address and delivery_address:
-                    lat_pick, lon_pick = get_lat_lon(pickup_address)
-                    lat_drop, lon_drop = get_lat_lon(delivery_address)
-                    if lat_pick is not None:
-                        new_order = pd.DataFrame([{
-                            'id': str(uuid.uuid4()),
-                            'pickup_address': pickup_address,
-                            'delivery_address': delivery_address,
-                            'assigned_to': 'N/A',
-                            'status': 'Pending',
-                            'lat_pick': lat_pick,
-                            'lon_pick': lon_pick,
-                            'lat_drop': lat_drop,
-                            'lon_drop': lon_drop
-                        }])
-                        distance = haversine_distance(lat_pick, lon_pick, lat_drop, lon_drop)
-                        eta = get_estimated_delivery_time(distance)
-                        new_order['eta'] = eta
-                        st.session_state.orders_df = pd.concat([st.session_state.orders_df, new_order], ignore_index=True)
-                        st.session_state.orders_df.to_csv(DATA_FILE, index=False)
-                        st.success("Shipment created successfully!")
-                        st.info(f"Estimated delivery time: {eta}")
+                except Exception as e:
+                    st.error(f"An error occurred while processing the file: {e}")
+
+    with col2:
+        with st.container():
+            st.subheader("Create New Shipment")
+            with st.form("new_shipment_form"):
+                pickup_address = st.text_input("Pickup Address")
+                delivery_address = st.text_input("Delivery Address")
+                submitted = st.form_submit_button("Create Shipment")
+
+                if submitted:
+                    if pickup_address and delivery_address:
+                        lat_pick, lon_pick = get_lat_lon(pickup_address)
+                        lat_drop, lon_drop = get_lat_lon(delivery_address)
+                        if lat_pick is not None:
+                            order_id = str(uuid.uuid4())
+                            new_order = pd.DataFrame([{
+                                'id': order_id,
+                                'pickup_address': pickup_address,
+                                'delivery_address': delivery_address,
+                                'assigned_to': 'N/A',
+                                'status': 'Pending',
+                                'lat_pick': lat_pick,
+                                'lon_pick': lon_pick,
+                                'lat_drop': lat_drop,
+                                'lon_drop': lon_drop
+                            }])
+                            distance = haversine_distance(lat_pick, lon_pick, lat_drop, lon_drop)
+                            eta = get_estimated_delivery_time(distance)
+                            new_order['eta'] = eta
+                            store.insert_orders(new_order)
+                            st.session_state.orders_df = append_orders(st.session_state.orders_df, new_order)
+                            st.success("Shipment created successfully!")
+                            # Slot the order into the current routes instead of re-solving them all
+                            partner = dispatch_new_order(store, order_id, (lat_pick, lon_pick), (lat_drop, lon_drop))
+                            if partner is not None:
+                                eta = store.get_order(order_id)['eta']
+                                st.info(f"Added to {partner}'s route")
+                            st.info(f"Estimated delivery time: {eta}")
+                        else:
+                            st.error("Could not geocode the address. Please check and try again.")
                     else:
-                        st.error("Could not geocode the address. Please check and try again.")
-                else:
-                    st.error("Please provide both pickup and delivery addresses.")
-
-# --- Tabs for Dashboard and Delivery Partner View ---
-tabs = st.tabs(["MSME Dashboard", "Delivery Partner View"])
-
-with tabs[0]:
-    st.header("Shipment Overview")
-    st.dataframe(st.session_state.orders_df)
-
-    st.subheader("Manage Shipments")
-    for index, order in st.session_state.orders_df.iterrows():
-        with st.expander(f"Order {order['id']}"):
-            st.write(f"**Pickup:** {order['pickup_address']}")
-            st.write(f"**Delivery:** {order['delivery_address']}")
-            st.write(f"**Status:** {order['status']}")
-            st.write(f"**Assigned to:** {order['assigned_to']}")
-            st.write(f"**Estimated Delivery Time:** {order.get('eta', 'N/A')}")
-
-            delivery_partners = ["Partner A", "Partner B", "Partner C"] # Replace with your actual list
-            selected_partner = st.selectbox("Assign to", ["N/A"] + delivery_partners, key=f"partner_{order['id']}")
-
-            if st.button("Assign", key=f"assign_{order['id']}"):
-                st.session_state.orders_df.loc[st.session_state.orders_df['id'] == order['id'], 'assigned_to'] = selected_partner
-                st.session_state.orders_df.to_csv(DATA_FILE, index=False)
-                st.success(f"Order {order['id']} assigned to {selected_partner}")
-
-    st.header("Route Optimization & Automation")
-    if st.button("Optimize Routes"):
-        pending_orders = st.session_state.orders_df[st.session_state.orders_df['status'] == 'Pending']
-        if not pending_orders.empty:
-            st.write(pending_orders)
-            # The optimizer needs a depot and a list of stops.
-            # We'll use the first pending order's pickup as the depot.
-            depot = pending_orders.iloc[0][['lat_pick', 'lon_pick']].values.tolist()
-            
-            # All delivery locations will be the stops.
-            stops = pending_orders[['lat_drop', 'lon_drop']].values.tolist()
-            
-            # Combine depot and stops.
-            locations = [depot] + stops
-            
-            # Create a list of unique locations, preserving the depot as the first element.
-            unique_locations = []
-            for item in locations:
-                if item not in unique_locations:
-                    unique_locations.append(item)
-
-            optimized_route, total_distance = optimize_route(unique_locations)
-            if optimized_route:
-                st.success(f"Optimized route found!")
-                
-                # Display the optimized route using the actual coordinates
-                route_coords = [unique_locations[i] for i in optimized_route]
-                st.write("Optimized Route (sequence of coordinates):")
-                st.dataframe(pd.DataFrame(route_coords, columns=['Latitude', 'Longitude']))
-                
-                st.info(f"Total distance: {total_distance:.2f} km")
-                total_eta = get_estimated_delivery_time(total_distance)
-                st.info(f"Estimated delivery time for the entire route: {total_eta}")
-            else:
-                st.error("Could not optimize routes. Ensure you have at least one order.")
-        else:
-            st.warning("No pending orders to optimize.")
-
-    if st.button("Auto Assign Deliveries"):
-        pending_orders = st.session_state.orders_df[st.session_state.orders_df['status'] == 'Pending']
-        if not pending_orders.empty:
-            delivery_partners = ["Partner A", "Partner B", "Partner C"] # Replace with your actual list
-            if not delivery_partners:
-                st.warning("No delivery partners available to assign.")
-            else:
-                partner_index = 0
-                for index, order in pending_orders.iterrows():
-                    assigned_partner = delivery_partners[partner_index % len(delivery_partners)]
-                    st.session_state.orders_df.loc[st.session_state.orders_df['id'] == order['id'], 'assigned_to'] = assigned_partner
-                    partner_index += 1
-                st.session_state.orders_df.to_csv(DATA_FILE, index=False)
-                st.success(f"Successfully assigned {len(pending_orders)} pending orders to delivery partners.")
+                        st.error("Please provide both pickup and delivery addresses.")
+
+    # --- Tabs for Dashboard and Delivery Partner View ---
+    tabs = st.tabs(["MSME Dashboard", "Delivery Partner View"])
+
+    with tabs[0]:
+        st.header("Shipment Overview")
+        metric_cols = st.columns(len(ORDER_STATUSES) + 1)
+        metric_cols[0].metric("Total", store.count())
+        for metric_col, status in zip(metric_cols[1:], ORDER_STATUSES):
+            metric_col.metric(status, store.count(status=status))
+
+        st.subheader("Manage Shipments")
+        # Filtering and paging happen in the store, so only one page is ever rendered
+        filter_cols = st.columns(3)
+        with filter_cols[0]:
+            status_filter = st.multiselect("Status", ORDER_STATUSES, key="manage_status")
+        with filter_cols[1]:
+            partner_filter = st.multiselect("Assigned to", ["N/A"] + delivery_partners, key="manage_partner")
+        with filter_cols[2]:
+            created_range = st.date_input("Created between", value=(), key="manage_created")
+        filters = {
+            'status': status_filter or None,
+            'assigned_to': partner_filter or None,
+        }
+        if len(created_range) == 2:
+            filters['created_from'] = created_range[0]
+            filters['created_to'] = pd.Timestamp(created_range[1]) + pd.Timedelta(days=1)
+
+        limit, offset = paginate("manage", store.count(**filters))
+        page_orders = store.query(**filters, limit=limit, offset=offset)
+        edited_orders = st.data_editor(
+            page_orders,
+            key="manage_editor",
+            hide_index=True,
+            disabled=[column for column in page_orders.columns if column not in ('assigned_to', 'status')],
+            column_config={
+                'assigned_to': st.column_config.SelectboxColumn("Assigned to", options=["N/A"] + delivery_partners),
+                'status': st.column_config.SelectboxColumn("Status", options=ORDER_STATUSES),
+            },
+        )
+        if st.button("Save Changes", key="manage_save"):
+            saved, conflicts = save_edits(store, page_orders, edited_orders, ['assigned_to', 'status'])
+            show_save_result(saved, conflicts)
+            if not conflicts:
                 st.rerun()
-        else:
-            st.warning("No pending orders to auto-assign.")
-
-    # Clear Data Button
-    if st.button("Clear All Order Data"):
-        st.session_state.orders_df = pd.DataFrame(columns=['id', 'pickup_address', 'delivery_address', 'assigned_to', 'status', 'lat_pick', 'lon_pick', 'lat_drop', 'lon_drop', 'eta'])
-        st.session_state.orders_df.to_csv(DATA_FILE, index=False)
-        st.success("All order data cleared!")
-        st.rerun()
 
-with tabs[1]:
-    st.header("Delivery Partner View")
-    delivery_partners = ["Partner A", "Partner B", "Partner C"] # Replace with your actual list
-    selected_partner = st.selectbox("Select Delivery Partner", delivery_partners)
-
-    if selected_partner:
-        assigned_orders = st.session_state.orders_df[st.session_state.orders_df['assigned_to'] == selected_partner]
-        st.subheader(f"Assigned Orders for {selected_partner}")
-        st.dataframe(assigned_orders)
-
-        for index, order in assigned_orders.iterrows():
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.button(f"Update Status for Order {order['id']}"):
-                    new_status = st.selectbox("New Status", ["Picked Up", "Delivered"], key=f"status_{order['id']}")
-                    if new_status:
-                        update_order_status(order['id'], new_status)
-                        st.success(f"Order {order['id']} status updated to {new_status}")
-            with col2:
-                if st.button(f"Share Details for Order {order['id']}"):
-                    eta = order.get('eta', 'N/A')
-                    share_text = f"Your order from {order['pickup_address']} is on its way! It will be delivered to {order['delivery_address']} in approximately {eta} by our delivery partner, {order['assigned_to']}."
-                    st.text_area("Share this with the receiver:", share_text, key=f"share_{order['id']}")
+        st.header("Route Optimization & Automation")
+        budget_col, search_col, shift_col, service_col = st.columns(4)
+        with budget_col:
+            time_limit = st.number_input("Solver time budget (seconds)", min_value=1, max_value=300, value=10)
+        with search_col:
+            metaheuristic = st.selectbox("Local search", ["guided_local_search", "tabu_search", "simulated_annealing", "greedy_descent"])
+        with shift_col:
+            shift_start = st.time_input("Shift start", value=pd.Timestamp(DEFAULT_SHIFT_START).time())
+        with service_col:
+            service_minutes = st.number_input("Minutes per stop", min_value=0, max_value=120, value=DEFAULT_SERVICE_MINUTES)
+        quick_reoptimize = False
+        if runner.jobs.latest_id('plan_routes', status='done') is not None:
+            quick_reoptimize = st.checkbox("Quick re-optimize from the last plan", value=True,
+                                           help="Fit the changed orders into the last routes in a moment, "
+                                                "instead of searching for better routes for the whole time budget")
+
+        if st.button("Optimize Routes"):
+            pending_orders = st.session_state.orders_df[st.session_state.orders_df['status'] == 'Pending']
+            if pending_orders.empty:
+                st.warning("No pending orders to optimize.")
+            elif runner.jobs.latest('plan_routes', status=['queued', 'running']) is not None:
+                st.warning("An optimization is already running; its routes will appear below when it finishes.")
+            else:
+                # Solve for every partner at once, in a background worker so the page stays usable.
+                # Large order sets are split into geographic clusters solved in parallel.
+                # Start from the last plan's routes, if any, so small changes re-solve quickly.
+                last_plan = runner.jobs.latest('plan_routes', status='done')
+                solver_options = {'time_limit': time_limit, 'metaheuristic': metaheuristic}
+                if quick_reoptimize and last_plan:
+                    solver_options.update(time_limit=min(time_limit, QUICK_REOPTIMIZE_SECONDS),
+                                          solution_limit=QUICK_REOPTIMIZE_SOLUTIONS)
+                runner.submit_plan(
+                    pending_orders, delivery_partners,
+                    solver_options=solver_options,
+                    shift_start=shift_start_time(shift_start), service_minutes=service_minutes,
+                    warm_start=(last_plan['result']['routes'], last_plan['result']['nodes']) if last_plan else None,
+                    distance_model=distance_cache.signature,
+                )
+
+        # Progress of a running optimization, refreshed every second until it finishes
+        active_job = runner.jobs.latest('plan_routes', status=['queued', 'running'])
+        if active_job is not None:
+            st.fragment(run_every=1)(show_plan_progress)(runner, active_job['id'])
+
+        # The last finished plan is kept in the job store, so reruns show it without re-solving
+        finished_job = runner.jobs.latest('plan_routes', status=['done', 'failed'])
+        if finished_job is not None:
+            if finished_job['status'] == 'failed':
+                st.error(f"Could not optimize routes: {finished_job['error']}")
+            else:
+                plan = finished_job['result']
+                st.success(f"Optimized routes found! (planned {pd.Timestamp(finished_job['finished_at'], unit='s', tz='UTC').tz_convert(None):%Y-%m-%d %H:%M} UTC)")
+                for vehicle_id, (partner, route, route_distance) in enumerate(zip(plan['partners'], plan['routes'], plan['distances'])):
+                    if len(route) <= 2:
+                        continue
+                    # Display the optimized route using the actual coordinates
+                    stops = route_stops(plan, vehicle_id)
+                    st.write(f"Optimized Route for {partner} (sequence of stops):")
+                    st.dataframe(stops, hide_index=True)
+                    st.info(f"Distance for {partner}: {route_distance:.2f} km, last stop at {stops['ETA'].iloc[-1]}")
+                st.info(f"Total distance: {sum(plan['distances']):.2f} km")
+
+        partner_capacity = st.number_input("Max orders per partner (0 shares them out evenly)", min_value=0, value=0)
+        if st.button("Auto Assign Deliveries"):
+            pending_orders = st.session_state.orders_df[st.session_state.orders_df['status'] == 'Pending']
+            if not pending_orders.empty:
+                if not delivery_partners:
+                    st.warning("No delivery partners available to assign.")
+                else:
+                    # Nearest partner by pickup distance and load, solved for the whole batch at once
+                    assignments = auto_assign(st.session_state.orders_df, delivery_partners, capacity=partner_capacity or None)
+                    store.set_column('assigned_to', assignments)
+                    st.success(f"Successfully assigned {len(assignments)} of {len(pending_orders)} pending orders to delivery partners.")
+                    st.rerun()
+            else:
+                st.warning("No pending orders to auto-assign.")
+
+        # Clear Data Button
+        if st.button("Clear All Order Data"):
+            store.delete_all()
+            st.session_state.orders_df = pd.DataFrame(columns=ORDER_COLUMNS)
+            st.success("All order data cleared!")
+            st.rerun()
+
+    with tabs[1]:
+        st.header("Delivery Partner View")
+        selected_partner = st.selectbox("Select Delivery Partner", delivery_partners)
+
+        if selected_partner:
+            st.subheader(f"Assigned Orders for {selected_partner}")
+            partner_status_filter = st.multiselect("Status", ORDER_STATUSES, default=["Pending", "Picked Up"], key="partner_status")
+            partner_filters = {'assigned_to': selected_partner, 'status': partner_status_filter or None}
+
+            limit, offset = paginate("partner", store.count(**partner_filters))
+            assigned_orders = store.query(**partner_filters, limit=limit, offset=offset)
+            edited_orders = st.data_editor(
+                assigned_orders,
+                key="partner_editor",
+                hide_index=True,
+                disabled=[column for column in assigned_orders.columns if column != 'status'],
+                column_config={'status': st.column_config.SelectboxColumn("Status", options=ORDER_STATUSES)},
+            )
+            if st.button("Update Statuses", key="partner_save"):
+                saved, conflicts = save_edits(store, assigned_orders, edited_orders, ['status'])
+                show_save_result(saved, conflicts)
+                if not conflicts:
+                    st.rerun()
+
+            if not assigned_orders.empty:
+                share_order_id = st.selectbox("Share details for order", assigned_orders['id'], key="partner_share")
+                order = assigned_orders[assigned_orders['id'] == share_order_id].iloc[0]
+                eta = order.get('eta', 'N/A')
+                share_text = f"Your order from {order['pickup_address']} is on its way! It will be delivered to {order['delivery_address']} by our delivery partner, {order['assigned_to']}. Estimated delivery: {eta}."
+                st.text_area("Share this with the receiver:", share_text, key="share_text")
+
+            # Unassigned pickups close to where the partner's last active order is dropped
+            orders_df = st.session_state.orders_df
+            active = orders_df[(orders_df['assigned_to'] == selected_partner) & orders_df['status'].isin(["Pending", "Picked Up"])]
+            if not active.empty:
+                st.subheader(f"Unassigned pickups near {selected_partner}")
+                radius_km = st.number_input("Within (km)", min_value=0.5, max_value=50.0, value=3.0, step=0.5, key="nearby_radius")
+                last_drop = active[['lat_drop', 'lon_drop']].to_numpy()[-1]
+                nearby = sync_pickup_index(orders_version).within([last_drop], radius_km)[0]
+                if nearby:
+                    distances = pd.Series(dict(nearby), name='distance_km')
+                    # Another session may have moved the shared index on to a newer version
+                    distances = distances[distances.index.isin(orders_df['id'])]
+                    nearby_orders = orders_df.set_index('id').loc[distances.index, ['pickup_address', 'delivery_address']]
+                    st.dataframe(nearby_orders.assign(distance_km=distances.round(2)).rename_axis('id').reset_index(), hide_index=True)
+                else:
+                    st.caption(f"No unassigned pickups within {radius_km:g} km.")
+
+    # --- Diagnostics: where the time went (geocoding, storage, matrix builds, solver) ---
+    with st.expander("Diagnostics"):
+        st.caption("Includes the route optimization jobs run in the background worker, added as each one finishes.")
+        snapshot = metrics.snapshot()
+        if snapshot['spans']:
+            spans = pd.DataFrame.from_dict(snapshot['spans'], orient='index').rename_axis('span').reset_index()
+            spans['mean_seconds'] = spans['total_seconds'] / spans['count']
+            st.write("Timings")
+            st.dataframe(spans.sort_values('total_seconds', ascending=False), hide_index=True)
+        if snapshot['counters']:
+            st.write("Counters")
+            st.dataframe(pd.Series(snapshot['counters'], name='count').rename_axis('event').reset_index(), hide_index=True)
+        if snapshot['solver_runs']:
+            st.write("Recent solver runs")
+            st.dataframe(pd.DataFrame(snapshot['solver_runs']).drop(columns='at').iloc[::-1], hide_index=True)
+        if not any(snapshot[part] for part in ['spans', 'counters', 'solver_runs']):
+            st.info("Nothing recorded yet.")
+        st.download_button("Download metrics (Prometheus text)", metrics.prometheus_text(),
+                           file_name="metrics.txt", mime="text/plain")
+        if st.button("Reset diagnostics"):
+            metrics.reset()
+            st.rerun()
+
+# Job workers import this script again as their main module; only the app itself draws the page
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from optimizer import haversine_cross_matrix
+from instrumentation import increment, timed
+from spatial_index import SpatialIndex
+
+# Extra cost, in km of driving, of every order a partner is already carrying
+LOAD_PENALTY_KM = 1.0
+
+# Batches up to this many order x partner-slot cells are solved exactly as a
+# min-cost assignment; larger ones greedily, cheapest pairs first
+HUNGARIAN_MAX_CELLS = 1_000_000
+
+# Nearest partners each order of a large batch is offered to in the greedy
+# assignment; orders they have no room for look again among the rest
+CANDIDATE_PARTNERS = 8
+
+def distances_km(from_coordinates, to_coordinates):
+    """Haversine distance in km from every point to every other point, as floats."""
+    return haversine_cross_matrix(from_coordinates, to_coordinates, dtype=np.float64) / 1000.0
+
+def partner_positions(orders_df, partners):
+    """
+    Where each partner is and how much they carry, from the orders they have
+    picked up: their position is the drop of their most recent one (NaN if
+    they carry nothing). Returns (positions, loads) arrays aligned with `partners`.
+    """
+    carried = orders_df[orders_df['status'] == 'Picked Up']
+    positions = np.full((len(partners), 2), np.nan)
+    loads = np.zeros(len(partners), dtype=np.int64)
+    for row, partner in enumerate(partners):
+        orders = carried[carried['assigned_to'] == partner]
+        loads[row] = len(orders)
+        if len(orders):
+            positions[row] = orders[['lat_drop', 'lon_drop']].to_numpy(dtype=np.float64)[-1]
+    return positions, loads
+
+def seed_positions(positions, pickups):
+    """
+    Place partners without a position on pickups as far as possible from
+    every other partner (farthest-point seeding), so idle partners spread
+    over the area instead of all competing for the same orders.
+    """
+    positions = np.array(positions, dtype=np.float64)
+    pickups = np.asarray(pickups, dtype=np.float64).reshape(-1, 2)
+    missing = np.flatnonzero(np.isnan(positions).any(axis=1))
+    if not len(missing) or not len(pickups):
+        return positions
+    known = ~np.isnan(positions).any(axis=1)
+    if known.any():
+        nearest = distances_km(positions[known], pickups).min(axis=0)
+    else:
+        # Nobody placed yet: start from the pickup farthest from the batch centre
+        nearest = distances_km(pickups.mean(axis=0), pickups)[0]
+    for row in missing:
+        positions[row] = pickups[int(np.argmax(nearest))]
+        nearest = np.minimum(nearest, distances_km(positions[row], pickups)[0])
+    return positions
+
+def fair_capacity(num_orders, loads):
+    """Orders per partner, counting what they carry, if the batch is shared out evenly."""
+    return int(-(-(num_orders + int(np.sum(loads))) // len(loads)))
+
+def nearest_assignment(pickups, positions, loads, slots, load_penalty_km=LOAD_PENALTY_KM,
+                       candidates=CANDIDATE_PARTNERS):
+    """
+    Greedy assignment for batches too large to solve exactly: every order is
+    offered to its `candidates` nearest partners with room, found with a
+    spatial index, cheapest pairs first, until every order is placed or no
+    partner has room. Returns each order's partner index, -1 where none.
+    """
+    assigned = np.full(len(pickups), -1, dtype=np.int64)
+    remaining = np.asarray(slots, dtype=np.int64).copy()
+    # Few partners: rebuild the tree on every change rather than search a buffer
+    index = SpatialIndex(buffer_size=0)
+    with_room = np.flatnonzero(remaining > 0)
+    index.add(with_room.tolist(), positions[with_room])
+    waiting = np.arange(len(pickups))
+    while len(waiting) and len(index):
+        hits = index.nearest(pickups[waiting], k=candidates)
+        orders = np.repeat(waiting, [len(found) for found in hits])
+        partners = np.array([partner for found in hits for partner, _ in found], dtype=np.int64)
+        costs = np.array([distance for found in hits for _, distance in found]) + load_penalty_km * loads[partners]
+        # The cheapest pair always has room, so every round places an order
+        for pair in np.argsort(costs, kind='stable'):
+            order, partner = orders[pair], partners[pair]
+            if assigned[order] < 0 and remaining[partner] > 0:
+                assigned[order] = partner
+                remaining[partner] -= 1
+                if not remaining[partner]:
+                    index.remove([int(partner)])
+        waiting = waiting[assigned[waiting] < 0]
+    return assigned
+
+@timed()
+def assign_orders(pickups, positions, loads, capacity=None, load_penalty_km=LOAD_PENALTY_KM):
+    """
+    Assign orders to partners at least total cost: the distance from the
+    partner's position to the pickup, plus `load_penalty_km` for every order
+    they carry, with at most `capacity` orders per partner (default: an even
+    share). Returns each order's partner index, -1 where no partner has room.
+    Large batches are assigned greedily among each order's nearest partners.
+    """
+    pickups = np.asarray(pickups, dtype=np.float64).reshape(-1, 2)
+    loads = np.asarray(loads, dtype=np.int64)
+    if capacity is None:
+        capacity = fair_capacity(len(pickups), loads)
+    slots = np.maximum(capacity - loads, 0)
+    assigned = np.full(len(pickups), -1, dtype=np.int64)
+    if not len(pickups) or not slots.sum():
+        return assigned
+    positions = seed_positions(positions, pickups)
+
+    if len(pickups) * min(int(slots.sum()), len(pickups)) <= HUNGARIAN_MAX_CELLS:
+        costs = distances_km(positions, pickups).T + load_penalty_km * loads
+        # One column per free slot of every partner (no more than there are orders)
+        slots = np.minimum(slots, len(pickups))
+        columns = np.repeat(np.arange(len(slots)), slots)
+        rows, slot_columns = linear_sum_assignment(costs[:, columns])
+        assigned[rows] = columns[slot_columns]
+    else:
+        assigned = nearest_assignment(pickups, positions, loads, slots, load_penalty_km)
+    increment('orders_auto_assigned', int((assigned >= 0).sum()))
+    return assigned
+
+def auto_assign(orders_df, partners, capacity=None, load_penalty_km=LOAD_PENALTY_KM):
+    """
+    Assign every pending order to a delivery partner by distance and load.
+    Returns {order_id: partner} for the orders that could be assigned.
+    """
+    pending = orders_df[orders_df['status'] == 'Pending']
+    if pending.empty or not partners:
+        return {}
+    positions, loads = partner_positions(orders_df, partners)
+    assigned = assign_orders(pending[['lat_pick', 'lon_pick']].to_numpy(dtype=np.float64), positions, loads,
+                             capacity=capacity, load_penalty_km=load_penalty_km)
+    partners = np.asarray(partners, dtype=object)
+    routed = assigned >= 0
+    return dict(zip(pending['id'].to_numpy()[routed], partners[assigned[routed]]))
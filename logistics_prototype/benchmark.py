@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+from ortools import __version__ as ortools_version
+from optimizer import (create_data_model, create_pickup_delivery_data_model, create_routing_model,
+                       get_routes, haversine_matrix, set_matrix_provider, solve)
+from clustering import DEFAULT_MAX_CLUSTER_SIZE, plan_clustered_routes
+
+# Get the absolute path to the directory benchmark results are written to
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'benchmarks')
+
+# Industrial areas orders are picked up around (from add_problematic_orders.py)
+INDUSTRIAL_AREAS = {
+    'Bawana': (28.7982, 77.03431),
+    'Narela': (28.832652, 77.099613),
+    'Mayapuri': (28.6333498, 77.1270148),
+    'Patparganj': (28.637063, 77.307978),
+    'Okhla': (28.53068, 77.272406),
+}
+
+# Centre and spread (km, one standard deviation) of drops across Delhi-NCR
+DELHI_CENTRE = (28.6139, 77.2090)
+DROP_SPREAD_KM = 10.0
+
+# Spread (km) of pickups around their industrial area
+PICKUP_SPREAD_KM = 1.5
+
+KM_PER_DEGREE = 111.32
+
+DEFAULT_SIZES = [100, 500, 1000, 2000]
+DEFAULT_TIME_BUDGETS = [1, 5]
+DEFAULT_VEHICLES = 5
+
+# Single-vehicle route benchmarks above this many stops are skipped; the
+# matrix alone grows quadratically (20,000 stops take 1.6 GB)
+DEFAULT_MAX_ROUTE_STOPS = 2000
+
+def scatter(rng, centres, spread_km):
+    """Points normally distributed `spread_km` around each [lat, lon] centre."""
+    centres = np.asarray(centres, dtype=np.float64).reshape(-1, 2)
+    offsets = rng.normal(scale=spread_km / KM_PER_DEGREE, size=centres.shape)
+    offsets[:, 1] /= np.cos(np.radians(centres[:, 0]))
+    return centres + offsets
+
+def generate_orders(num_orders, seed=0):
+    """
+    Reproducible synthetic orders: pickups clustered around the industrial
+    areas, drops spread across Delhi-NCR.
+    Returns parallel lists of pickup and drop [lat, lon] coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    areas = np.array(list(INDUSTRIAL_AREAS.values()))
+    pickups = scatter(rng, areas[rng.integers(len(areas), size=num_orders)], PICKUP_SPREAD_KM)
+    drops = scatter(rng, np.repeat([DELHI_CENTRE], num_orders, axis=0), DROP_SPREAD_KM)
+    return pickups.round(6).tolist(), drops.round(6).tolist()
+
+def generate_stops(num_stops, seed=0):
+    """Reproducible synthetic stops for single-route benchmarks (depot first)."""
+    pickups, drops = generate_orders(-(-num_stops // 2), seed)
+    stops = [location for pair in zip(pickups, drops) for location in pair]
+    return stops[:num_stops]
+
+class StageTimer:
+    """Wall-clock seconds spent in named stages."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def time(self, stage, function, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+
+def timed_matrix_provider(timer, provider=haversine_matrix):
+    """Matrix provider that books its time to the 'matrix' stage."""
+    return lambda addresses: timer.time('matrix', provider, addresses)
+
+def run_model(timer, build_model, solver_options):
+    """Build, solve and extract one model, timing each stage. Returns (cost_km, status)."""
+    previous = set_matrix_provider(timed_matrix_provider(timer))
+    try:
+        data = timer.time('model', build_model)
+    finally:
+        set_matrix_provider(previous)
+    # The matrix is built inside the data model; report it on its own
+    timer.seconds['model'] -= timer.seconds.get('matrix', 0.0)
+
+    manager, routing = timer.time('model', create_routing_model, data)
+    solution = timer.time('solve', solve, data, manager, routing, solver_options)
+    if not solution:
+        return None, 'no_solution'
+    routes, distances = timer.time('extract', get_routes, data, manager, routing, solution)
+    return sum(distances), 'ok'
+
+def benchmark_route(num_stops, time_limit, seed=0, solver_options=None):
+    """Benchmark a single-vehicle route (optimize_route) over `num_stops` stops."""
+    stops = generate_stops(num_stops, seed)
+    solver_options = dict(solver_options or {}, time_limit=time_limit)
+    timer = StageTimer()
+    cost, status = run_model(timer, lambda: create_data_model(stops), solver_options)
+    return {'workload': 'route', 'stops': num_stops, 'orders': None, 'vehicles': 1,
+            'cost_km': cost, 'status': status, **stage_results(timer)}
+
+def benchmark_pickup_delivery(num_stops, time_limit, num_vehicles=DEFAULT_VEHICLES, seed=0,
+                              solver_options=None, max_cluster_size=DEFAULT_MAX_CLUSTER_SIZE, processes=None):
+    """
+    Benchmark pickup-and-delivery planning for `num_stops` / 2 orders.
+    Order sets that fit in one model are timed stage by stage; larger ones go
+    through plan_clustered_routes and only the total is timed.
+    """
+    num_orders = max(1, num_stops // 2)
+    pickups, drops = generate_orders(num_orders, seed)
+    solver_options = dict(solver_options or {}, time_limit=time_limit)
+    timer = StageTimer()
+    if num_orders <= max_cluster_size:
+        cost, status = run_model(timer, lambda: create_pickup_delivery_data_model(
+            pickups, drops, num_vehicles=num_vehicles), solver_options)
+        workload = 'pickup_delivery'
+    else:
+        routes, distances, _ = timer.time('total', plan_clustered_routes, pickups, drops, num_vehicles,
+                                          max_cluster_size=max_cluster_size, solver_options=solver_options,
+                                          processes=processes)
+        cost, status = (sum(distances), 'ok') if routes else (None, 'no_solution')
+        workload = 'clustered'
+    return {'workload': workload, 'stops': 2 * num_orders, 'orders': num_orders, 'vehicles': num_vehicles,
+            'cost_km': cost, 'status': status, **stage_results(timer)}
+
+def stage_results(timer):
+    """Stage timings as result fields, plus the total."""
+    seconds = timer.seconds
+    total = seconds.get('total', sum(seconds.values()))
+    return {
+        'matrix_seconds': seconds.get('matrix'),
+        'model_seconds': seconds.get('model'),
+        'solve_seconds': seconds.get('solve'),
+        'extract_seconds': seconds.get('extract'),
+        'total_seconds': total,
+    }
+
+def code_version():
+    """Git commit of the working tree, if available."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes=DEFAULT_SIZES, time_budgets=DEFAULT_TIME_BUDGETS, workloads=('route', 'pickup_delivery'),
+                   num_vehicles=DEFAULT_VEHICLES, seed=0, solver_options=None,
+                   max_route_stops=DEFAULT_MAX_ROUTE_STOPS, processes=None, progress=print):
+    """Run every workload for every size and time budget. Returns the report dict."""
+    results = []
+    for workload in workloads:
+        for num_stops in sizes:
+            for time_limit in time_budgets:
+                if workload == 'route' and num_stops > max_route_stops:
+                    continue
+                if workload == 'route':
+                    result = benchmark_route(num_stops, time_limit, seed, solver_options)
+                else:
+                    result = benchmark_pickup_delivery(num_stops, time_limit, num_vehicles, seed,
+                                                       solver_options, processes=processes)
+                result.update(seed=seed, time_limit=time_limit,
+                              stops_per_second=result['stops'] / result['total_seconds'] if result['total_seconds'] else None)
+                results.append(result)
+                if progress is not None:
+                    cost = f"{result['cost_km']:.1f} km" if result['cost_km'] is not None else result['status']
+                    progress(f"{result['workload']:>15} {result['stops']:>6} stops, {time_limit:>4}s budget: "
+                             f"{result['total_seconds']:.2f}s total, {cost}")
+    return {
+        'version': code_version(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'ortools': ortools_version,
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'solver_options': solver_options or {},
+        'results': results,
+    }
+
+def compare_reports(baseline, current):
+    """
+    Pair up results of two reports by workload, size and time budget.
+    Returns rows with the relative change in total time and route cost
+    (positive means slower or longer routes).
+    """
+    def key(result):
+        return result['workload'], result['stops'], result['vehicles'], result['time_limit'], result['seed']
+
+    baseline_results = {key(result): result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        before = baseline_results.get(key(result))
+        if before is None:
+            continue
+        row = {'workload': result['workload'], 'stops': result['stops'], 'time_limit': result['time_limit']}
+        for field in ['total_seconds', 'cost_km']:
+            if before[field] and result[field] is not None:
+                row[f'{field}_change'] = result[field] / before[field] - 1
+            else:
+                row[f'{field}_change'] = None
+        rows.append(row)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the route optimizer on synthetic Delhi-NCR orders.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="stop counts to benchmark")
+    parser.add_argument('--budgets', type=float, nargs='+', default=DEFAULT_TIME_BUDGETS, help="solver time budgets in seconds")
+    parser.add_argument('--workloads', nargs='+', default=['route', 'pickup_delivery'], choices=['route', 'pickup_delivery'])
+    parser.add_argument('--vehicles', type=int, default=DEFAULT_VEHICLES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--metaheuristic', default=None, help="e.g. guided_local_search")
+    parser.add_argument('--max-route-stops', type=int, default=DEFAULT_MAX_ROUTE_STOPS)
+    parser.add_argument('--processes', type=int, default=None, help="worker processes for clustered solves")
+    parser.add_argument('--output', default=None, help="JSON file to write (default: data/benchmarks/<time>.json)")
+    parser.add_argument('--compare', default=None, help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    solver_options = {'metaheuristic': args.metaheuristic} if args.metaheuristic else None
+    report = run_benchmarks(args.sizes, args.budgets, args.workloads, args.vehicles, args.seed,
+                            solver_options, args.max_route_stops, args.processes)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Wrote {len(report['results'])} results to {output}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        for row in compare_reports(baseline, report):
+            changes = ', '.join(
+                f"{field.replace('_change', '')} {row[field]:+.1%}" for field in ['total_seconds_change', 'cost_km_change']
+                if row[field] is not None
+            )
+            print(f"{row['workload']:>15} {row['stops']:>6} stops, {row['time_limit']:>4}s budget: {changes}")
+
+if __name__ == "__main__":
+    main()
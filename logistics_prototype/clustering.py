@@ -0,0 +1,189 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import math
+from optimizer import build_distance_matrix, optimize_pickup_delivery
+from instrumentation import metrics, timed
+
+# Largest number of orders solved in a single OR-Tools model
+DEFAULT_MAX_CLUSTER_SIZE = 300
+
+# Lloyd iterations used by kmeans_partition
+DEFAULT_KMEANS_ITERATIONS = 20
+
+def kmeans_partition(coordinates, num_clusters, max_cluster_size=None,
+                     iterations=DEFAULT_KMEANS_ITERATIONS, seed=0):
+    """
+    Split [lat, lon] points into `num_clusters` geographic clusters with k-means.
+    With `max_cluster_size`, every point goes to the nearest cluster that still
+    has room, so no cluster grows beyond it.
+    Returns the cluster label of every point.
+    """
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    num_points = len(points)
+    num_clusters = max(1, min(num_clusters, num_points))
+    if max_cluster_size is not None and max_cluster_size * num_clusters < num_points:
+        raise ValueError("max_cluster_size is too small to fit every point in num_clusters clusters")
+
+    # Scale longitude so a degree east counts as much as a degree north
+    scaled = points * [1.0, math.cos(math.radians(points[:, 0].mean()))]
+    rng = np.random.default_rng(seed)
+    centroids = scaled[rng.choice(num_points, num_clusters, replace=False)]
+
+    labels = np.zeros(num_points, dtype=np.int64)
+    for _ in range(iterations):
+        distances = ((scaled[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+        if max_cluster_size is None:
+            labels = distances.argmin(axis=1)
+        else:
+            labels = balanced_assignment(distances, max_cluster_size)
+
+        new_centroids = centroids.copy()
+        counts = np.bincount(labels, minlength=num_clusters)
+        for axis in range(2):
+            sums = np.bincount(labels, weights=scaled[:, axis], minlength=num_clusters)
+            np.divide(sums, counts, out=new_centroids[:, axis], where=counts > 0)
+        if np.allclose(new_centroids, centroids):
+            break
+        centroids = new_centroids
+    return labels
+
+def balanced_assignment(distances, capacity):
+    """
+    Assign every point (row) to a cluster (column) without exceeding `capacity`
+    points per cluster. Points that lose the most by missing their nearest
+    cluster choose first.
+    """
+    preferences = np.argsort(distances, axis=1)
+    if distances.shape[1] > 1:
+        ordered = np.take_along_axis(distances, preferences[:, :2], axis=1)
+        regret = ordered[:, 1] - ordered[:, 0]
+    else:
+        regret = np.zeros(len(distances))
+
+    labels = np.empty(len(distances), dtype=np.int64)
+    counts = np.zeros(distances.shape[1], dtype=np.int64)
+    for point in np.argsort(-regret):
+        for cluster in preferences[point]:
+            if counts[cluster] < capacity:
+                labels[point] = cluster
+                counts[cluster] += 1
+                break
+    return labels
+
+def _solve_cluster(pickups, drops, solver_options, vehicle_capacity=None):
+    """Solve one cluster with a single vehicle (runs in a worker process)."""
+    routes, distances, nodes = optimize_pickup_delivery(pickups, drops, num_vehicles=1, solver_options=solver_options,
+                                                        vehicle_capacities=vehicle_capacity)
+    if routes is None:
+        return None, None, None
+    return routes[0], distances[0], nodes
+
+def _solve_cluster_with_metrics(*job):
+    """_solve_cluster in a pool process, returning what it recorded so the caller can keep it."""
+    metrics.reset()
+    return _solve_cluster(*job), metrics.snapshot()
+
+@timed()
+def plan_clustered_routes(pickups, drops, num_vehicles, max_cluster_size=DEFAULT_MAX_CLUSTER_SIZE,
+                          solver_options=None, processes=None, warm_start=None,
+                          solution_callback=None, progress_callback=None, max_orders_per_vehicle=None,
+                          vehicle_capacities=None):
+    """
+    Solve the Pickup and Delivery Problem for city-scale order volumes.
+    Orders are clustered by drop location into the same number of clusters per
+    vehicle, of equal size and no more than `max_cluster_size` orders each, so
+    every vehicle gets an equal share of the orders. Clusters are solved
+    independently across a process pool, then each vehicle's clusters are
+    chained into one route. Each cluster is solved within the capacity (orders
+    on board at once) of the vehicle it is handed to.
+    Returns the same (routes, distances, nodes) as optimize_pickup_delivery.
+    `max_orders_per_vehicle` (default: an even share) applies to a single
+    model; clusters are handed out evenly anyway.
+    `warm_start` and `solution_callback` only apply when the orders fit in a
+    single model; otherwise `progress_callback(done, total)` is called as each
+    cluster is solved.
+    """
+    num_orders = len(pickups)
+    if num_orders <= max_cluster_size or num_vehicles < 1:
+        # Small enough to solve as one model
+        return optimize_pickup_delivery(pickups, drops, num_vehicles=num_vehicles,
+                                        solver_options=solver_options, warm_start=warm_start,
+                                        solution_callback=solution_callback,
+                                        max_orders_per_vehicle=max_orders_per_vehicle,
+                                        vehicle_capacities=vehicle_capacities)
+
+    # Round up to whole clusters per vehicle, then fill them evenly
+    clusters_per_vehicle = -(-num_orders // (max_cluster_size * num_vehicles))
+    num_clusters = min(num_orders, clusters_per_vehicle * num_vehicles)
+    labels = kmeans_partition(drops, num_clusters, max_cluster_size=-(-num_orders // num_clusters))
+    members = [np.flatnonzero(labels == cluster) for cluster in range(num_clusters)]
+    members = [orders for orders in members if len(orders)]
+
+    # Hand the biggest clusters out first, each to the least loaded vehicle
+    vehicle_clusters = [[] for _ in range(num_vehicles)]
+    vehicle_loads = [0] * num_vehicles
+    cluster_vehicles = [None] * len(members)
+    for cluster in sorted(range(len(members)), key=lambda cluster: -len(members[cluster])):
+        vehicle_id = vehicle_loads.index(min(vehicle_loads))
+        vehicle_clusters[vehicle_id].append(cluster)
+        vehicle_loads[vehicle_id] += len(members[cluster])
+        cluster_vehicles[cluster] = vehicle_id
+    if vehicle_capacities is not None and not isinstance(vehicle_capacities, (list, tuple)):
+        vehicle_capacities = [vehicle_capacities] * num_vehicles
+
+    # Solve every cluster in parallel, each within its vehicle's capacity
+    jobs = [([pickups[order] for order in orders], [drops[order] for order in orders], solver_options,
+             vehicle_capacities[cluster_vehicles[cluster]] if vehicle_capacities is not None else None)
+            for cluster, orders in enumerate(members)]
+    results = [None] * len(jobs)
+    if len(jobs) == 1 or processes == 1:
+        for done, job in enumerate(jobs, 1):
+            results[done - 1] = _solve_cluster(*job)
+            if progress_callback is not None:
+                progress_callback(done, len(jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {executor.submit(_solve_cluster_with_metrics, *job): cluster for cluster, job in enumerate(jobs)}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]], cluster_metrics = future.result()
+                metrics.merge(cluster_metrics)
+                if progress_callback is not None:
+                    progress_callback(done, len(jobs))
+    if any(route is None for route, _, _ in results):
+        return None, None, None
+
+    # Merge the cluster routes onto one node list with a shared virtual depot
+    nodes = [{'type': 'depot', 'location': list(pickups[0]), 'orders': []}]
+    routes = []
+    distances = []
+    # Where each vehicle leaves one cluster for the next, as (last stop, first stop)
+    links = []
+    for clusters in vehicle_clusters:
+        route = [0]
+        route_distance = 0.0
+        for cluster in clusters:
+            cluster_route, cluster_distance, cluster_nodes = results[cluster]
+            stops = []
+            for node in cluster_route[1:-1]:
+                nodes.append({
+                    'type': cluster_nodes[node]['type'],
+                    'location': cluster_nodes[node]['location'],
+                    'pair_location': cluster_nodes[node].get('pair_location'),
+                    'orders': [int(members[cluster][order]) for order in cluster_nodes[node]['orders']],
+                })
+                stops.append(len(nodes) - 1)
+            if len(route) > 1 and stops:
+                links.append((len(routes), route[-1], stops[0]))
+            route += stops
+            route_distance += cluster_distance
+        routes.append(route + [0])
+        distances.append(route_distance)
+
+    if links:
+        # Travel from each cluster's last stop to the next one's first, on the
+        # same distances (road or straight-line) the clusters were solved with
+        link_matrix = build_distance_matrix([nodes[stop]['location'] for _, last, first in links
+                                             for stop in (last, first)])
+        for link, (vehicle_id, _, _) in enumerate(links):
+            distances[vehicle_id] += link_matrix[2 * link, 2 * link + 1] / 1000.0
+    return routes, distances, nodes
@@ -0,0 +1,228 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+from optimizer import build_distance_matrix, cheapest_insertion, cheapest_pair_insertion
+from eta import DEFAULT_SERVICE_MINUTES, format_eta, route_arrival_times
+from instrumentation import increment, timed
+from jobs import JobStore
+
+# Time the local search may spend on a changed route, in seconds
+DEFAULT_LOCAL_SEARCH_SECONDS = 0.05
+
+# Order statuses after which an order's pickup, or its drop, is no longer visited
+PICKED_UP_STATUSES = ('Picked Up', 'Delivered')
+DELIVERED_STATUSES = ('Delivered',)
+
+def route_length(distance_matrix, depot, route):
+    """Distance driven along a route (stops only, no depot)."""
+    stops = [depot] + list(route) + [depot]
+    return sum(distance_matrix[previous_node][next_node] for previous_node, next_node in zip(stops, stops[1:]))
+
+def improve_route(distance_matrix, depot, route, pairs, deadline):
+    """
+    Bounded local search on one route: move single stops to their cheapest
+    position, keeping every pickup before its drop (`pairs` maps pickup to
+    drop), until no move helps or `deadline` (time.perf_counter()) passes.
+    Returns the improved route.
+    """
+    route = list(route)
+    drop_pickups = {drop: pickup for pickup, drop in pairs.items()}
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for stop in list(route):
+            if time.perf_counter() >= deadline:
+                break
+            position = route.index(stop)
+            previous_node = route[position - 1] if position > 0 else depot
+            next_node = route[position + 1] if position + 1 < len(route) else depot
+            gain = (distance_matrix[previous_node][stop] + distance_matrix[stop][next_node]
+                    - distance_matrix[previous_node][next_node])
+            rest = route[:position] + route[position + 1:]
+            start = rest.index(drop_pickups[stop]) + 1 if stop in drop_pickups else 0
+            end = rest.index(pairs[stop]) if stop in pairs else None
+            cost, new_position = cheapest_insertion(distance_matrix, depot, rest, stop, start, end)
+            if cost < gain:
+                rest.insert(new_position, stop)
+                route = rest
+                improved = True
+    return route
+
+class Dispatcher:
+    """
+    Keeps the routes of the latest plan in memory and updates them as the
+    day goes on: new orders are inserted into the partner route where they
+    add the least distance, finished stops are dropped, and only the changed
+    route gets a short local search and fresh ETAs. Changes are written back
+    to the plan's job, so the app shows the current routes.
+    """
+
+    def __init__(self, plan, job_id=None, jobs=None, matrix_provider=build_distance_matrix,
+                 local_search_seconds=DEFAULT_LOCAL_SEARCH_SECONDS):
+        self.plan = plan
+        self.job_id = job_id
+        self.jobs = jobs
+        self.matrix_provider = matrix_provider
+        self.local_search_seconds = local_search_seconds
+        self._positions = {order_id: position for position, order_id in enumerate(plan['order_ids'])}
+        self._statuses = {}
+        self._lock = threading.Lock()
+
+    def _route_matrix(self, stops):
+        """Distances between a route's stops, behind a virtual depot at zero distance from all of them."""
+        matrix = np.zeros((len(stops) + 1, len(stops) + 1), dtype=np.int64)
+        if stops:
+            matrix[1:, 1:] = self.matrix_provider([self.plan['nodes'][node]['location'] for node in stops])
+        return matrix
+
+    @timed('dispatch.add_order')
+    def add_order(self, order_id, pickup, drop):
+        """
+        Insert a new order into the partner route where it adds the least
+        distance. Returns (order_id, {'assigned_to', 'eta'}) updates for every
+        order on the changed route.
+        """
+        with self._lock:
+            plan = self.plan
+            position = len(plan['order_ids'])
+            plan['order_ids'].append(order_id)
+            plan['assigned_to'].append(None)
+            plan['eta'].append('N/A')
+            self._positions[order_id] = position
+            pickup_node = len(plan['nodes'])
+            plan['nodes'].append({'type': 'pickup', 'location': list(pickup), 'pair_location': list(drop), 'orders': [position]})
+            plan['nodes'].append({'type': 'delivery', 'location': list(drop), 'pair_location': list(pickup), 'orders': [position]})
+
+            best = None
+            for vehicle_id, route in enumerate(plan['routes']):
+                stops = route[1:-1]
+                matrix = self._route_matrix(stops + [pickup_node, pickup_node + 1])
+                cost, pickup_position, drop_position = cheapest_pair_insertion(
+                    matrix, 0, list(range(1, len(stops) + 1)), len(stops) + 1, len(stops) + 2)
+                if best is None or cost < best[0]:
+                    best = (cost, vehicle_id, pickup_position, drop_position)
+            _, vehicle_id, pickup_position, drop_position = best
+            stops = plan['routes'][vehicle_id][1:-1]
+            stops.insert(pickup_position, pickup_node)
+            stops.insert(drop_position + 1, pickup_node + 1)
+            increment('dispatch_orders_inserted')
+            updates = self._reroute(vehicle_id, stops)
+            self._save()
+            return updates
+
+    @timed('dispatch.set_statuses')
+    def set_statuses(self, statuses):
+        """
+        Drop the stops of orders that are done ('Picked Up' or 'Delivered',
+        from a {order_id: status} mapping) from their routes. Returns updates
+        for the orders still on the changed routes.
+        """
+        with self._lock:
+            nodes = self.plan['nodes']
+            changed = set()
+            for order_id, status in statuses.items():
+                position = self._positions.get(order_id)
+                if position is not None:
+                    self._statuses[position] = status
+                    changed.add(position)
+
+            def is_done(node):
+                finished = PICKED_UP_STATUSES if nodes[node]['type'] == 'pickup' else DELIVERED_STATUSES
+                return all(self._statuses.get(order) in finished for order in nodes[node]['orders'])
+
+            updates = []
+            rerouted = False
+            for vehicle_id, route in enumerate(self.plan['routes']):
+                if not any(changed.intersection(nodes[node]['orders']) for node in route[1:-1]):
+                    continue
+                stops = [node for node in route[1:-1] if not is_done(node)]
+                if len(stops) < len(route) - 2:
+                    increment('dispatch_stops_completed', len(route) - 2 - len(stops))
+                    updates += self._reroute(vehicle_id, stops)
+                    rerouted = True
+            if rerouted:
+                self._save()
+            return updates
+
+    def _reroute(self, vehicle_id, stops):
+        """Local search, distance and ETAs for one changed route."""
+        plan = self.plan
+        nodes = plan['nodes']
+        matrix = self._route_matrix(stops)
+        local_route = list(range(1, len(stops) + 1))
+
+        # A pickup and its drop share the same orders
+        drop_of = {tuple(nodes[node]['orders']): local for local, node in zip(local_route, stops)
+                   if nodes[node]['type'] == 'delivery'}
+        pairs = {local: drop_of[tuple(nodes[node]['orders'])] for local, node in zip(local_route, stops)
+                 if nodes[node]['type'] == 'pickup' and tuple(nodes[node]['orders']) in drop_of}
+        local_route = improve_route(matrix, 0, local_route, pairs, time.perf_counter() + self.local_search_seconds)
+        stops = [stops[local - 1] for local in local_route]
+
+        plan['routes'][vehicle_id] = [0] + stops + [0]
+        plan['distances'][vehicle_id] = float(route_length(matrix, 0, local_route)) / 1000
+        # The rest of the route starts now, or at the shift start if that's later
+        start = max(pd.Timestamp(plan['shift_start']), pd.Timestamp.now())
+        arrivals = route_arrival_times([plan['routes'][vehicle_id]], nodes, shift_start=start,
+                                       service_minutes=plan.get('service_minutes', DEFAULT_SERVICE_MINUTES),
+                                       matrix_provider=self.matrix_provider)[0]
+        stop_etas = format_eta(arrivals)
+        plan['stop_etas'][vehicle_id] = list(stop_etas)
+
+        partner = plan['partners'][vehicle_id]
+        updates = {}
+        for node, eta in zip(stops, stop_etas):
+            for order in nodes[node]['orders']:
+                plan['assigned_to'][order] = partner
+                if nodes[node]['type'] == 'delivery':
+                    plan['eta'][order] = eta
+                updates[plan['order_ids'][order]] = {'assigned_to': partner, 'eta': plan['eta'][order]}
+        return list(updates.items())
+
+    def _save(self):
+        """Write the current routes back to the plan's job."""
+        if self.jobs is not None and self.job_id is not None:
+            self.jobs.update(self.job_id, result=self.plan)
+
+_default_dispatcher = None
+_default_jobs = None
+_default_dispatcher_lock = threading.Lock()
+
+def get_default_dispatcher():
+    """
+    Shared Dispatcher over the latest finished route plan, reloaded when a
+    newer plan finishes. None if no plan has been made yet.
+    """
+    global _default_dispatcher, _default_jobs
+    with _default_dispatcher_lock:
+        if _default_jobs is None:
+            _default_jobs = JobStore()
+        job_id = _default_jobs.latest_id('plan_routes', status='done')
+        if job_id is None:
+            return None
+        if _default_dispatcher is None or _default_dispatcher.job_id != job_id:
+            job = _default_jobs.get(job_id)
+            _default_dispatcher = Dispatcher(job['result'], job_id=job_id, jobs=_default_jobs)
+        return _default_dispatcher
+
+def dispatch_new_order(store, order_id, pickup, drop, dispatcher=None):
+    """
+    Route a new order into the current plan (the default dispatcher's unless
+    one is given) and save the changed assignments and ETAs; returns its partner.
+    """
+    dispatcher = get_default_dispatcher() if dispatcher is None else dispatcher
+    if dispatcher is None:
+        return None
+    updates = dispatcher.add_order(order_id, pickup, drop)
+    store.update_orders(updates)
+    return dict(updates).get(order_id, {}).get('assigned_to')
+
+def dispatch_status_changes(store, statuses, dispatcher=None):
+    """Re-route after order status changes ({order_id: status}) and save the new ETAs."""
+    dispatcher = get_default_dispatcher() if dispatcher is None else dispatcher
+    if dispatcher is None:
+        return
+    updates = dispatcher.set_statuses(statuses)
+    if updates:
+        store.update_orders(updates)
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+from optimizer import haversine_vector
+
+# Average Delhi traffic speed (km/h) for each hour of the day, slowest in the
+# morning and evening peaks
+HOURLY_SPEED_KMPH = np.array([
+    35, 35, 35, 35, 35, 32,   # 00:00 - 06:00
+    28, 20, 16, 16, 20, 24,   # 06:00 - 12:00
+    24, 24, 22, 20, 18, 15,   # 12:00 - 18:00
+    15, 16, 20, 26, 30, 33,   # 18:00 - 24:00
+], dtype=np.float64)
+
+# Time spent at every pickup and drop, in minutes
+DEFAULT_SERVICE_MINUTES = 5
+
+# When delivery partners start their shift
+DEFAULT_SHIFT_START = '09:00'
+
+# Format of the ETAs stored with orders and shared with receivers
+ETA_FORMAT = '%Y-%m-%d %H:%M'
+
+SECONDS_PER_HOUR = 3600
+
+def travel_seconds(departure_seconds, distances_km, speed_profile=HOURLY_SPEED_KMPH):
+    """
+    Time-dependent travel time, in seconds, for arrays of departures (seconds
+    since midnight) and distances. Each trip moves at the speed of the hour it
+    is in, so a trip that runs into the evening peak slows down.
+    """
+    speeds = np.asarray(speed_profile, dtype=np.float64) / SECONDS_PER_HOUR
+    departure = np.asarray(departure_seconds, dtype=np.float64)
+    remaining = np.asarray(distances_km, dtype=np.float64)
+    departure, remaining = np.broadcast_arrays(departure, remaining)
+    clock = departure.copy()
+    remaining = np.nan_to_num(remaining, nan=0.0)
+    # Step hour by hour, with every unfinished trip moving at once
+    while (remaining > 0).any():
+        speed = speeds[(clock // SECONDS_PER_HOUR).astype(np.int64) % len(speeds)]
+        to_next_hour = SECONDS_PER_HOUR - clock % SECONDS_PER_HOUR
+        reachable = speed * to_next_hour
+        finishes = remaining <= reachable
+        clock = clock + np.where(remaining > 0, np.where(finishes, remaining / speed, to_next_hour), 0.0)
+        remaining = np.where(finishes, 0.0, remaining - reachable)
+    return clock - departure
+
+def stop_arrival_seconds(leg_km, start_seconds, service_minutes=DEFAULT_SERVICE_MINUTES,
+                         speed_profile=HOURLY_SPEED_KMPH):
+    """
+    Arrival time at every stop of many routes at once.
+    `leg_km` is a routes x stops array of the distance driven to reach each
+    stop (NaN after a route's last stop); `start_seconds` is when each route
+    leaves, in seconds since midnight. Returns arrivals in seconds since
+    midnight, NaN where there is no stop.
+    """
+    leg_km = np.atleast_2d(np.asarray(leg_km, dtype=np.float64))
+    clock = np.broadcast_to(np.asarray(start_seconds, dtype=np.float64), leg_km.shape[:1]).copy()
+    service = np.broadcast_to(np.asarray(service_minutes, dtype=np.float64) * 60, leg_km.shape[:1])
+    arrivals = np.full(leg_km.shape, np.nan)
+    for stop in range(leg_km.shape[1]):
+        legs = leg_km[:, stop]
+        has_stop = ~np.isnan(legs)
+        clock = clock + travel_seconds(clock, np.where(has_stop, legs, 0.0), speed_profile)
+        arrivals[:, stop] = np.where(has_stop, clock, np.nan)
+        clock = clock + np.where(has_stop, service, 0.0)
+    return arrivals
+
+def leg_distances_km(locations, matrix_provider=None):
+    """
+    Distance in km driven to reach every stop of a route from the one before
+    (0 for the first stop), straight-line unless a matrix provider is given.
+    """
+    points = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+    legs = np.zeros(len(points))
+    if len(points) < 2:
+        return legs
+    if matrix_provider is None:
+        legs[1:] = haversine_vector(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+    else:
+        matrix = np.asarray(matrix_provider(points.tolist()))
+        legs[1:] = matrix[np.arange(len(points) - 1), np.arange(1, len(points))] / 1000.0
+    return legs
+
+def shift_start_time(shift_start=DEFAULT_SHIFT_START, now=None):
+    """Today's shift start, or now if the shift has already begun."""
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    start = pd.Timestamp.combine(now.date(), pd.Timestamp(str(shift_start)).time())
+    return max(start, now)
+
+def route_arrival_times(routes, nodes, shift_start=None, service_minutes=DEFAULT_SERVICE_MINUTES,
+                        speed_profile=HOURLY_SPEED_KMPH, matrix_provider=None):
+    """
+    Arrival timestamps at every stop of optimized routes, as returned by
+    optimize_pickup_delivery. Each route starts at its first stop at
+    `shift_start` (a Timestamp, one per route or shared).
+    Returns one datetime64 array per route, aligned with route[1:-1].
+    """
+    shift_start = shift_start_time() if shift_start is None else shift_start
+    starts = pd.DatetimeIndex(np.broadcast_to(np.asarray(shift_start, dtype='datetime64[s]'), (len(routes),)))
+    midnight = starts.normalize()
+    stops = [route[1:-1] for route in routes]
+    longest = max((len(route_stops) for route_stops in stops), default=0)
+    leg_km = np.full((len(routes), longest), np.nan)
+    for row, route_stops in enumerate(stops):
+        locations = [nodes[node]['location'] for node in route_stops]
+        leg_km[row, :len(route_stops)] = leg_distances_km(locations, matrix_provider)
+
+    start_seconds = (starts - midnight).total_seconds().values
+    arrivals = stop_arrival_seconds(leg_km, start_seconds, service_minutes, speed_profile)
+    arrival_times = midnight.values[:, None] + (arrivals * 1e9).astype('timedelta64[ns]')
+    return [arrival_times[row, :len(route_stops)] for row, route_stops in enumerate(stops)]
+
+def order_delivery_times(routes, nodes, arrival_times, num_orders):
+    """Delivery timestamp of every order (NaT if unrouted), from route_arrival_times."""
+    delivered = np.full(num_orders, np.datetime64('NaT'), dtype='datetime64[ns]')
+    for route, route_arrivals in zip(routes, arrival_times):
+        for node, arrival in zip(route[1:-1], route_arrivals):
+            if nodes[node]['type'] == 'delivery':
+                delivered[nodes[node]['orders']] = arrival
+    return delivered
+
+def direct_delivery_times(distances_km, start=None, service_minutes=DEFAULT_SERVICE_MINUTES,
+                          speed_profile=HOURLY_SPEED_KMPH):
+    """
+    Delivery timestamps for orders taken straight from pickup to drop, for
+    whole arrays of orders at once, leaving at `start` (default now).
+    """
+    start = pd.Timestamp.now() if start is None else pd.Timestamp(start)
+    midnight = start.normalize()
+    # Loading at the pickup, then the drive
+    departure = (start - midnight).total_seconds() + service_minutes * 60
+    seconds = departure + travel_seconds(departure, distances_km, speed_profile)
+    return np.datetime64(midnight) + (seconds * 1e9).astype('timedelta64[ns]')
+
+def format_eta(times):
+    """Format ETA timestamps (one or an array) for display and storage."""
+    if np.ndim(times) == 0:
+        return 'N/A' if pd.isna(times) else pd.Timestamp(times).strftime(ETA_FORMAT)
+    formatted = pd.DatetimeIndex(np.asarray(times, dtype='datetime64[ns]')).strftime(ETA_FORMAT)
+    return np.asarray(formatted.fillna('N/A'), dtype=object)
@@ -0,0 +1,227 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import re
+import sqlite3
+import threading
+import time
+from instrumentation import increment
+
+# Get the absolute path to the geocode cache file
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'geocode_cache.sqlite')
+
+# How long found and not-found results stay valid, in seconds
+DEFAULT_TTL_SECONDS = 90 * 24 * 3600
+DEFAULT_NEGATIVE_TTL_SECONDS = 7 * 24 * 3600
+
+# Entries kept in the in-process LRU in front of the disk cache
+DEFAULT_LRU_SIZE = 4096
+
+# Nominatim's usage policy allows at most one request per second
+DEFAULT_MIN_DELAY_SECONDS = 1.0
+
+# Lookups in flight at once during batch geocoding; the rate limiter still applies
+DEFAULT_MAX_WORKERS = 4
+
+# Retries for lookups that fail with a network or service error
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_BACKOFF_SECONDS = 1.0
+
+def normalize_address(address):
+    """Normalize an address string for use as a cache key."""
+    address = str(address).lower()
+    address = re.sub(r'\s*,\s*', ', ', address)
+    address = re.sub(r'\s+', ' ', address)
+    return address.strip(' ,.')
+
+class GeocodeCache:
+    """
+    Disk-backed geocode cache (SQLite) with an in-process LRU in front.
+    Entries are keyed on normalized addresses; addresses that could not be
+    found are stored as negative entries with their own, shorter TTL.
+    """
+
+    def __init__(self, path=CACHE_FILE, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 negative_ttl_seconds=DEFAULT_NEGATIVE_TTL_SECONDS, lru_size=DEFAULT_LRU_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS geocode ('
+            'address TEXT PRIMARY KEY, lat REAL, lon REAL, updated_at REAL NOT NULL)'
+        )
+        self._connection.commit()
+
+    def _is_fresh(self, lat, updated_at, now):
+        ttl = self.ttl_seconds if lat is not None else self.negative_ttl_seconds
+        return now - updated_at < ttl
+
+    def _remember(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get(self, address):
+        """
+        Look up an address.
+        Returns (hit, (lat, lon)); a negative entry is a hit with (None, None).
+        """
+        key = normalize_address(address)
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                entry = self._connection.execute(
+                    'SELECT lat, lon, updated_at FROM geocode WHERE address = ?', (key,)
+                ).fetchone()
+            if entry is None or not self._is_fresh(entry[0], entry[2], now):
+                self._lru.pop(key, None)
+                return False, (None, None)
+            self._remember(key, entry)
+            return True, (entry[0], entry[1])
+
+    def set(self, address, lat, lon):
+        """Store a result; pass None coordinates to record a not-found address."""
+        self.set_many([(address, lat, lon)])
+
+    def set_many(self, results):
+        """Store many (address, lat, lon) results in one transaction."""
+        now = time.time()
+        rows = [(normalize_address(address), lat, lon, now) for address, lat, lon in results]
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO geocode (address, lat, lon, updated_at) VALUES (?, ?, ?, ?)', rows
+                )
+            for key, lat, lon, updated_at in rows:
+                self._remember(key, (lat, lon, updated_at))
+
+    def close(self):
+        self._connection.close()
+
+class RateLimiter:
+    """Space calls at least `min_delay_seconds` apart, across threads."""
+
+    def __init__(self, min_delay_seconds=DEFAULT_MIN_DELAY_SECONDS):
+        self.min_delay_seconds = min_delay_seconds
+        self._lock = threading.Lock()
+        self._next_call = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_call - now
+            self._next_call = max(now, self._next_call) + self.min_delay_seconds
+        if delay > 0:
+            time.sleep(delay)
+
+class Geocoder:
+    """
+    Cached, rate-limited geocoding on top of any geopy-style geocoder, i.e. an
+    object whose geocode(address) returns a location with latitude and
+    longitude, or None. Defaults to Nominatim.
+    """
+
+    def __init__(self, geocoder=None, cache=None, min_delay_seconds=DEFAULT_MIN_DELAY_SECONDS):
+        if geocoder is None:
+            from geopy.geocoders import Nominatim
+            geocoder = Nominatim(user_agent="logistics_prototype")
+        self.geocoder = geocoder
+        self.cache = cache if cache is not None else GeocodeCache()
+        self.rate_limiter = RateLimiter(min_delay_seconds)
+
+    def _lookup(self, address):
+        """Query the geocoder; returns (lat, lon), (None, None) if not found, or raises."""
+        self.rate_limiter.wait()
+        increment('geocode_requests')
+        location = self.geocoder.geocode(address)
+        if location:
+            return location.latitude, location.longitude
+        return None, None
+
+    def geocode(self, address):
+        """Geocode one address to (lat, lon), or (None, None) if it can't be found."""
+        hit, coordinates = self.cache.get(address)
+        increment('geocode_cache_hits' if hit else 'geocode_cache_misses')
+        if hit:
+            return coordinates
+        try:
+            lat, lon = self._lookup(address)
+        except Exception:
+            # Network or service errors are not cached, so the next call retries
+            increment('geocode_errors')
+            return None, None
+        self.cache.set(address, lat, lon)
+        return lat, lon
+
+    def _lookup_with_retries(self, address, retries):
+        """Query the geocoder, retrying errors with exponential backoff."""
+        for attempt in range(retries + 1):
+            try:
+                return self._lookup(address)
+            except Exception:
+                if attempt == retries:
+                    raise
+                increment('geocode_retries')
+                time.sleep(DEFAULT_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+    def geocode_batch(self, addresses, max_workers=DEFAULT_MAX_WORKERS, retries=DEFAULT_RETRIES,
+                      progress_callback=None):
+        """
+        Geocode many addresses, looking each distinct address up at most once.
+        Lookups run concurrently on `max_workers` threads under the shared rate
+        limiter; `progress_callback(done, total)` is called as each one finishes.
+        Returns a dict mapping every input address to (lat, lon) or (None, None).
+        """
+        results = {}
+        pending = OrderedDict()
+        for address in addresses:
+            if address in results:
+                continue
+            hit, coordinates = self.cache.get(address)
+            increment('geocode_cache_hits' if hit else 'geocode_cache_misses')
+            if hit:
+                results[address] = coordinates
+            else:
+                pending.setdefault(normalize_address(address), []).append(address)
+                results[address] = (None, None)
+
+        found = []
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                futures = {
+                    executor.submit(self._lookup_with_retries, same_addresses[0], retries): same_addresses
+                    for same_addresses in pending.values()
+                }
+                for done, future in enumerate(as_completed(futures), 1):
+                    same_addresses = futures[future]
+                    try:
+                        lat, lon = future.result()
+                    except Exception:
+                        increment('geocode_errors')
+                        lat, lon = None, None
+                    else:
+                        found.append((same_addresses[0], lat, lon))
+                    for address in same_addresses:
+                        results[address] = (lat, lon)
+                    if progress_callback is not None:
+                        progress_callback(done, len(futures))
+        self.cache.set_many(found)
+        return results
+
+_default_geocoder = None
+_default_geocoder_lock = threading.Lock()
+
+def get_default_geocoder():
+    """Shared Nominatim-backed Geocoder using the on-disk cache."""
+    global _default_geocoder
+    with _default_geocoder_lock:
+        if _default_geocoder is None:
+            _default_geocoder = Geocoder()
+        return _default_geocoder
@@ -0,0 +1,146 @@
+import pandas as pd
+import numpy as np
+import uuid
+from optimizer import haversine_vector
+from utils import ORDER_COLUMNS, get_lat_lon_batch, get_estimated_delivery_times
+from instrumentation import increment, span, timed
+
+# Column names the uploaded CSV must use for addresses
+PICKUP_COLUMN = 'pickupaddress'
+DELIVERY_COLUMN = 'deliveryaddress'
+
+# Alternative spellings accepted for the address columns
+COLUMN_ALIASES = {
+    'pickup_address': PICKUP_COLUMN,
+    'delivery_address': DELIVERY_COLUMN,
+}
+
+# Optional coordinate columns that let rows skip geocoding
+COORDINATE_COLUMNS = ['lat_pick', 'lon_pick', 'lat_drop', 'lon_drop']
+
+# Suffix added to addresses before geocoding
+ADDRESS_SUFFIX = ", Delhi, India"
+
+# Rows read and prepared at a time by read_orders_csv
+DEFAULT_CHUNK_SIZE = 10000
+
+MISSING_COLUMNS_MESSAGE = (
+    "The CSV must have 'pickupaddress' and 'deliveryaddress' columns. Optionally, you can include "
+    "'lat_pick', 'lon_pick', 'lat_drop', 'lon_drop' for direct coordinate input."
+)
+
+class MissingColumnsError(ValueError):
+    """Raised when a CSV of orders lacks the pickup or delivery address column."""
+
+def normalize_columns(raw_df):
+    """Clean up column names (strip whitespace, convert to lowercase, resolve aliases)."""
+    raw_df = raw_df.copy()
+    raw_df.columns = raw_df.columns.str.strip().str.lower()
+    return raw_df.rename(columns=COLUMN_ALIASES)
+
+def has_address_columns(raw_df):
+    """Check a normalized DataFrame has the pickup and delivery address columns."""
+    return PICKUP_COLUMN in raw_df.columns and DELIVERY_COLUMN in raw_df.columns
+
+def validate_coordinates(raw_df):
+    """
+    Return the coordinate columns as floats, with missing columns and
+    out-of-range or unparseable values as NaN.
+    """
+    coordinates = pd.DataFrame(index=raw_df.index)
+    for column in COORDINATE_COLUMNS:
+        if column in raw_df.columns:
+            coordinates[column] = pd.to_numeric(raw_df[column], errors='coerce')
+        else:
+            coordinates[column] = np.nan
+    for lat_col, lon_col in [('lat_pick', 'lon_pick'), ('lat_drop', 'lon_drop')]:
+        invalid = ~coordinates[lat_col].between(-90, 90) | ~coordinates[lon_col].between(-180, 180)
+        coordinates.loc[invalid, [lat_col, lon_col]] = np.nan
+    return coordinates
+
+@timed()
+def prepare_orders(raw_df, geocode_batch=get_lat_lon_batch):
+    """
+    Turn a DataFrame of raw orders into rows of the orders table, column-wise.
+    Rows without valid coordinates are geocoded in one batch through
+    `geocode_batch(addresses) -> {address: (lat, lon)}`.
+    Returns the new orders and the list of addresses that could not be geocoded.
+    """
+    raw_df = normalize_columns(raw_df)
+    if not has_address_columns(raw_df):
+        raise MissingColumnsError(MISSING_COLUMNS_MESSAGE)
+
+    pickup_addresses = raw_df[PICKUP_COLUMN].astype(str)
+    delivery_addresses = raw_df[DELIVERY_COLUMN].astype(str)
+    coordinates = validate_coordinates(raw_df)
+
+    # Geocode every address missing coordinates in one batch
+    lookups = []
+    for addresses, lat_col, lon_col in [(pickup_addresses, 'lat_pick', 'lon_pick'), (delivery_addresses, 'lat_drop', 'lon_drop')]:
+        missing = coordinates[lat_col].isna()
+        lookups.append((addresses[missing], lat_col, lon_col))
+    to_geocode = pd.concat([addresses for addresses, _, _ in lookups])
+    failed_addresses = []
+    if len(to_geocode):
+        geocoded = geocode_batch((to_geocode + ADDRESS_SUFFIX).unique().tolist())
+        for addresses, lat_col, lon_col in lookups:
+            found = np.array([geocoded.get(address + ADDRESS_SUFFIX, (None, None)) for address in addresses],
+                             dtype=np.float64).reshape(-1, 2)
+            coordinates.loc[addresses.index, lat_col] = found[:, 0]
+            coordinates.loc[addresses.index, lon_col] = found[:, 1]
+            failed = coordinates.loc[addresses.index, lat_col].isna()
+            failed_addresses += addresses[failed].tolist()
+
+    # Skip orders whose pickup or delivery still has no coordinates
+    valid = coordinates.notna().all(axis=1)
+    coordinates = coordinates[valid]
+
+    increment('orders_prepared', int(valid.sum()))
+    increment('orders_skipped', int((~valid).sum()))
+    distances = haversine_vector(coordinates['lat_pick'], coordinates['lon_pick'],
+                                 coordinates['lat_drop'], coordinates['lon_drop'])
+    new_orders = pd.DataFrame({
+        'id': [str(uuid.uuid4()) for _ in range(len(coordinates))],
+        'pickup_address': pickup_addresses[valid].values,
+        'delivery_address': delivery_addresses[valid].values,
+        'assigned_to': 'N/A',
+        'status': 'Pending',
+        'lat_pick': coordinates['lat_pick'].values,
+        'lon_pick': coordinates['lon_pick'].values,
+        'lat_drop': coordinates['lat_drop'].values,
+        'lon_drop': coordinates['lon_drop'].values,
+        'eta': get_estimated_delivery_times(distances),
+    }, columns=ORDER_COLUMNS)
+    return new_orders, list(dict.fromkeys(failed_addresses))
+
+def read_orders_csv(file, chunksize=DEFAULT_CHUNK_SIZE, geocode_batch=get_lat_lon_batch):
+    """
+    Stream a CSV of raw orders, preparing `chunksize` rows at a time.
+    Yields (new_orders, failed_addresses) for every chunk.
+    """
+    for chunk in pd.read_csv(file, chunksize=chunksize):
+        with span('ingest_chunk', rows=len(chunk)):
+            prepared = prepare_orders(chunk, geocode_batch=geocode_batch)
+        yield prepared
+
+@timed()
+def ingest_orders_csv(file, chunksize=DEFAULT_CHUNK_SIZE, geocode_batch=get_lat_lon_batch):
+    """
+    Read and prepare a whole CSV of raw orders in bounded-size chunks.
+    Returns all new orders in one DataFrame and the addresses that failed.
+    """
+    frames = []
+    failed_addresses = []
+    for new_orders, failed in read_orders_csv(file, chunksize=chunksize, geocode_batch=geocode_batch):
+        frames.append(new_orders)
+        failed_addresses += failed
+    new_orders = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=ORDER_COLUMNS)
+    return new_orders, list(dict.fromkeys(failed_addresses))
+
+def append_orders(orders_df, new_orders):
+    """Append new orders to the orders table in a single concatenation."""
+    if new_orders.empty:
+        return orders_df
+    if orders_df.empty:
+        return new_orders.reset_index(drop=True)
+    return pd.concat([orders_df, new_orders], ignore_index=True)
@@ -0,0 +1,122 @@
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+import json
+import logging
+import threading
+import time
+
+# Recent spans and solver runs kept for the diagnostics panel
+DEFAULT_HISTORY_SIZE = 200
+
+# Prefix of every metric name in the Prometheus text export
+METRIC_PREFIX = 'logistics'
+
+logger = logging.getLogger('logistics_prototype.instrumentation')
+
+class Metrics:
+    """
+    Process-wide timing spans, counters and solver statistics.
+    Every finished span is also logged as one JSON line at DEBUG level.
+    """
+
+    def __init__(self, history_size=DEFAULT_HISTORY_SIZE):
+        self._lock = threading.Lock()
+        self.history_size = history_size
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}
+            self.counters = {}
+            self.recent = deque(maxlen=self.history_size)
+            self.solver_runs = deque(maxlen=self.history_size)
+
+    def record_span(self, name, seconds, **labels):
+        """Add one timed run of `name` to its totals."""
+        with self._lock:
+            totals = self.spans.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            totals['count'] += 1
+            totals['total_seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            event = {'span': name, 'seconds': round(seconds, 6), 'at': time.time(), **labels}
+            self.recent.append(event)
+        logger.debug(json.dumps(event, default=str))
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_solver_run(self, **stats):
+        """Keep the statistics of one OR-Tools solve (wall time, objective, branches, ...)."""
+        event = {'at': time.time(), **stats}
+        with self._lock:
+            self.solver_runs.append(event)
+        logger.debug(json.dumps({'solver': event}, default=str))
+
+    def merge(self, snapshot):
+        """Add a snapshot taken in another process, such as a job worker's, to these metrics."""
+        with self._lock:
+            for name, totals in snapshot['spans'].items():
+                mine = self.spans.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+                mine['count'] += totals['count']
+                mine['total_seconds'] += totals['total_seconds']
+                mine['max_seconds'] = max(mine['max_seconds'], totals['max_seconds'])
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.recent.extend(snapshot['recent'])
+            self.solver_runs.extend(snapshot['solver_runs'])
+
+    def snapshot(self):
+        """Copy of every metric, safe to read while others keep recording."""
+        with self._lock:
+            return {
+                'spans': {name: dict(totals) for name, totals in self.spans.items()},
+                'counters': dict(self.counters),
+                'recent': list(self.recent),
+                'solver_runs': list(self.solver_runs),
+            }
+
+    def prometheus_text(self):
+        """Export spans and counters in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            f'# TYPE {METRIC_PREFIX}_span_seconds summary',
+        ]
+        for name, totals in sorted(snapshot['spans'].items()):
+            lines.append(f'{METRIC_PREFIX}_span_seconds_count{{span="{name}"}} {totals["count"]}')
+            lines.append(f'{METRIC_PREFIX}_span_seconds_sum{{span="{name}"}} {totals["total_seconds"]:.6f}')
+        lines.append(f'# TYPE {METRIC_PREFIX}_span_seconds_max gauge')
+        for name, totals in sorted(snapshot['spans'].items()):
+            lines.append(f'{METRIC_PREFIX}_span_seconds_max{{span="{name}"}} {totals["max_seconds"]:.6f}')
+        lines.append(f'# TYPE {METRIC_PREFIX}_events_total counter')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'{METRIC_PREFIX}_events_total{{event="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+@contextmanager
+def span(name, **labels):
+    """Time the enclosed block as one run of the span `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record_span(name, time.perf_counter() - start, **labels)
+
+def timed(name=None):
+    """Decorator timing every call of a function as a span (named after it by default)."""
+    def decorate(function):
+        span_name = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def increment(name, amount=1):
+    """Add to the counter `name`."""
+    metrics.increment(name, amount)
@@ -0,0 +1,224 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from optimizer import set_matrix_provider
+from clustering import plan_clustered_routes
+from planning import apply_plan, plan_orders
+from route_cache import RouteCache, cached_solver
+from road_network import load_distance_cache
+from storage import DB_FILE, OrderStore
+from instrumentation import metrics
+
+# Get the absolute path to the job database
+JOBS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'jobs.sqlite')
+
+# Optimization jobs run at once; the rest wait in the queue. Large jobs still
+# spread their clusters over every core.
+DEFAULT_JOB_WORKERS = 1
+
+# Least time between two progress updates written by a running job, in seconds
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+# How long a writer waits for another process's transaction, in seconds
+BUSY_TIMEOUT_SECONDS = 30
+
+JOB_STATUSES = ['queued', 'running', 'done', 'failed']
+
+# Workers start from a fresh interpreter: forking the app's process would copy
+# locks held by its other threads (Streamlit sessions, logging, metrics) and
+# can leave a worker stuck before it picks up its first job. A fresh worker
+# imports the main module again, so scripts that start jobs keep their
+# top-level code under `if __name__ == "__main__"`
+WORKER_START_METHOD = 'spawn'
+
+class JobStore:
+    """
+    Optimization jobs in SQLite (WAL mode), shared by the app and the worker
+    processes: status, progress with the best solution so far, and the final
+    result, so a finished plan survives page reruns and restarts.
+    """
+
+    def __init__(self, path=JOBS_FILE):
+        self.path = path
+        self._local = threading.local()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, params TEXT, progress TEXT, '
+                'result TEXT, error TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_kind_created_at ON jobs (kind, created_at)')
+
+    def _connection(self):
+        """One connection per thread; SQLite connections must not be shared across threads."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def create(self, kind, params=None):
+        """Queue a new job; returns its id."""
+        job_id = str(uuid.uuid4())
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'INSERT INTO jobs (id, kind, status, params, created_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, kind, 'queued', json.dumps(params or {}, default=str), time.time())
+            )
+        return job_id
+
+    def update(self, job_id, **values):
+        """Update some fields of a job; params, progress and result are stored as JSON."""
+        for column in ['params', 'progress', 'result']:
+            if column in values:
+                values[column] = json.dumps(values[column], default=str)
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in values)} WHERE id = ?",
+                list(values.values()) + [job_id]
+            )
+
+    def fail_unfinished(self, error):
+        """
+        Mark every queued and running job as failed with `error`, e.g. jobs
+        whose worker went away with the server. Returns how many were marked.
+        """
+        connection = self._connection()
+        with connection:
+            return connection.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE status IN ('queued', 'running')",
+                (error, time.time())
+            ).rowcount
+
+    def _job(self, row, columns):
+        job = dict(zip(columns, row))
+        for column in ['params', 'progress', 'result']:
+            job[column] = json.loads(job[column]) if job[column] else None
+        return job
+
+    def get(self, job_id):
+        """Return one job as a dict, or None if it doesn't exist."""
+        cursor = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        row = cursor.fetchone()
+        return self._job(row, [column[0] for column in cursor.description]) if row else None
+
+    def _latest(self, columns, kind, status):
+        sql = f'SELECT {columns} FROM jobs WHERE kind = ?'
+        params = [kind]
+        if status is not None:
+            statuses = [status] if isinstance(status, str) else list(status)
+            sql += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params += statuses
+        return self._connection().execute(sql + ' ORDER BY created_at DESC LIMIT 1', params)
+
+    def latest_id(self, kind, status=None):
+        """Id of the most recently created job of a kind, without loading its result."""
+        row = self._latest('id', kind, status).fetchone()
+        return row[0] if row else None
+
+    def latest(self, kind, status=None):
+        """The most recently created job of a kind, optionally with one of the given statuses."""
+        cursor = self._latest('*', kind, status)
+        row = cursor.fetchone()
+        return self._job(row, [column[0] for column in cursor.description]) if row else None
+
+def init_worker():
+    """Give a new worker process the same distances as the app (road or straight-line)."""
+    set_matrix_provider(load_distance_cache().matrix)
+
+def run_plan_job(job_id, orders, partners, options, jobs_path=JOBS_FILE, store_path=DB_FILE):
+    """
+    Body of a route planning job (runs in a worker process). Reports progress
+    and the best routes so far, then writes the plan to the orders store and
+    the job. The worker opens its own database connections.
+    Returns the metrics recorded during the job, which are also kept in its
+    final progress record, so the app can show the worker's timings.
+    """
+    # A worker runs one job at a time, so everything recorded from here on is this job's
+    metrics.reset()
+    jobs = JobStore(jobs_path)
+    started_at = time.time()
+    jobs.update(job_id, status='running', started_at=started_at)
+    progress = {'solutions': 0, 'distance_km': None, 'routes': None, 'clusters_done': 0, 'clusters_total': None}
+    last_write = [0.0]
+
+    def report(force=False):
+        now = time.time()
+        if force or now - last_write[0] >= PROGRESS_INTERVAL_SECONDS:
+            last_write[0] = now
+            jobs.update(job_id, progress=dict(progress, elapsed_seconds=round(now - started_at, 3)))
+
+    def on_solution(distance_km, routes):
+        progress.update(solutions=progress['solutions'] + 1, distance_km=distance_km, routes=routes)
+        report()
+
+    def on_cluster(done, total):
+        progress.update(clusters_done=done, clusters_total=total)
+        report(force=True)
+
+    def finish(**values):
+        job_metrics = metrics.snapshot()
+        jobs.update(job_id, finished_at=time.time(), **values,
+                    progress=dict(progress, elapsed_seconds=round(time.time() - started_at, 3), metrics=job_metrics))
+        return job_metrics
+
+    try:
+        options = dict(options)
+        plan_function = cached_solver(plan_clustered_routes, RouteCache(), signature=options.pop('distance_model', ''))
+        plan = plan_orders(orders, partners, plan_function=plan_function,
+                           solution_callback=on_solution, progress_callback=on_cluster, **options)
+        if plan is None:
+            return finish(status='failed', error='No routes could be found for these orders.')
+        apply_plan(OrderStore(store_path, legacy_csv=None), plan)
+        return finish(status='done', result=plan)
+    except Exception as error:
+        return finish(status='failed', error=f'{type(error).__name__}: {error}')
+
+class JobRunner:
+    """Runs route planning jobs on a process pool, off the UI thread."""
+
+    def __init__(self, max_workers=DEFAULT_JOB_WORKERS, jobs=None, store_path=DB_FILE):
+        self.jobs = jobs if jobs is not None else JobStore()
+        self.store_path = store_path
+        # Jobs queued or running when the last server stopped have no worker
+        # left to finish them, and would otherwise block new optimizations
+        self.jobs.fail_unfinished('Interrupted: the server restarted before the job finished.')
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                             mp_context=multiprocessing.get_context(WORKER_START_METHOD))
+
+    def submit_plan(self, orders, partners, **options):
+        """
+        Queue a planning job for a DataFrame of orders; options are passed on to
+        planning.plan_orders, plus 'distance_model' for the route cache.
+        Returns the job id.
+        """
+        params = {'orders': len(orders), 'partners': list(partners),
+                  **{key: value for key, value in options.items() if key != 'warm_start'}}
+        job_id = self.jobs.create('plan_routes', params)
+        future = self._executor.submit(run_plan_job, job_id, orders, list(partners), options,
+                                       self.jobs.path, self.store_path)
+
+        def record_outcome(future):
+            # A worker that died (e.g. out of memory) never reports back itself
+            if future.exception() is not None:
+                self.jobs.update(job_id, status='failed', error=f'Worker crashed: {future.exception()}',
+                                 finished_at=time.time())
+            else:
+                # Show the worker's solver runs and timings with the app's own
+                metrics.merge(future.result())
+        future.add_done_callback(record_outcome)
+        return job_id
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
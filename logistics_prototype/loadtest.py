@@ -0,0 +1,403 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from benchmark import code_version, generate_orders
+from assignment import auto_assign
+from dispatch import Dispatcher, dispatch_new_order, dispatch_status_changes
+from eta import format_eta, direct_delivery_times
+from ingestion import ingest_orders_csv
+from optimizer import haversine_vector
+from planning import apply_plan, plan_orders
+from storage import ORDER_COLUMNS, SNAPSHOT_DIR, OrderStore, compact_orders, with_created_at
+
+# Get the absolute path to the directory load test reports are written to
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'loadtests')
+
+# Share of each operation in a simulated session's workload
+DEFAULT_MIX = {'status': 0.6, 'create': 0.2, 'assign': 0.1, 'upload': 0.05, 'optimize': 0.05}
+
+DEFAULT_SESSIONS = 8
+DEFAULT_OPS_PER_SESSION = 100
+DEFAULT_INITIAL_ORDERS = 1000
+DEFAULT_UPLOAD_ROWS = 50
+
+# Orders every session's status updates draw from, so sessions contend for the
+# same rows the way partners and dispatchers do
+DEFAULT_HOT_ORDERS = 100
+
+# Solver time for an optimize operation, and how many pending orders it plans
+DEFAULT_OPTIMIZE_SECONDS = 1
+DEFAULT_OPTIMIZE_ORDERS = 100
+
+PARTNERS = ["Partner A", "Partner B", "Partner C"]
+
+# Statuses a partner moves an order through, in order
+STATUS_FLOW = ["Pending", "Picked Up", "Delivered"]
+
+# Orders store backends a run can use, and the file each keeps its orders in
+STORE_FILES = {'sqlite': 'orders.sqlite', 'csv': 'orders.csv'}
+
+# Bounding box of the coordinates the stub geocoder hands out (Delhi-NCR)
+STUB_LAT_RANGE = (28.40, 28.88)
+STUB_LON_RANGE = (76.95, 77.40)
+
+def stub_geocode(address):
+    """Deterministic coordinates for an address, without any network lookup."""
+    digest = hashlib.sha1(str(address).encode()).digest()
+    lat_fraction, lon_fraction = int.from_bytes(digest[:4], 'big') / 2 ** 32, int.from_bytes(digest[4:8], 'big') / 2 ** 32
+    return (STUB_LAT_RANGE[0] + lat_fraction * (STUB_LAT_RANGE[1] - STUB_LAT_RANGE[0]),
+            STUB_LON_RANGE[0] + lon_fraction * (STUB_LON_RANGE[1] - STUB_LON_RANGE[0]))
+
+def stub_geocode_batch(addresses, progress_callback=None):
+    """Stand-in for utils.get_lat_lon_batch."""
+    return {address: stub_geocode(address) for address in addresses}
+
+class CsvOrderStore:
+    """
+    Baseline with the storage the app had before the SQLite store: a single
+    CSV file that every write reads whole, changes and writes back, with no
+    locking. Has the OrderStore methods the operations use; `expected` values
+    are checked, but not atomically with the write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            pd.DataFrame(columns=ORDER_COLUMNS).to_csv(path, index=False)
+
+    def all_orders(self):
+        return pd.read_csv(self.path, dtype={'id': str})
+
+    def snapshot(self, version=None, directory=None):
+        return compact_orders(self.all_orders())
+
+    def get_order(self, order_id):
+        orders_df = self.all_orders()
+        rows = orders_df[orders_df['id'] == order_id]
+        return rows.iloc[0].to_dict() if len(rows) else None
+
+    def insert_orders(self, orders_df):
+        orders_df = pd.concat([self.all_orders(), with_created_at(orders_df)[ORDER_COLUMNS]], ignore_index=True)
+        orders_df.to_csv(self.path, index=False)
+
+    def update_order(self, order_id, expected=None, **values):
+        return not self.update_orders([(order_id, values, expected)])
+
+    def update_orders(self, updates):
+        orders_df = self.all_orders().set_index('id')
+        conflicts = []
+        for update in updates:
+            order_id, values = update[:2]
+            expected = (update[2] if len(update) > 2 else None) or {}
+            if order_id not in orders_df.index or any(orders_df.loc[order_id, column] != value
+                                                      for column, value in expected.items()):
+                conflicts.append(order_id)
+                continue
+            for column, value in values.items():
+                orders_df.loc[order_id, column] = value
+        orders_df.reset_index().to_csv(self.path, index=False)
+        return conflicts
+
+    def set_column(self, column, values):
+        self.update_orders([(order_id, {column: value}) for order_id, value in dict(values).items()])
+
+def open_store(backend, path):
+    """The orders store of a backend in STORE_FILES, at `path`."""
+    if backend == 'csv':
+        return CsvOrderStore(path)
+    return OrderStore(path, legacy_csv=None)
+
+def seed_orders(store, num_orders, seed=0):
+    """Fill the store with synthetic pending orders; returns their ids."""
+    pickups, drops = generate_orders(num_orders, seed)
+    pickups, drops = np.asarray(pickups), np.asarray(drops)
+    ids = [str(uuid.uuid4()) for _ in range(num_orders)]
+    distances = haversine_vector(pickups[:, 0], pickups[:, 1], drops[:, 0], drops[:, 1])
+    store.insert_orders(pd.DataFrame({
+        'id': ids,
+        'pickup_address': [f'Seed pickup {order}' for order in range(num_orders)],
+        'delivery_address': [f'Seed drop {order}' for order in range(num_orders)],
+        'assigned_to': 'N/A',
+        'status': 'Pending',
+        'lat_pick': pickups[:, 0], 'lon_pick': pickups[:, 1],
+        'lat_drop': drops[:, 0], 'lon_drop': drops[:, 1],
+        'eta': format_eta(direct_delivery_times(distances)),
+    }))
+    return ids
+
+class SessionState:
+    """What one simulated session wrote, so lost writes can be counted afterwards."""
+
+    def __init__(self, hot_orders, guarded=True):
+        self.hot_orders = list(hot_orders)
+        self.guarded = guarded
+        # Status steps this session made on each order, the steps the store
+        # rejected because another session had changed the order first, and
+        # the orders it created
+        self.advances = {}
+        self.conflicts = 0
+        self.created = []
+        self.timings = []
+
+# Plans made by optimize operations, shared by the sessions of one process
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def op_create(store, state, rng, session_id):
+    """Create Shipment: geocode two addresses and insert one order, then slot it into the routes."""
+    order_id = str(uuid.uuid4())
+    pickup_address, delivery_address = f'Pickup {session_id}-{rng.integers(1e9)}', f'Drop {session_id}-{rng.integers(1e9)}'
+    lat_pick, lon_pick = stub_geocode(pickup_address)
+    lat_drop, lon_drop = stub_geocode(delivery_address)
+    distance = haversine_vector(lat_pick, lon_pick, lat_drop, lon_drop)
+    store.insert_orders(pd.DataFrame([{
+        'id': order_id, 'pickup_address': pickup_address, 'delivery_address': delivery_address,
+        'assigned_to': 'N/A', 'status': 'Pending', 'lat_pick': lat_pick, 'lon_pick': lon_pick,
+        'lat_drop': lat_drop, 'lon_drop': lon_drop, 'eta': format_eta(direct_delivery_times(distance)),
+    }]))
+    state.created.append(order_id)
+    if _dispatcher is not None:
+        dispatch_new_order(store, order_id, (lat_pick, lon_pick), (lat_drop, lon_drop), dispatcher=_dispatcher)
+
+def op_upload(store, state, rng, session_id, rows=DEFAULT_UPLOAD_ROWS):
+    """Bulk upload: ingest a CSV of new orders through the stub geocoder and insert them."""
+    batch = rng.integers(1e9)
+    csv = pd.DataFrame({
+        'pickupaddress': [f'Upload pickup {session_id}-{batch}-{row}' for row in range(rows)],
+        'deliveryaddress': [f'Upload drop {session_id}-{batch}-{row}' for row in range(rows)],
+    }).to_csv(index=False)
+    new_orders, _ = ingest_orders_csv(io.StringIO(csv), geocode_batch=stub_geocode_batch)
+    store.insert_orders(new_orders)
+    state.created += new_orders['id'].tolist()
+
+def op_status(store, state, rng, session_id):
+    """
+    A partner reads a shared order and moves it to its next status: a
+    read-modify-write that other sessions may be doing on the same row.
+    Guarded sessions only write if the order still has the status they read,
+    as the app's editors do, and count a rejected write as a conflict.
+    Delivered orders are left as they are.
+    """
+    order_id = state.hot_orders[rng.integers(len(state.hot_orders))]
+    current = store.get_order(order_id)['status']
+    position = STATUS_FLOW.index(current)
+    if position + 1 == len(STATUS_FLOW):
+        return
+    status = STATUS_FLOW[position + 1]
+    if state.guarded:
+        if not store.update_order(order_id, expected={'status': current}, status=status):
+            state.conflicts += 1
+            return
+    else:
+        store.update_order(order_id, status=status)
+    state.advances[order_id] = state.advances.get(order_id, 0) + 1
+    if _dispatcher is not None:
+        dispatch_status_changes(store, {order_id: status}, dispatcher=_dispatcher)
+
+def op_assign(store, state, rng, session_id, snapshot_dir=SNAPSHOT_DIR):
+    """Auto Assign Deliveries over the whole table, written in one transaction."""
+    orders_df = store.snapshot(directory=snapshot_dir)
+    store.set_column('assigned_to', auto_assign(orders_df, PARTNERS))
+
+def op_optimize(store, state, rng, session_id, snapshot_dir=SNAPSHOT_DIR, time_limit=DEFAULT_OPTIMIZE_SECONDS,
+                max_orders=DEFAULT_OPTIMIZE_ORDERS):
+    """Optimize Routes on the latest pending orders, in the session itself rather than a job worker."""
+    global _dispatcher
+    orders_df = store.snapshot(directory=snapshot_dir)
+    pending = orders_df[orders_df['status'] == 'Pending'].tail(max_orders)
+    if pending.empty:
+        return
+    plan = plan_orders(pending, PARTNERS, solver_options={'time_limit': time_limit}, processes=1)
+    if plan is not None:
+        apply_plan(store, plan)
+        with _dispatcher_lock:
+            _dispatcher = Dispatcher(plan)
+
+OPERATIONS = {
+    'create': op_create,
+    'upload': op_upload,
+    'status': op_status,
+    'assign': op_assign,
+    'optimize': op_optimize,
+}
+
+def run_session(session_id, backend, path, hot_orders, num_ops, mix, seed, snapshot_dir, optimize_seconds, guarded=True):
+    """
+    One simulated user issuing `num_ops` operations drawn from `mix`.
+    Returns its timings and what it wrote, for the report.
+    """
+    store = open_store(backend, path)
+    rng = np.random.default_rng([seed, session_id])
+    state = SessionState(hot_orders, guarded)
+    names = list(mix)
+    weights = np.array([mix[name] for name in names], dtype=np.float64)
+    for name in rng.choice(names, size=num_ops, p=weights / weights.sum()):
+        kwargs = {}
+        if name in ('assign', 'optimize'):
+            kwargs['snapshot_dir'] = snapshot_dir
+        if name == 'optimize':
+            kwargs['time_limit'] = optimize_seconds
+        start = time.perf_counter()
+        try:
+            OPERATIONS[name](store, state, rng, session_id, **kwargs)
+            error = None
+        except Exception as exception:
+            error = f'{type(exception).__name__}: {exception}'
+        state.timings.append((name, time.perf_counter() - start, error))
+    return {'timings': state.timings, 'advances': state.advances, 'conflicts': state.conflicts,
+            'created': state.created}
+
+def count_lost_writes(store, sessions):
+    """
+    Compare the store with what the sessions wrote. Statuses only move
+    forward, so an order the sessions advanced N times in all should be N
+    steps along; each missing step is a lost update, silently overwritten.
+    Created orders that are missing are lost inserts. Writes the store
+    rejected as conflicts aren't advances, so they aren't counted here.
+    """
+    final = store.all_orders().set_index('id')['status']
+    advances = {}
+    for session in sessions:
+        for order_id, count in session['advances'].items():
+            advances[order_id] = advances.get(order_id, 0) + count
+    lost_updates = sum(max(0, count - (STATUS_FLOW.index(final[order_id]) if order_id in final.index else 0))
+                       for order_id, count in advances.items())
+    lost_inserts = sum(order_id not in final.index for session in sessions for order_id in session['created'])
+    return lost_updates, lost_inserts
+
+def summarize(timings, wall_seconds):
+    """Latency percentiles, errors and throughput per operation."""
+    frame = pd.DataFrame(timings, columns=['operation', 'seconds', 'error'])
+    rows = []
+    for operation, group in list(frame.groupby('operation')) + [('all', frame)]:
+        seconds = group['seconds'].to_numpy()
+        rows.append({
+            'operation': operation,
+            'count': len(group),
+            'errors': int(group['error'].notna().sum()),
+            'p50_ms': float(np.percentile(seconds, 50) * 1000),
+            'p99_ms': float(np.percentile(seconds, 99) * 1000),
+            'max_ms': float(seconds.max() * 1000),
+            'throughput_per_second': len(group) / wall_seconds,
+        })
+    return rows
+
+def run_load_test(sessions=DEFAULT_SESSIONS, ops_per_session=DEFAULT_OPS_PER_SESSION, mix=DEFAULT_MIX,
+                  initial_orders=DEFAULT_INITIAL_ORDERS, mode='threads', seed=0,
+                  optimize_seconds=DEFAULT_OPTIMIZE_SECONDS, backend='sqlite', hot_orders=DEFAULT_HOT_ORDERS,
+                  guarded=True):
+    """
+    Run simulated sessions concurrently against a scratch orders store of
+    the given backend ('sqlite' or the 'csv' baseline). Status updates all
+    draw from the first `hot_orders` seeded orders, and with `guarded=False`
+    write without checking the status they read. Returns the report dict.
+    """
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    try:
+        path = os.path.join(workdir, STORE_FILES[backend])
+        store = open_store(backend, path)
+        seeded = seed_orders(store, initial_orders, seed)
+        snapshot_dir = os.path.join(workdir, 'snapshots')
+
+        executor_class = ThreadPoolExecutor if mode == 'threads' else ProcessPoolExecutor
+        start = time.perf_counter()
+        with executor_class(max_workers=sessions) as executor:
+            futures = [executor.submit(run_session, session_id, backend, path, seeded[:hot_orders], ops_per_session,
+                                       mix, seed, snapshot_dir, optimize_seconds, guarded)
+                       for session_id in range(sessions)]
+            results = [future.result() for future in futures]
+        wall_seconds = time.perf_counter() - start
+
+        timings = [timing for result in results for timing in result['timings']]
+        errors = sorted({error for _, _, error in timings if error})
+        try:
+            lost_updates, lost_inserts = count_lost_writes(store, results)
+        except Exception as exception:
+            # The CSV baseline can be left too damaged to read back at all
+            lost_updates = lost_inserts = None
+            errors.insert(0, f'Final store unreadable: {type(exception).__name__}: {exception}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'version': code_version(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'store': backend,
+        'mode': mode,
+        'sessions': sessions,
+        'ops_per_session': ops_per_session,
+        'mix': mix,
+        'initial_orders': initial_orders,
+        'hot_orders': hot_orders,
+        'guarded': guarded,
+        'seed': seed,
+        'cpu_count': os.cpu_count(),
+        'wall_seconds': wall_seconds,
+        'lost_updates': lost_updates if lost_updates is None else int(lost_updates),
+        'conflicts': sum(result['conflicts'] for result in results),
+        'lost_inserts': lost_inserts if lost_inserts is None else int(lost_inserts),
+        'errors': errors[:20],
+        'operations': summarize(timings, wall_seconds),
+    }
+
+def parse_mix(text):
+    """An operation mix such as 'status=0.6,create=0.2,assign=0.2'."""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name.strip()}', expected one of {', '.join(OPERATIONS)}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the app's data operations with many concurrent sessions.")
+    parser.add_argument('--sessions', type=int, default=DEFAULT_SESSIONS)
+    parser.add_argument('--ops', type=int, default=DEFAULT_OPS_PER_SESSION, help="operations per session")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="operation weights, e.g. status=0.6,create=0.2,assign=0.1,upload=0.05,optimize=0.05")
+    parser.add_argument('--orders', type=int, default=DEFAULT_INITIAL_ORDERS, help="orders in the store at the start")
+    parser.add_argument('--hot-orders', type=int, default=DEFAULT_HOT_ORDERS,
+                        help="seeded orders the sessions' status updates share")
+    parser.add_argument('--store', choices=list(STORE_FILES), default='sqlite',
+                        help="orders store to test: the SQLite store, or the old CSV file as a baseline")
+    parser.add_argument('--unguarded', action='store_true',
+                        help="write status updates without checking the status read, as the app used to")
+    parser.add_argument('--mode', choices=['threads', 'processes'], default='threads')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--optimize-seconds', type=float, default=DEFAULT_OPTIMIZE_SECONDS)
+    parser.add_argument('--output', default=None, help="JSON file to write (default: data/loadtests/<time>.json)")
+    args = parser.parse_args()
+
+    report = run_load_test(args.sessions, args.ops, args.mix, args.orders, args.mode, args.seed, args.optimize_seconds,
+                           args.store, args.hot_orders, not args.unguarded)
+    print(f"{report['sessions']} sessions x {report['ops_per_session']} operations on the {report['store']} store "
+          f"({report['mode']}) in {report['wall_seconds']:.1f}s")
+    for row in report['operations']:
+        print(f"{row['operation']:>9} {row['count']:>6} ops, {row['errors']:>3} errors, p50 {row['p50_ms']:8.1f} ms, "
+              f"p99 {row['p99_ms']:8.1f} ms, {row['throughput_per_second']:7.1f}/s")
+    if report['lost_updates'] is None:
+        print("Lost writes: unknown, the store could not be read back")
+    else:
+        print(f"Lost updates: {report['lost_updates']}, lost inserts: {report['lost_inserts']}")
+    print(f"Rejected conflicting updates: {report['conflicts']}")
+    for error in report['errors']:
+        print(f"Error: {error}")
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Wrote the report to {output}")
+
+if __name__ == "__main__":
+    main()
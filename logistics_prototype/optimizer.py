@@ -1,7 +1,30 @@
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 import pandas as pd
+import numpy as np
 import math
+import time
+from itertools import accumulate
+from instrumentation import metrics, span, timed
+
+# Radius of earth in kilometers
+EARTH_RADIUS_KM = 6371
+
+# Rows of the distance matrix computed per block by haversine_matrix
+DEFAULT_BLOCK_SIZE = 256
+
+# Average travel speed used to turn distances into travel times
+DEFAULT_SPEED_KMPH = 25
+
+# Decimal places kept when merging duplicate coordinates (~0.1 m)
+COORDINATE_PRECISION = 6
+
+# Wall-clock budget applied when a metaheuristic is requested without any limit,
+# since guided local search and friends otherwise never stop on their own
+DEFAULT_TIME_LIMIT_SECONDS = 10
+
+# Largest pickup-and-delivery model built with parallel cheapest insertion
+PARALLEL_INSERTION_MAX_PAIRS = 100
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
@@ -18,41 +41,282 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
     c = 2 * math.asin(math.sqrt(a))
     
-    # Radius of earth in kilometers
-    r = 6371
-    return c * r
+    return c * EARTH_RADIUS_KM
+
+def haversine_vector(lat1, lon1, lat2, lon2):
+    """
+    Calculate the great circle distance between arrays of point pairs
+    (specified in decimal degrees), element by element.
+    Returns distances in kilometers
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(values, dtype=np.float64)) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))) * EARTH_RADIUS_KM
+
+def haversine_cross_matrix(from_coordinates, to_coordinates, dtype=np.int32):
+    """
+    Calculate the great circle distance from every [lat, lon] point of one
+    list to every point of another.
+    Returns a len(from) x len(to) matrix of distances in meters, truncated to integers
+    """
+    from_coords = np.radians(np.asarray(from_coordinates, dtype=np.float64).reshape(-1, 2))
+    to_coords = np.radians(np.asarray(to_coordinates, dtype=np.float64).reshape(-1, 2))
+    dlat = to_coords[:, 0] - from_coords[:, 0, None]
+    dlon = to_coords[:, 1] - from_coords[:, 1, None]
+    a = np.sin(dlat / 2) ** 2 + np.cos(from_coords[:, 0, None]) * np.cos(to_coords[:, 0]) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return (c * EARTH_RADIUS_KM * 1000).astype(dtype)
+
+def haversine_matrix(coordinates, block_size=DEFAULT_BLOCK_SIZE, dtype=np.int32):
+    """
+    Calculate the pairwise great circle distances between a list of
+    [lat, lon] points in one batch.
+    Returns a contiguous square matrix of distances in meters, truncated to
+    integers for OR-Tools. Only the upper triangle is computed, `block_size`
+    rows at a time, and mirrored into the lower half so memory for the
+    temporaries stays bounded for very large stop counts.
+    """
+    coords = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    num_locations = len(coords)
+    block_size = max(1, int(block_size or num_locations or 1))
+
+    matrix = np.zeros((num_locations, num_locations), dtype=dtype)
+    for start in range(0, num_locations, block_size):
+        stop = min(start + block_size, num_locations)
+        # Distances from this block of rows to every column at or after it
+        block = haversine_cross_matrix(coords[start:stop], coords[start:], dtype=dtype)
+        matrix[start:stop, start:] = block
+        matrix[start:, start:stop] = block.T
+    np.fill_diagonal(matrix, 0)
+    return matrix
+
+# Function turning a list of [lat, lon] points into a square distance matrix
+# in meters; replaced through set_matrix_provider (e.g. by a caching wrapper)
+_matrix_provider = haversine_matrix
+
+def set_matrix_provider(provider):
+    """Use `provider(addresses)` to build every distance matrix; returns the previous provider."""
+    global _matrix_provider
+    previous, _matrix_provider = _matrix_provider, provider
+    return previous
 
-def create_data_model(addresses):
+def build_distance_matrix(addresses):
+    """Build the distance matrix (meters, integer for OR-Tools) with the current provider."""
+    with span('distance_matrix', stops=len(addresses)):
+        return np.array(_matrix_provider(addresses))
+
+def index_locations(coordinates, precision=COORDINATE_PRECISION):
+    """
+    Merge duplicate coordinates ([lat, lon], or any fixed-length sequence of
+    numbers) through a hash index.
+    Returns the unique locations in first-seen order and, for every input
+    coordinate, the position of its unique location.
+    """
+    index = {}
+    unique_locations = []
+    positions = []
+    for coordinate in coordinates:
+        key = tuple(round(float(value), precision) for value in coordinate)
+        position = index.get(key)
+        if position is None:
+            position = index[key] = len(unique_locations)
+            unique_locations.append([float(value) for value in coordinate])
+        positions.append(position)
+    return unique_locations, positions
+
+def create_data_model(addresses, num_vehicles=1, depot=0, demands=None,
+                      vehicle_capacities=None, max_route_distance_km=None,
+                      time_windows=None, speed_kmph=DEFAULT_SPEED_KMPH):
     """Create the data model for the problem."""
     data = {}
     data['addresses'] = addresses
-    data['num_vehicles'] = 1
-    data['depot'] = 0
+    data['num_vehicles'] = num_vehicles
+    data['depot'] = depot
     
-    # Create distance matrix
-    num_locations = len(addresses)
-    data['distance_matrix'] = []
-    
-    for i in range(num_locations):
-        row = []
-        for j in range(num_locations):
-            if i == j:
-                distance = 0
-            else:
-                # Calculate actual distance between coordinates
-                lat1, lon1 = addresses[i]
-                lat2, lon2 = addresses[j]
-                distance = haversine_distance(lat1, lon1, lat2, lon2)
-                # Convert to meters and round to integer for OR-Tools
-                distance = int(distance * 1000)
-            row.append(distance)
-        data['distance_matrix'].append(row)
+    # Create distance matrix (meters, integer for OR-Tools)
+    data['distance_matrix'] = build_distance_matrix(addresses)
+
+    # Capacity: every stop carries one order unless told otherwise. With
+    # several vehicles and no explicit capacity, split the stops evenly so
+    # each partner gets a share of the work.
+    if demands is None and vehicle_capacities is None and num_vehicles > 1:
+        demands = [0 if node == depot else 1 for node in range(len(addresses))]
+        vehicle_capacities = -(-(len(addresses) - 1) // num_vehicles)
+    if demands is not None:
+        if vehicle_capacities is None:
+            vehicle_capacities = sum(demands)
+        if not isinstance(vehicle_capacities, (list, tuple)):
+            vehicle_capacities = [vehicle_capacities] * num_vehicles
+        data['demands'] = [int(demand) for demand in demands]
+        data['vehicle_capacities'] = [int(capacity) for capacity in vehicle_capacities]
+
+    # Maximum distance a single vehicle may travel, in meters
+    if max_route_distance_km is not None:
+        data['max_route_distance'] = int(max_route_distance_km * 1000)
+
+    # Time windows are (earliest, latest) arrival in seconds from shift start
+    if time_windows is not None:
+        meters_per_second = speed_kmph * 1000 / 3600
+        data['time_matrix'] = (data['distance_matrix'] / meters_per_second).astype(np.int64)
+        data['time_windows'] = [(int(start), int(end)) for start, end in time_windows]
     
     return data
 
-def get_solution(data, manager, routing, solution):
+def create_pickup_delivery_data_model(pickups, drops, num_vehicles=1, depot=None,
+                                      vehicle_capacities=None, max_route_distance_km=None,
+                                      max_orders_per_vehicle=None):
+    """
+    Create the data model for a pickup-and-delivery problem.
+    Every order adds a pickup node and a drop node; orders with the same pickup
+    and drop locations share that pair of nodes. Orders that only share one
+    end keep their own nodes (at zero distance from each other), since OR-Tools'
+    insertion heuristics break down when one node belongs to several pairs.
+    Without a depot, vehicles start and end at a virtual depot that is zero
+    distance from every stop.
+    `vehicle_capacities` limits the orders on board at once;
+    `max_orders_per_vehicle` the orders each vehicle takes over the whole route.
+    """
+    lanes, lane_positions = index_locations([list(pickup) + list(drop) for pickup, drop in zip(pickups, drops)])
+    unique_pickups = [lane[:2] for lane in lanes]
+    unique_drops = [lane[2:] for lane in lanes]
+    first_drop_node = 1 + len(lanes)
+
+    data = {}
+    data['addresses'] = [list(depot) if depot is not None else unique_pickups[0]] + unique_pickups + unique_drops
+    data['num_vehicles'] = num_vehicles
+    data['depot'] = 0
+
+    # Describe what happens at each node so routes can be mapped back to orders
+    data['nodes'] = [{'type': 'depot', 'location': data['addresses'][0], 'orders': []}]
+    data['nodes'] += [{'type': 'pickup', 'location': lane[:2], 'pair_location': lane[2:], 'orders': []} for lane in lanes]
+    data['nodes'] += [{'type': 'delivery', 'location': lane[2:], 'pair_location': lane[:2], 'orders': []} for lane in lanes]
+
+    demands = [0] * len(data['addresses'])
+    for order, lane in enumerate(lane_positions):
+        pickup_node = 1 + lane
+        drop_node = first_drop_node + lane
+        data['nodes'][pickup_node]['orders'].append(order)
+        data['nodes'][drop_node]['orders'].append(order)
+        demands[pickup_node] += 1
+        demands[drop_node] -= 1
+    data['pickups_deliveries'] = [(1 + lane, first_drop_node + lane) for lane in range(len(lanes))]
+
+    # Create distance matrix (meters, integer for OR-Tools)
+    data['distance_matrix'] = build_distance_matrix(data['addresses'])
+    if depot is None:
+        data['distance_matrix'][0, :] = 0
+        data['distance_matrix'][:, 0] = 0
+
+    if vehicle_capacities is not None:
+        if not isinstance(vehicle_capacities, (list, tuple)):
+            vehicle_capacities = [vehicle_capacities] * num_vehicles
+        data['demands'] = demands
+        data['vehicle_capacities'] = [int(capacity) for capacity in vehicle_capacities]
+
+    # Orders per vehicle: with several vehicles and no explicit limit, split
+    # them evenly. From a virtual depot one vehicle doing everything costs no
+    # more than any split, so the solver would otherwise leave partners idle.
+    order_counts = [len(node['orders']) if node['type'] == 'pickup' else 0 for node in data['nodes']]
+    if max_orders_per_vehicle is None and num_vehicles > 1:
+        # Room for one more lane than an even share needs, since the orders of
+        # a lane can't be split between vehicles
+        max_orders_per_vehicle = -(-len(pickups) // num_vehicles) + max(order_counts) - 1
+    if max_orders_per_vehicle is not None:
+        if not isinstance(max_orders_per_vehicle, (list, tuple)):
+            max_orders_per_vehicle = [max_orders_per_vehicle] * num_vehicles
+        data['order_counts'] = order_counts
+        data['max_orders'] = [int(max_orders) for max_orders in max_orders_per_vehicle]
+
+    if max_route_distance_km is not None:
+        data['max_route_distance'] = int(max_route_distance_km * 1000)
+
+    return data
+
+def create_routing_model(data):
+    """Create the routing index manager and model with the data model's dimensions."""
+    # Create the routing index manager
+    manager = pywrapcp.RoutingIndexManager(
+        len(data['addresses']), 
+        data['num_vehicles'], 
+        data['depot']
+    )
+    
+    # Create routing model
+    routing = pywrapcp.RoutingModel(manager)
+
+    # Hand the whole matrix to the solver so arc costs are evaluated natively
+    # instead of through a Python callback per arc
+    transit_callback_index = routing.RegisterTransitMatrix(data['distance_matrix'].tolist())
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    # Capacity constraint
+    if 'demands' in data:
+        demand_callback_index = routing.RegisterUnaryTransitVector(data['demands'])
+        routing.AddDimensionWithVehicleCapacity(
+            demand_callback_index,
+            0,  # null capacity slack
+            data['vehicle_capacities'],
+            True,  # start cumul to zero
+            'Capacity'
+        )
+
+    # Distance constraint; pickup-and-delivery also needs it for precedence
+    if 'max_route_distance' in data or 'pickups_deliveries' in data:
+        routing.AddDimension(
+            transit_callback_index,
+            0,  # no slack
+            data.get('max_route_distance', int(data['distance_matrix'].sum())),
+            True,  # start cumul to zero
+            'Distance'
+        )
+
+    # Pickup and delivery constraints: same vehicle, pickup before drop
+    if 'pickups_deliveries' in data:
+        distance_dimension = routing.GetDimensionOrDie('Distance')
+        solver = routing.solver()
+        for pickup_node, drop_node in data['pickups_deliveries']:
+            pickup_index = manager.NodeToIndex(pickup_node)
+            drop_index = manager.NodeToIndex(drop_node)
+            routing.AddPickupAndDelivery(pickup_index, drop_index)
+            solver.Add(routing.VehicleVar(pickup_index) == routing.VehicleVar(drop_index))
+            solver.Add(distance_dimension.CumulVar(pickup_index) <= distance_dimension.CumulVar(drop_index))
+
+    # Orders per vehicle over the whole route
+    if 'order_counts' in data:
+        count_callback_index = routing.RegisterUnaryTransitVector(data['order_counts'])
+        routing.AddDimensionWithVehicleCapacity(
+            count_callback_index,
+            0,  # null capacity slack
+            data['max_orders'],
+            True,  # start cumul to zero
+            'Orders'
+        )
+
+    # Time window constraint
+    if 'time_windows' in data:
+        time_callback_index = routing.RegisterTransitMatrix(data['time_matrix'].tolist())
+        horizon = max(end for _, end in data['time_windows'])
+        routing.AddDimension(
+            time_callback_index,
+            horizon,  # allow waiting time
+            horizon,  # maximum time per vehicle
+            False,  # don't force start cumul to zero
+            'Time'
+        )
+        time_dimension = routing.GetDimensionOrDie('Time')
+        for node, (start, end) in enumerate(data['time_windows']):
+            if node == data['depot']:
+                continue
+            time_dimension.CumulVar(manager.NodeToIndex(node)).SetRange(start, end)
+        depot_start, depot_end = data['time_windows'][data['depot']]
+        for vehicle_id in range(data['num_vehicles']):
+            time_dimension.CumulVar(routing.Start(vehicle_id)).SetRange(depot_start, depot_end)
+
+    return manager, routing
+
+def get_solution(data, manager, routing, solution, vehicle_id=0):
     """Extract solution information."""
-    index = routing.Start(0)
+    index = routing.Start(vehicle_id)
     route_distance = 0
     route = []
     
@@ -61,7 +325,7 @@ def get_solution(data, manager, routing, solution):
         route.append(node_index)
         previous_index = index
         index = solution.Value(routing.NextVar(index))
-        route_distance += routing.GetArcCostForVehicle(previous_index, index, 0)
+        route_distance += routing.GetArcCostForVehicle(previous_index, index, vehicle_id)
     
     # Add the final node
     route.append(manager.IndexToNode(index))
@@ -71,47 +335,399 @@ def get_solution(data, manager, routing, solution):
     
     return route, route_distance_km
 
-def optimize_route(addresses):
-    """Solve the Vehicle Routing Problem and return optimized route."""
+def get_current_routes(data, manager, routing):
+    """Routes (node indices) of the solution being reported, for use inside a solution callback."""
+    routes = []
+    for vehicle_id in range(data['num_vehicles']):
+        index = routing.Start(vehicle_id)
+        route = []
+        while not routing.IsEnd(index):
+            route.append(manager.IndexToNode(index))
+            index = routing.NextVar(index).Value()
+        route.append(manager.IndexToNode(index))
+        routes.append(route)
+    return routes
+
+def get_routes(data, manager, routing, solution):
+    """Extract the route and distance of every vehicle."""
+    routes = []
+    distances = []
+    for vehicle_id in range(data['num_vehicles']):
+        route, route_distance_km = get_solution(data, manager, routing, solution, vehicle_id)
+        routes.append(route)
+        distances.append(route_distance_km)
+    return routes, distances
+
+def create_search_parameters(data, solver_options=None):
+    """
+    Build OR-Tools search parameters from a solver options dict with the optional
+    keys 'first_solution_strategy', 'metaheuristic' (e.g. 'guided_local_search',
+    'tabu_search', 'simulated_annealing'), 'time_limit' in seconds and
+    'solution_limit'.
+    """
+    solver_options = solver_options or {}
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+
+    # Setting first solution heuristic
+    strategy = solver_options.get('first_solution_strategy')
+    if strategy is None:
+        # Insertion handles paired stops far better than arc-by-arc path building;
+        # the parallel variant finds better first routes but stalls for minutes
+        # beyond a few hundred orders
+        if 'pickups_deliveries' not in data:
+            strategy = 'path_cheapest_arc'
+        elif len(data['pickups_deliveries']) <= PARALLEL_INSERTION_MAX_PAIRS:
+            strategy = 'parallel_cheapest_insertion'
+        else:
+            strategy = 'local_cheapest_insertion'
+    search_parameters.first_solution_strategy = (
+        getattr(routing_enums_pb2.FirstSolutionStrategy, strategy.upper())
+    )
+
+    # Setting local search metaheuristic
+    metaheuristic = solver_options.get('metaheuristic')
+    if metaheuristic is not None:
+        search_parameters.local_search_metaheuristic = (
+            getattr(routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic.upper())
+        )
+
+    # Setting search limits
+    time_limit = solver_options.get('time_limit')
+    solution_limit = solver_options.get('solution_limit')
+    if metaheuristic is not None and time_limit is None and solution_limit is None:
+        time_limit = DEFAULT_TIME_LIMIT_SECONDS
+    if time_limit is not None:
+        search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+    if solution_limit is not None:
+        search_parameters.solution_limit = int(solution_limit)
+
+    return search_parameters
+
+def node_key(node):
+    """
+    Hashable key identifying a node across models: its rounded location, plus
+    its type and the other end of its order for pickup-and-delivery nodes.
+    """
+    if isinstance(node, dict):
+        pair_key = node_key(node['pair_location']) if node.get('pair_location') is not None else ()
+        return (node['type'],) + node_key(node['location']) + pair_key
+    lat, lon = node
+    return (round(float(lat), COORDINATE_PRECISION), round(float(lon), COORDINATE_PRECISION))
+
+def remap_routes(routes, previous_nodes, nodes, depot=0):
+    """
+    Translate routes solved over `previous_nodes` onto the node indices of
+    `nodes` (addresses, or pickup-and-delivery node descriptions).
+    Depot visits and stops that no longer exist are dropped.
+    """
+    index = {node_key(node): position for position, node in enumerate(nodes)}
+    remapped = []
+    for route in routes:
+        remapped_route = []
+        for previous_node in route:
+            if previous_node == depot:
+                continue
+            node = index.get(node_key(previous_nodes[previous_node]))
+            if node is not None and node != depot:
+                remapped_route.append(node)
+        remapped.append(remapped_route)
+    return remapped
+
+def cheapest_insertion(distance_matrix, depot, route, node, start=0, end=None):
+    """
+    Find where inserting `node` into a route (stops only, no depot) adds the
+    least distance, considering positions from `start` up to `end` (default:
+    the end of the route).
+    Returns the added distance and the position to insert at.
+    """
+    best_cost, best_position = None, None
+    end = len(route) if end is None else end
+    for position in range(start, end + 1):
+        previous_node = route[position - 1] if position > 0 else depot
+        next_node = route[position] if position < len(route) else depot
+        cost = (distance_matrix[previous_node][node] + distance_matrix[node][next_node]
+                - distance_matrix[previous_node][next_node])
+        if best_cost is None or cost < best_cost:
+            best_cost, best_position = cost, position
+    return best_cost, best_position
+
+def cheapest_pair_insertion(distance_matrix, depot, route, pickup_node, drop_node,
+                            loads=None, demand=0, capacity=None):
+    """
+    Find where inserting a pickup and its drop, drop after pickup, adds the least
+    distance to a route (stops only, no depot). With `loads` (load after each
+    stop) and a `capacity`, positions that would overload the vehicle are skipped.
+    Returns the added distance and the pickup and drop positions in the
+    original route, or (None, None, None) if nothing fits.
+    """
+    if capacity is None:
+        return _uncapacitated_pair_insertion(distance_matrix, depot, route, pickup_node, drop_node)
+    best_cost, best_pickup, best_drop = None, None, None
+    stops = [depot] + list(route) + [depot]
+    for pickup_position in range(len(route) + 1):
+        previous_node, next_node = stops[pickup_position], stops[pickup_position + 1]
+        load_before = loads[pickup_position - 1] if loads and pickup_position > 0 else 0
+        if capacity is not None and load_before + demand > capacity:
+            continue
+        pickup_cost = (distance_matrix[previous_node][pickup_node] + distance_matrix[pickup_node][next_node]
+                       - distance_matrix[previous_node][next_node])
+        segment_load = load_before
+        for drop_position in range(pickup_position, len(route) + 1):
+            if drop_position == pickup_position:
+                # Drop straight after the pickup
+                cost = (distance_matrix[previous_node][pickup_node] + distance_matrix[pickup_node][drop_node]
+                        + distance_matrix[drop_node][next_node] - distance_matrix[previous_node][next_node])
+            else:
+                # Every stop between pickup and drop carries the extra load
+                if loads:
+                    segment_load = max(segment_load, loads[drop_position - 1])
+                if capacity is not None and segment_load + demand > capacity:
+                    break
+                before, after = stops[drop_position], stops[drop_position + 1]
+                cost = pickup_cost + (distance_matrix[before][drop_node] + distance_matrix[drop_node][after]
+                                      - distance_matrix[before][after])
+            if best_cost is None or cost < best_cost:
+                best_cost, best_pickup, best_drop = cost, pickup_position, drop_position
+    return best_cost, best_pickup, best_drop
+
+def _uncapacitated_pair_insertion(distance_matrix, depot, route, pickup_node, drop_node):
+    """
+    cheapest_pair_insertion without a capacity, in linear time: the best drop
+    after each pickup position is the cheapest drop insertion further along.
+    """
+    distance_matrix = np.asarray(distance_matrix)
+    stops = np.array([depot] + list(route) + [depot])
+    before, after = stops[:-1], stops[1:]
+    direct = distance_matrix[before, after].astype(np.int64)
+    pickup_costs = distance_matrix[before, pickup_node] + distance_matrix[pickup_node, after] - direct
+    drop_costs = distance_matrix[before, drop_node] + distance_matrix[drop_node, after] - direct
+    # Drop straight after the pickup
+    adjacent_costs = (distance_matrix[before, pickup_node] + distance_matrix[pickup_node, drop_node]
+                      + distance_matrix[drop_node, after] - direct)
+    # Cheapest drop strictly after each pickup position
+    later_drop_costs = np.append(np.minimum.accumulate(drop_costs[::-1])[::-1][1:], np.iinfo(np.int64).max // 2)
+    costs = np.minimum(adjacent_costs, pickup_costs + later_drop_costs)
+    pickup_position = int(np.argmin(costs))
+    if adjacent_costs[pickup_position] <= pickup_costs[pickup_position] + later_drop_costs[pickup_position]:
+        return costs[pickup_position].item(), pickup_position, pickup_position
+    drop_position = pickup_position + 1 + int(np.argmin(drop_costs[pickup_position + 1:]))
+    return costs[pickup_position].item(), pickup_position, drop_position
+
+def complete_routes(data, routes):
+    """
+    Insert every node the routes do not visit yet at its cheapest position, so a
+    warm start covers the whole model. New pickup-and-delivery pairs are placed
+    together within vehicle capacity; other drops go after their pickups on the
+    same route.
+    """
+    routes = [list(route) for route in routes[:data['num_vehicles']]]
+    routes += [[] for _ in range(data['num_vehicles'] - len(routes))]
+    visited = {node for route in routes for node in route}
+    demands = data.get('demands')
+    capacities = data.get('vehicle_capacities')
+    order_counts = data.get('order_counts')
+    taken = [sum(order_counts[node] for node in route) for route in routes] if order_counts else None
+
+    # Pairs with neither stop routed yet are inserted together
+    pickups_of = {}
+    for pickup_node, drop_node in data.get('pickups_deliveries', []):
+        pickups_of.setdefault(drop_node, []).append(pickup_node)
+        if pickup_node in visited or drop_node in visited:
+            continue
+        # Vehicles still under their order limit first, any vehicle if none is
+        candidates = range(len(routes))
+        if taken is not None:
+            candidates = [vehicle_id for vehicle_id in candidates
+                          if taken[vehicle_id] + order_counts[pickup_node] <= data['max_orders'][vehicle_id]] or candidates
+        best = None
+        for vehicle_id in candidates:
+            route = routes[vehicle_id]
+            cost, pickup_position, drop_position = cheapest_pair_insertion(
+                data['distance_matrix'], data['depot'], route, pickup_node, drop_node,
+                loads=list(accumulate(demands[node] for node in route)) if demands else None,
+                demand=demands[pickup_node] if demands else 0,
+                capacity=capacities[vehicle_id] if capacities else None,
+            )
+            if cost is not None and (best is None or cost < best[0]):
+                best = (cost, vehicle_id, pickup_position, drop_position)
+        if best is None:
+            continue
+        _, vehicle_id, pickup_position, drop_position = best
+        routes[vehicle_id].insert(pickup_position, pickup_node)
+        routes[vehicle_id].insert(drop_position + 1, drop_node)
+        visited.update((pickup_node, drop_node))
+        if taken is not None:
+            taken[vehicle_id] += order_counts[pickup_node]
+
+    missing = [node for node in range(len(data['addresses'])) if node != data['depot'] and node not in visited]
+    # Pickups (and plain stops) first, so drops can be placed after them
+    missing.sort(key=lambda node: node in pickups_of)
+    for node in missing:
+        candidates = range(len(routes))
+        start = {}
+        if node in pickups_of:
+            placed = [(vehicle_id, route.index(pickup_node))
+                      for vehicle_id, route in enumerate(routes)
+                      for pickup_node in pickups_of[node] if pickup_node in route]
+            if placed:
+                vehicle_id = placed[0][0]
+                candidates = [vehicle_id]
+                start[vehicle_id] = max(position for placed_vehicle, position in placed if placed_vehicle == vehicle_id) + 1
+        best = None
+        for vehicle_id in candidates:
+            cost, position = cheapest_insertion(data['distance_matrix'], data['depot'], routes[vehicle_id], node, start.get(vehicle_id, 0))
+            if best is None or cost < best[0]:
+                best = (cost, vehicle_id, position)
+        routes[best[1]].insert(best[2], node)
+    return routes
+
+def solve(data, manager, routing, solver_options=None, initial_routes=None, solution_callback=None):
+    """
+    Solve a routing model built by create_routing_model.
+    When `initial_routes` (stops only, in node indices) are given, the search
+    starts from them instead of building a first solution from scratch.
+    `solution_callback(distance_km, routes)` is called with every improved solution.
+    """
+    search_parameters = create_search_parameters(data, solver_options)
+    start = time.perf_counter()
+
+    if solution_callback is not None:
+        # Local search also reports the worse solutions it moves through
+        best = [None]
+
+        def report_improvement():
+            cost = routing.CostVar().Value()
+            if best[0] is None or cost < best[0]:
+                best[0] = cost
+                solution_callback(cost / 1000.0, get_current_routes(data, manager, routing))
+        routing.AddAtSolutionCallback(report_improvement)
+
+    initial_solution = None
+    if initial_routes:
+        routing.CloseModelWithParameters(search_parameters)
+        initial_solution = routing.ReadAssignmentFromRoutes(
+            [[manager.NodeToIndex(node) for node in route] for route in complete_routes(data, initial_routes)],
+            True
+        )
+
+    # Fall back to a cold solve if the previous routes break a constraint
+    if initial_solution:
+        solution = routing.SolveFromAssignmentWithParameters(initial_solution, search_parameters)
+    else:
+        solution = routing.SolveWithParameters(search_parameters)
+
+    wall_seconds = time.perf_counter() - start
+    metrics.record_span('solve', wall_seconds)
+    metrics.record_solver_run(
+        wall_seconds=round(wall_seconds, 6),
+        status=routing_enums_pb2.RoutingSearchStatus.Value.Name(routing.status()),
+        objective=solution.ObjectiveValue() if solution else None,
+        branches=routing.solver().Branches(),
+        failures=routing.solver().Failures(),
+        nodes=len(data['addresses']),
+        vehicles=data['num_vehicles'],
+        warm_start=bool(initial_solution),
+    )
+    return solution
+
+@timed()
+def optimize_route(addresses, solver_options=None, warm_start=None, solution_callback=None):
+    """
+    Solve the Vehicle Routing Problem and return optimized route.
+    `warm_start` is an optional (route, addresses) pair from a previous solve;
+    `solution_callback` is passed on to solve.
+    """
     if len(addresses) < 2:
         return None, None
     
     # Create the data model
     data = create_data_model(addresses)
-    
-    # Create the routing index manager
-    manager = pywrapcp.RoutingIndexManager(
-        len(data['addresses']), 
-        data['num_vehicles'], 
-        data['depot']
-    )
-    
-    # Create routing model
-    routing = pywrapcp.RoutingModel(manager)
+    manager, routing = create_routing_model(data)
+    initial_routes = None
+    if warm_start is not None:
+        previous_route, previous_addresses = warm_start
+        initial_routes = remap_routes([previous_route], previous_addresses, addresses)
+    solution = solve(data, manager, routing, solver_options, initial_routes, solution_callback)
 
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
+    if solution:
+        return get_solution(data, manager, routing, solution)
+    else:
+        return None, None
 
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+@timed()
+def optimize_routes(addresses, num_vehicles, demands=None, vehicle_capacities=None,
+                    max_route_distance_km=None, time_windows=None,
+                    speed_kmph=DEFAULT_SPEED_KMPH, solver_options=None, warm_start=None,
+                    solution_callback=None):
+    """
+    Solve the Capacitated Vehicle Routing Problem for several vehicles at once.
+    Returns one route (list of node indices, starting and ending at the depot)
+    and one distance in kilometers per vehicle.
+    `warm_start` is an optional (routes, addresses) pair from a previous solve;
+    `solution_callback` is passed on to solve.
+    """
+    if len(addresses) < 2 or num_vehicles < 1:
+        return None, None
 
-    # Setting first solution heuristic
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    data = create_data_model(
+        addresses,
+        num_vehicles=num_vehicles,
+        demands=demands,
+        vehicle_capacities=vehicle_capacities,
+        max_route_distance_km=max_route_distance_km,
+        time_windows=time_windows,
+        speed_kmph=speed_kmph,
     )
-
-    # Solve the problem
-    solution = routing.SolveWithParameters(search_parameters)
+    manager, routing = create_routing_model(data)
+    initial_routes = None
+    if warm_start is not None:
+        previous_routes, previous_addresses = warm_start
+        initial_routes = remap_routes(previous_routes, previous_addresses, addresses)
+    solution = solve(data, manager, routing, solver_options, initial_routes, solution_callback)
 
     if solution:
-        return get_solution(data, manager, routing, solution)
+        return get_routes(data, manager, routing, solution)
     else:
         return None, None
 
+@timed()
+def optimize_pickup_delivery(pickups, drops, num_vehicles=1, depot=None,
+                             vehicle_capacities=None, max_route_distance_km=None,
+                             solver_options=None, warm_start=None, solution_callback=None,
+                             max_orders_per_vehicle=None):
+    """
+    Solve the Pickup and Delivery Problem for a list of orders, given as
+    parallel lists of pickup and drop [lat, lon] coordinates.
+    Returns one route and one distance in kilometers per vehicle, plus the
+    node descriptions (type, location and order positions) the routes index.
+    `warm_start` is an optional (routes, nodes) pair from a previous solve;
+    `solution_callback` is passed on to solve.
+    """
+    if len(pickups) < 1 or len(pickups) != len(drops) or num_vehicles < 1:
+        return None, None, None
+
+    data = create_pickup_delivery_data_model(
+        pickups,
+        drops,
+        num_vehicles=num_vehicles,
+        depot=depot,
+        vehicle_capacities=vehicle_capacities,
+        max_route_distance_km=max_route_distance_km,
+        max_orders_per_vehicle=max_orders_per_vehicle,
+    )
+    manager, routing = create_routing_model(data)
+    initial_routes = None
+    if warm_start is not None:
+        previous_routes, previous_nodes = warm_start
+        initial_routes = remap_routes(previous_routes, previous_nodes, data['nodes'])
+    solution = solve(data, manager, routing, solver_options, initial_routes, solution_callback)
+
+    if solution:
+        routes, distances = get_routes(data, manager, routing, solution)
+        return routes, distances, data['nodes']
+    else:
+        return None, None, None
+
 # Example usage and testing
 if __name__ == "__main__":
     # Test with some sample coordinates
@@ -124,4 +740,18 @@ if __name__ == "__main__":
     
     route, distance = optimize_route(test_addresses)
     print(f"Optimized route: {route}")
-    print(f"Total distance: {distance:.2f} km")
\ No newline at end of file
+    print(f"Total distance: {distance:.2f} km")
+
+    routes, distances = optimize_routes(test_addresses, num_vehicles=2)
+    for vehicle_id, (route, distance) in enumerate(zip(routes, distances)):
+        print(f"Vehicle {vehicle_id}: {route} ({distance:.2f} km)")
+
+    # Two orders from New Delhi, one from Gurgaon
+    routes, distances, nodes = optimize_pickup_delivery(
+        [test_addresses[0], test_addresses[0], test_addresses[2]],
+        [test_addresses[1], test_addresses[3], test_addresses[3]],
+        num_vehicles=2,
+    )
+    for vehicle_id, (route, distance) in enumerate(zip(routes, distances)):
+        stops = [f"{nodes[node]['type']} {nodes[node]['orders']}" for node in route[1:-1]]
+        print(f"Vehicle {vehicle_id}: {stops} ({distance:.2f} km)")
\ No newline at end of file
@@ -0,0 +1,165 @@
+import argparse
+from functools import partial
+import json
+import os
+import re
+import time
+import pandas as pd
+from optimizer import set_matrix_provider
+from clustering import DEFAULT_MAX_CLUSTER_SIZE, plan_clustered_routes
+from eta import DEFAULT_SERVICE_MINUTES, DEFAULT_SHIFT_START, shift_start_time
+from ingestion import DEFAULT_CHUNK_SIZE, ingest_orders_csv
+from jobs import JobStore
+from planning import apply_plan, plan_orders, route_stops
+from road_network import load_distance_cache
+from storage import OrderStore
+
+# Get the absolute path to the directory route files are written to
+ROUTES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'routes')
+
+# Solver time for a whole run, unless --budget says otherwise
+DEFAULT_BUDGET = '30s'
+
+DEFAULT_METAHEURISTIC = 'guided_local_search'
+
+# Seconds in each unit accepted by --budget
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_duration(text):
+    """Seconds in a duration such as '30s', '5m', '1.5h' or '90'."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*', str(text).lower())
+    if match is None:
+        raise ValueError(f"Invalid duration '{text}', expected e.g. 30s, 5m or 1h")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+def partner_names(partners):
+    """Partner names from a list of names, or 'Partner 1' to 'Partner N' for a count."""
+    if len(partners) == 1 and str(partners[0]).isdigit():
+        return [f'Partner {number}' for number in range(1, int(partners[0]) + 1)]
+    return list(partners)
+
+def cluster_time_limit(budget_seconds, num_orders, num_partners, max_cluster_size=DEFAULT_MAX_CLUSTER_SIZE,
+                       processes=None):
+    """
+    Solver time limit per model so that all of them fit in the budget.
+    Orders that fit in one model get the whole budget; otherwise clusters run
+    `processes` at a time and each round gets an equal share.
+    """
+    if num_orders <= max_cluster_size:
+        return budget_seconds
+    num_clusters = min(num_orders, max(num_partners, -(-num_orders // max_cluster_size)))
+    rounds = -(-num_clusters // (processes or os.cpu_count() or 1))
+    return budget_seconds / rounds
+
+def plan_routes(orders, partners, budget_seconds=parse_duration(DEFAULT_BUDGET), metaheuristic=DEFAULT_METAHEURISTIC,
+                shift_start=None, service_minutes=DEFAULT_SERVICE_MINUTES, max_cluster_size=DEFAULT_MAX_CLUSTER_SIZE,
+                processes=None, progress_callback=None, vehicle_capacities=None):
+    """
+    Plan routes for a DataFrame of orders (as prepared by ingestion), one per
+    partner, within a total solver time budget. Large order sets are split
+    into regions solved in parallel across `processes` cores.
+    `vehicle_capacities` limits the orders each partner carries at once.
+    Returns the plan (see planning.plan_orders), or None if no routes were found.
+    """
+    time_limit = cluster_time_limit(budget_seconds, len(orders), len(partners), max_cluster_size, processes)
+    solver_options = {'time_limit': time_limit, 'metaheuristic': metaheuristic}
+    plan_function = partial(plan_clustered_routes, max_cluster_size=max_cluster_size)
+    return plan_orders(orders, partners, solver_options=solver_options, shift_start=shift_start,
+                       service_minutes=service_minutes, plan_function=plan_function, processes=processes,
+                       progress_callback=progress_callback, vehicle_capacities=vehicle_capacities)
+
+def route_file_name(partner):
+    """File name of a partner's route, e.g. 'partner_a.csv'."""
+    return re.sub(r'[^a-z0-9]+', '_', partner.lower()).strip('_') + '.csv'
+
+def write_route_files(plan, output_dir=ROUTES_DIR):
+    """
+    Write one CSV of stops per partner with a route, and the whole plan as
+    plan.json. Returns the paths written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for vehicle_id, (partner, route) in enumerate(zip(plan['partners'], plan['routes'])):
+        if len(route) <= 2:
+            continue
+        path = os.path.join(output_dir, route_file_name(partner))
+        route_stops(plan, vehicle_id).to_csv(path, index=False)
+        paths.append(path)
+    path = os.path.join(output_dir, 'plan.json')
+    with open(path, 'w') as handle:
+        json.dump(plan, handle)
+    paths.append(path)
+    return paths
+
+def publish_plan(plan, store, jobs, params=None):
+    """
+    Assign the planned orders in the orders store and record the plan as a
+    finished job, so the app shows it as the latest optimized routes.
+    """
+    apply_plan(store, plan)
+    job_id = jobs.create('plan_routes', params)
+    now = time.time()
+    jobs.update(job_id, status='done', result=plan, started_at=now, finished_at=now)
+    return job_id
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan delivery routes for a batch of orders, outside the app.")
+    parser.add_argument('--orders', default=None,
+                        help="CSV of orders, as uploaded in the app (default: pending orders in the orders store)")
+    parser.add_argument('--partners', nargs='+', required=True, help="number of partners, or their names")
+    parser.add_argument('--budget', type=parse_duration, default=DEFAULT_BUDGET, help="total solver time, e.g. 30s, 5m or 1h")
+    parser.add_argument('--metaheuristic', default=DEFAULT_METAHEURISTIC)
+    parser.add_argument('--date', default=None, help="day the routes are driven, YYYY-MM-DD (default: today)")
+    parser.add_argument('--shift-start', default=DEFAULT_SHIFT_START)
+    parser.add_argument('--service-minutes', type=float, default=DEFAULT_SERVICE_MINUTES)
+    parser.add_argument('--capacity', type=int, default=None, help="orders a partner can carry at once")
+    parser.add_argument('--max-cluster-size', type=int, default=DEFAULT_MAX_CLUSTER_SIZE)
+    parser.add_argument('--processes', type=int, default=None, help="worker processes for regions (default: all cores)")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNK_SIZE, help="CSV rows read at a time")
+    parser.add_argument('--output', default=ROUTES_DIR, help="directory for the per-partner route files")
+    parser.add_argument('--store', action='store_true',
+                        help="add the orders to the orders store, assign them and show the plan in the app")
+    args = parser.parse_args()
+
+    partners = partner_names(args.partners)
+    budget_seconds = args.budget
+    distance_cache = load_distance_cache()
+    set_matrix_provider(distance_cache.matrix)
+    store = OrderStore() if args.store or args.orders is None else None
+
+    if args.orders is not None:
+        orders, failed_addresses = ingest_orders_csv(args.orders, chunksize=args.chunksize)
+        if failed_addresses:
+            print(f"Skipped orders with {len(failed_addresses)} addresses that could not be geocoded")
+    else:
+        orders = store.query(status='Pending')
+    if orders.empty:
+        print("No orders to plan.")
+        return 1
+
+    now = pd.Timestamp(args.date) if args.date else None
+    shift_start = shift_start_time(args.shift_start, now=now)
+    print(f"Planning {len(orders)} orders for {len(partners)} partners within {budget_seconds:g}s")
+    started = time.perf_counter()
+    plan = plan_routes(orders, partners, budget_seconds, args.metaheuristic, shift_start, args.service_minutes,
+                       args.max_cluster_size, args.processes,
+                       progress_callback=lambda done, total: print(f"Solved {done} of {total} regions"),
+                       vehicle_capacities=args.capacity)
+    if plan is None:
+        print("No routes could be found for these orders.")
+        return 1
+    print(f"Planned {sum(plan['distances']):.2f} km in {time.perf_counter() - started:.1f}s")
+    distance_cache.flush()
+
+    paths = write_route_files(plan, args.output)
+    print(f"Wrote {len(paths)} files to {args.output}")
+    if args.store:
+        if args.orders is not None:
+            store.insert_orders(orders)
+        publish_plan(plan, store, JobStore(), params={'orders': len(orders), 'partners': partners,
+                                                     'budget_seconds': budget_seconds, 'source': 'plan_routes.py'})
+        print("Saved the assignments and ETAs to the orders store")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,69 @@
+import pandas as pd
+from optimizer import COORDINATE_PRECISION, build_distance_matrix
+from clustering import plan_clustered_routes
+from eta import DEFAULT_SERVICE_MINUTES, format_eta, order_delivery_times, route_arrival_times, shift_start_time
+
+def plan_orders(orders, partners, solver_options=None, shift_start=None, service_minutes=DEFAULT_SERVICE_MINUTES,
+                warm_start=None, plan_function=plan_clustered_routes, processes=None,
+                solution_callback=None, progress_callback=None, vehicle_capacities=None):
+    """
+    Plan pickup-and-delivery routes for a DataFrame of orders (id and
+    coordinate columns), one route per partner, with per-stop ETAs.
+    `vehicle_capacities` limits the orders each partner carries at once.
+    Returns a JSON-serializable plan, or None if no routes could be found.
+    """
+    # Compact (float32) coordinates are rounded back to their stored precision
+    pickups = orders[['lat_pick', 'lon_pick']].astype('float64').round(COORDINATE_PRECISION).values.tolist()
+    drops = orders[['lat_drop', 'lon_drop']].astype('float64').round(COORDINATE_PRECISION).values.tolist()
+    routes, distances, nodes = plan_function(
+        pickups, drops, num_vehicles=len(partners), solver_options=solver_options, processes=processes,
+        warm_start=warm_start, solution_callback=solution_callback, progress_callback=progress_callback,
+        vehicle_capacities=vehicle_capacities,
+    )
+    if not routes:
+        return None
+
+    # Each order goes to the partner whose route picks it up
+    assigned_to = [None] * len(orders)
+    for partner, route in zip(partners, routes):
+        for node in route[1:-1]:
+            for order in nodes[node]['orders']:
+                assigned_to[order] = partner
+
+    # Per-stop arrival times; each order's ETA is its drop's arrival
+    shift_start = shift_start_time() if shift_start is None else pd.Timestamp(shift_start)
+    arrival_times = route_arrival_times(routes, nodes, shift_start=shift_start, service_minutes=service_minutes,
+                                        matrix_provider=build_distance_matrix)
+    order_etas = format_eta(order_delivery_times(routes, nodes, arrival_times, len(orders)))
+    return {
+        'order_ids': orders['id'].tolist(),
+        'partners': list(partners),
+        'routes': [[int(node) for node in route] for route in routes],
+        'distances': [float(distance) for distance in distances],
+        'nodes': nodes,
+        'assigned_to': assigned_to,
+        'eta': list(order_etas),
+        'stop_etas': [list(format_eta(route_arrivals)) for route_arrivals in arrival_times],
+        'shift_start': shift_start.strftime('%Y-%m-%d %H:%M:%S'),
+        'service_minutes': service_minutes,
+    }
+
+def apply_plan(store, plan):
+    """Write every routed order's partner and ETA to the orders store; returns how many."""
+    routed = [(order_id, partner, eta) for order_id, partner, eta
+              in zip(plan['order_ids'], plan['assigned_to'], plan['eta']) if partner is not None]
+    store.set_column('assigned_to', {order_id: partner for order_id, partner, _ in routed})
+    store.set_column('eta', {order_id: eta for order_id, _, eta in routed if eta != 'N/A'})
+    return len(routed)
+
+def route_stops(plan, vehicle_id):
+    """One partner's stops in visiting order, with coordinates, ETA and order ids."""
+    route = plan['routes'][vehicle_id]
+    nodes = plan['nodes']
+    return pd.DataFrame({
+        'Stop': [nodes[node]['type'].title() for node in route[1:-1]],
+        'Latitude': [nodes[node]['location'][0] for node in route[1:-1]],
+        'Longitude': [nodes[node]['location'][1] for node in route[1:-1]],
+        'ETA': plan['stop_etas'][vehicle_id],
+        'Orders': [', '.join(plan['order_ids'][order] for order in nodes[node]['orders']) for node in route[1:-1]],
+    })
@@ -0,0 +1,314 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+from optimizer import haversine_cross_matrix, haversine_vector
+from route_cache import DistanceCache, get_default_distance_cache
+from spatial_index import unit_vectors
+
+# Get the absolute paths to the offline road graph and its preprocessed CSR cache.
+# road_nodes.csv has columns id, lat, lon; road_edges.csv has source, target,
+# length_m and an optional oneway flag (e.g. exported from an OSM extract).
+ROAD_NODES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'road_nodes.csv')
+ROAD_EDGES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'road_edges.csv')
+ROAD_GRAPH_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'road_graph.npz')
+
+# Get the absolute path to the hub index of the road graph (built on first use)
+ROAD_HUBS_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'road_hubs.npz')
+
+# Get the absolute path to the cache of road distances between stops
+ROAD_DISTANCE_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'road_distance_cache.npz')
+
+# Straight-line distance is scaled by this for stops the graph can't connect
+DETOUR_FACTOR = 1.4
+
+# Road graph around the stops searched by Dijkstra, as a margin in degrees
+# around their bounding box (about 5 km in Delhi, so it covers SEARCH_LIMIT_M)
+SEARCH_MARGIN_DEGREES = 0.05
+
+# Distances Dijkstra fills in per call (sources x graph nodes); bounds memory
+SOURCE_BLOCK_ELEMENTS = 16_000_000
+
+# Searches up to this many sources x graph nodes run to completion and are
+# exact; bigger ones search SEARCH_LIMIT_M around every stop and go through
+# the hub index beyond that (about 1.5 s for 1,000 stops on 100k nodes)
+EXACT_SEARCH_MAX_WORK = 10_000_000
+
+# Road distance searched around each stop in the bounded search, in meters.
+# Pairs closer than this are exact; farther ones go via the hubs near each end
+SEARCH_LIMIT_M = 5000
+
+# Spacing of the hub grid, in meters. Distances between every pair of hubs
+# are computed once per graph (one full Dijkstra per hub) and cached on disk
+HUB_SPACING_M = 1500
+
+# Stops whose nearby hubs are remembered between searches
+ACCESS_CACHE_SIZE = 20_000
+
+METERS_PER_DEGREE = 111_320
+
+def build_csr(num_nodes, sources, targets, lengths):
+    """
+    Build CSR adjacency arrays (indptr, indices, lengths) for a directed graph,
+    keeping the shortest of any parallel edges.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    # Zero weights would read as missing edges in a sparse matrix
+    lengths = np.maximum(np.asarray(lengths, dtype=np.float64), 0.1)
+    order = np.lexsort((lengths, targets, sources))
+    sources, targets, lengths = sources[order], targets[order], lengths[order]
+    first = np.ones(len(sources), dtype=bool)
+    first[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+    sources, targets, lengths = sources[first], targets[first], lengths[first]
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_nodes), out=indptr[1:])
+    return indptr, targets, lengths
+
+def shortest_paths(graph, from_nodes, to_nodes, limit=np.inf):
+    """
+    Shortest path lengths from every node of `from_nodes` to every node of
+    `to_nodes`, with one Dijkstra per distinct source, a block at a time.
+    With `limit` (meters) each search stops there; farther nodes are inf.
+    """
+    sources, source_rows = np.unique(from_nodes, return_inverse=True)
+    road = np.empty((len(sources), len(to_nodes)), dtype=np.float64)
+    source_block = max(1, SOURCE_BLOCK_ELEMENTS // max(1, graph.shape[0]))
+    for start in range(0, len(sources), source_block):
+        block = sources[start:start + source_block]
+        road[start:start + len(block)] = dijkstra(graph, directed=True, indices=block, limit=limit)[:, to_nodes]
+    return road[source_rows]
+
+def via_hubs(out_access, in_access, hub_matrix, block=256):
+    """
+    Shortest distances from sources to targets through one hub near each end:
+    min over hubs h1, h2 of source->h1 + h1->h2 + h2->target. `out_access`
+    and `in_access` hold the (hub numbers, distances) near each source and
+    target. Returns a len(out_access) x len(in_access) matrix (inf if none).
+    """
+    via = np.full((len(out_access), len(in_access)), np.inf)
+    for start in range(0, len(out_access), block):
+        # Distance from each source of the block to every hub
+        to_hubs = np.full((len(out_access[start:start + block]), len(hub_matrix)), np.inf)
+        for row, (hubs, distances) in enumerate(out_access[start:start + block]):
+            if len(hubs):
+                to_hubs[row] = (distances[:, None] + hub_matrix[hubs]).min(axis=0)
+        for column, (hubs, distances) in enumerate(in_access):
+            if len(hubs):
+                via[start:start + len(to_hubs), column] = (to_hubs[:, hubs] + distances).min(axis=1)
+    return via
+
+class RoadNetwork:
+    """
+    Directed road graph in CSR form answering many-to-many shortest path
+    distances (meters) between arbitrary [lat, lon] points. Points are snapped
+    to their nearest graph node; the snap distance is added at both ends.
+    Small searches run Dijkstra to completion. Big ones search only
+    `search_limit_m` around each stop, and reach farther stops through a grid
+    of hubs whose distances to each other are computed once and kept in
+    `hub_cache_file`; those distances are real routes, at most a short detour
+    through the hubs longer than the shortest.
+    Use `network.cross_matrix` / `network.matrix` as a matrix provider.
+    """
+
+    def __init__(self, node_coordinates, indptr, indices, lengths, hub_cache_file=None,
+                 search_limit_m=SEARCH_LIMIT_M, hub_spacing_m=HUB_SPACING_M):
+        self.node_coordinates = np.asarray(node_coordinates, dtype=np.float64).reshape(-1, 2)
+        self.graph = csr_matrix((lengths, indices, indptr), shape=(len(self.node_coordinates),) * 2)
+        self.hub_cache_file = hub_cache_file
+        self.search_limit_m = search_limit_m
+        self.hub_spacing_m = hub_spacing_m
+        digest = hashlib.sha256()
+        for array in (self.node_coordinates, indptr, indices, lengths):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        # Changes whenever the graph does; used to key caches of its distances
+        self.signature = 'road:' + digest.hexdigest()
+        self._tree = None
+        self._reverse = None
+        self._hubs = None
+        # Nearby hubs of stops already searched, by direction and graph node
+        self._access = {}
+
+    def snap(self, coordinates):
+        """Return the nearest graph node of every point and the distance to it in meters."""
+        points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        if self._tree is None:
+            self._tree = cKDTree(unit_vectors(self.node_coordinates))
+        _, nearest = self._tree.query(unit_vectors(points))
+        nearest = np.asarray(nearest, dtype=np.int64).reshape(-1)
+        snapped = self.node_coordinates[nearest]
+        offsets = haversine_vector(points[:, 0], points[:, 1], snapped[:, 0], snapped[:, 1]) * 1000
+        return nearest, offsets
+
+    def _search_graph(self, points):
+        """Subgraph within SEARCH_MARGIN_DEGREES of the points, and its node numbers."""
+        low = points.min(axis=0) - SEARCH_MARGIN_DEGREES
+        high = points.max(axis=0) + SEARCH_MARGIN_DEGREES
+        keep = np.flatnonzero(((self.node_coordinates >= low) & (self.node_coordinates <= high)).all(axis=1))
+        renumber = np.full(len(self.node_coordinates), -1, dtype=np.int64)
+        renumber[keep] = np.arange(len(keep))
+        return self.graph[keep][:, keep], renumber
+
+    def hubs(self):
+        """
+        Hub nodes, one near every point of a `hub_spacing_m` grid over the
+        graph, and the shortest distances between every pair of them. Loaded
+        from `hub_cache_file`, or computed and written there.
+        """
+        if self._hubs is not None:
+            return self._hubs
+        if self.hub_cache_file and os.path.exists(self.hub_cache_file):
+            with np.load(self.hub_cache_file) as cached:
+                if str(cached['signature']) == self.signature and float(cached['spacing']) == self.hub_spacing_m:
+                    self._hubs = cached['hubs'], cached['hub_matrix']
+                    return self._hubs
+
+        low, high = self.node_coordinates.min(axis=0), self.node_coordinates.max(axis=0)
+        lat_step = self.hub_spacing_m / METERS_PER_DEGREE
+        lon_step = lat_step / np.cos(np.radians((low[0] + high[0]) / 2))
+        lats, lons = np.meshgrid(np.arange(low[0], high[0] + lat_step, lat_step),
+                                 np.arange(low[1], high[1] + lon_step, lon_step), indexing='ij')
+        grid = np.column_stack([lats.ravel(), lons.ravel()])
+        nodes, offsets = self.snap(grid)
+        # Grid points with no road nearby get no hub
+        hubs = np.unique(nodes[offsets <= self.hub_spacing_m / 2])
+        hub_matrix = shortest_paths(self.graph, hubs, hubs).astype(np.float32)
+        if self.hub_cache_file:
+            os.makedirs(os.path.dirname(self.hub_cache_file), exist_ok=True)
+            temporary = f'{self.hub_cache_file}.{os.getpid()}.tmp'
+            with open(temporary, 'wb') as handle:
+                np.savez(handle, signature=self.signature, spacing=self.hub_spacing_m, hubs=hubs, hub_matrix=hub_matrix)
+            os.replace(temporary, self.hub_cache_file)
+        self._hubs = hubs, hub_matrix
+        return self._hubs
+
+    def _access_hubs(self, direction, graph, renumber, nodes):
+        """
+        (hub numbers, distances) of the hubs within the search limit of each
+        graph node, from it ('out') or to it ('in'), searching only for nodes
+        not seen before.
+        """
+        hubs, _ = self.hubs()
+        inside = np.flatnonzero(renumber[hubs] >= 0)
+        missing = np.unique([node for node in nodes if (direction, node) not in self._access])
+        if len(missing):
+            if len(self._access) + len(missing) > ACCESS_CACHE_SIZE:
+                self._access = {}
+            if direction == 'in':
+                if self._reverse is None or self._reverse[0] is not graph:
+                    self._reverse = graph, graph.T.tocsr()
+                graph = self._reverse[1]
+            distances = shortest_paths(graph, renumber[missing], renumber[hubs[inside]], limit=self.search_limit_m)
+            for node, row in zip(missing, distances):
+                reached = np.isfinite(row)
+                self._access[(direction, node)] = inside[reached], row[reached]
+        return [self._access[(direction, node)] for node in nodes]
+
+    def _bounded_paths(self, graph, renumber, from_nodes, to_nodes):
+        """
+        Road distances between graph nodes (full graph numbers): exact up to
+        the search limit, through the hubs beyond it.
+        """
+        if len(np.unique(to_nodes)) < len(np.unique(from_nodes)):
+            reverse = graph.T.tocsr()
+            self._reverse = graph, reverse
+            road = shortest_paths(reverse, renumber[to_nodes], renumber[from_nodes], limit=self.search_limit_m).T
+        else:
+            road = shortest_paths(graph, renumber[from_nodes], renumber[to_nodes], limit=self.search_limit_m)
+        far = ~np.isfinite(road)
+        if far.any():
+            rows, columns = np.flatnonzero(far.any(axis=1)), np.flatnonzero(far.any(axis=0))
+            via = via_hubs(self._access_hubs('out', graph, renumber, from_nodes[rows]),
+                           self._access_hubs('in', graph, renumber, to_nodes[columns]), self.hubs()[1])
+            road[np.ix_(rows, columns)] = np.minimum(road[np.ix_(rows, columns)], via)
+        return road
+
+    def cross_matrix(self, from_coordinates, to_coordinates, dtype=np.int32):
+        """
+        Shortest road distances from every [lat, lon] point of one list to every
+        point of another. Returns a len(from) x len(to) matrix in meters.
+        """
+        from_points = np.asarray(from_coordinates, dtype=np.float64).reshape(-1, 2)
+        to_points = np.asarray(to_coordinates, dtype=np.float64).reshape(-1, 2)
+        if len(from_points) == 0 or len(to_points) == 0:
+            return np.zeros((len(from_points), len(to_points)), dtype=dtype)
+
+        from_nodes, from_offsets = self.snap(from_points)
+        to_nodes, to_offsets = self.snap(to_points)
+        graph, renumber = self._search_graph(np.vstack([
+            from_points, to_points, self.node_coordinates[from_nodes], self.node_coordinates[to_nodes]]))
+
+        searches = min(len(np.unique(from_nodes)), len(np.unique(to_nodes)))
+        if self.search_limit_m is not None and searches * graph.shape[0] > EXACT_SEARCH_MAX_WORK:
+            road = self._bounded_paths(graph, renumber, from_nodes, to_nodes)
+        elif len(np.unique(to_nodes)) < len(np.unique(from_nodes)):
+            # Fewer targets: search backwards from them on the reversed graph
+            road = shortest_paths(graph.T.tocsr(), renumber[to_nodes], renumber[from_nodes]).T
+        else:
+            road = shortest_paths(graph, renumber[from_nodes], renumber[to_nodes])
+
+        distances = from_offsets[:, None] + road + to_offsets
+        straight = haversine_cross_matrix(from_points, to_points, dtype=np.float64)
+        # Points snapped to the same node are closer as the crow flies than via it
+        same_node = from_nodes[:, None] == to_nodes
+        distances[same_node] = straight[same_node]
+        unreachable = ~np.isfinite(distances)
+        distances[unreachable] = straight[unreachable] * DETOUR_FACTOR
+        return distances.astype(dtype)
+
+    def matrix(self, coordinates):
+        """Square road distance matrix for a list of [lat, lon] points."""
+        return self.cross_matrix(coordinates, coordinates)
+
+def load_road_network(nodes_file=ROAD_NODES_FILE, edges_file=ROAD_EDGES_FILE, cache_file=ROAD_GRAPH_CACHE_FILE,
+                      hub_cache_file=ROAD_HUBS_CACHE_FILE):
+    """
+    Load the offline road graph, preprocessing the CSV extract into CSR arrays
+    cached on disk; the cache is rebuilt whenever the CSV files are newer.
+    The hub index for long distances is cached in `hub_cache_file`.
+    Returns None if there is no road graph.
+    """
+    if not (os.path.exists(nodes_file) and os.path.exists(edges_file)):
+        return None
+    source_mtime = max(os.path.getmtime(nodes_file), os.path.getmtime(edges_file))
+    if cache_file and os.path.exists(cache_file) and os.path.getmtime(cache_file) >= source_mtime:
+        with np.load(cache_file) as cached:
+            return RoadNetwork(cached['node_coordinates'], cached['indptr'], cached['indices'], cached['lengths'],
+                               hub_cache_file=hub_cache_file)
+
+    nodes = pd.read_csv(nodes_file, usecols=['id', 'lat', 'lon'])
+    edges = pd.read_csv(edges_file)
+    positions = pd.Series(np.arange(len(nodes)), index=nodes['id'])
+    # Drop edges to nodes missing from the extract
+    edges = edges[edges['source'].isin(positions.index) & edges['target'].isin(positions.index)]
+    sources = positions[edges['source']].values
+    targets = positions[edges['target']].values
+    lengths = edges['length_m'].values
+    # Two-way streets are stored once in the extract
+    if 'oneway' in edges.columns:
+        oneway = edges['oneway'].astype(str).str.strip().str.lower().isin(['1', 'true', 'yes']).values
+    else:
+        oneway = np.zeros(len(edges), dtype=bool)
+    sources, targets = np.concatenate([sources, targets[~oneway]]), np.concatenate([targets, sources[~oneway]])
+    lengths = np.concatenate([lengths, lengths[~oneway]])
+
+    node_coordinates = nodes[['lat', 'lon']].values.astype(np.float64)
+    indptr, indices, lengths = build_csr(len(nodes), sources, targets, lengths)
+    if cache_file:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temporary = f'{cache_file}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as handle:
+            np.savez(handle, node_coordinates=node_coordinates, indptr=indptr, indices=indices, lengths=lengths)
+        os.replace(temporary, cache_file)
+    return RoadNetwork(node_coordinates, indptr, indices, lengths, hub_cache_file=hub_cache_file)
+
+def load_distance_cache():
+    """Road distances from the offline graph when one is installed, straight-line otherwise."""
+    road_network = load_road_network()
+    if road_network is None:
+        return get_default_distance_cache()
+    return DistanceCache(path=ROAD_DISTANCE_CACHE_FILE, cross_matrix=road_network.cross_matrix,
+                         symmetric=False, signature=road_network.signature)
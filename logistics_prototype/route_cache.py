@@ -0,0 +1,264 @@
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from optimizer import COORDINATE_PRECISION, haversine_cross_matrix, haversine_matrix
+from instrumentation import increment
+
+# Get the absolute paths to the on-disk distance and route caches
+DISTANCE_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'distance_cache.npz')
+ROUTE_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'route_cache.sqlite')
+
+# Locations whose pairwise distances are kept; 5000 locations take 100 MB as int32
+DEFAULT_MAX_LOCATIONS = 5000
+
+# Solved plans kept in the in-process LRU in front of the disk cache
+DEFAULT_LRU_SIZE = 128
+
+# How long a solved plan stays valid on disk, in seconds
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+# Arguments that don't change the answer and are left out of the cache key
+UNKEYED_ARGUMENTS = {'warm_start', 'processes', 'solution_callback', 'progress_callback'}
+
+def round_coordinates(value, precision=COORDINATE_PRECISION):
+    """Round every float in a nested structure of lists, tuples and dicts."""
+    if isinstance(value, dict):
+        return {str(key): round_coordinates(item, precision) for key, item in sorted(value.items())}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [round_coordinates(item, precision) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return round(value, precision)
+    return value
+
+def cache_key(name, arguments):
+    """Stable sha256 key for a call, from its rounded coordinates and parameters."""
+    keyed = {key: value for key, value in arguments.items() if key not in UNKEYED_ARGUMENTS}
+    payload = json.dumps([name, round_coordinates(keyed)], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot cache a {type(value).__name__}")
+
+class DistanceCache:
+    """
+    Pairwise distances (meters) between every location seen so far, stored once
+    per location pair. A request with new locations only computes the new rows
+    and columns; the rest is read from the stored matrix.
+    Distances come from `cross_matrix(from, to)`, haversine by default; pass
+    `symmetric=False` for one-way costs such as road distances, and a
+    `signature` that changes whenever the cost model does.
+    Use `cache.matrix` as the optimizer's matrix provider. New locations are
+    kept in memory until `flush()`, which only the process that owns the cache
+    file should call, so worker processes never write it.
+    """
+
+    def __init__(self, path=DISTANCE_CACHE_FILE, max_locations=DEFAULT_MAX_LOCATIONS,
+                 cross_matrix=haversine_cross_matrix, symmetric=True, signature='haversine'):
+        self.path = path
+        self.max_locations = max_locations
+        self.cross_matrix = cross_matrix
+        self.symmetric = symmetric
+        self.signature = str(signature)
+        self._lock = threading.Lock()
+        self._locations = np.empty((0, 2), dtype=np.float64)
+        self._index = {}
+        self._matrix = np.empty((0, 0), dtype=np.int32)
+        self._dirty = False
+        if path and os.path.exists(path):
+            try:
+                with np.load(path) as stored:
+                    if str(stored['signature']) == self.signature:
+                        self._locations = stored['locations']
+                        self._matrix = stored['matrix']
+            except (OSError, KeyError, ValueError):
+                # A damaged cache file is rebuilt from scratch
+                self._locations = np.empty((0, 2), dtype=np.float64)
+                self._matrix = np.empty((0, 0), dtype=np.int32)
+            self._index = {tuple(location): i for i, location in enumerate(self._locations.tolist())}
+        self._buffer = self._matrix
+
+    def __len__(self):
+        return len(self._locations)
+
+    def matrix(self, coordinates):
+        """Return the square distance matrix for a list of [lat, lon] points."""
+        points = np.round(np.asarray(coordinates, dtype=np.float64).reshape(-1, 2), COORDINATE_PRECISION)
+        if len(points) > self.max_locations:
+            return self.cross_matrix(points, points)
+        with self._lock:
+            new_points = list(dict.fromkeys(tuple(point) for point in points.tolist() if tuple(point) not in self._index))
+            increment('distance_cache_new_locations', len(new_points))
+            if new_points:
+                if len(self._locations) + len(new_points) > self.max_locations:
+                    # Full: start over with just the locations asked for now
+                    self._locations = np.empty((0, 2), dtype=np.float64)
+                    self._index = {}
+                    self._matrix = self._buffer = np.empty((0, 0), dtype=np.int32)
+                    new_points = list(dict.fromkeys(tuple(point) for point in points.tolist()))
+                self._add(np.array(new_points, dtype=np.float64))
+                self._dirty = True
+            positions = np.array([self._index[tuple(point)] for point in points.tolist()], dtype=np.int64)
+            return self._matrix[np.ix_(positions, positions)]
+
+    def _add(self, new_locations):
+        """Grow the matrix by the rows and columns of `new_locations`."""
+        old_count = len(self._locations)
+        to_new = self.cross_matrix(self._locations, new_locations)
+        from_new = to_new.T if self.symmetric else self.cross_matrix(new_locations, self._locations)
+        if self.symmetric and self.cross_matrix is haversine_cross_matrix:
+            among_new = haversine_matrix(new_locations)
+        else:
+            among_new = self.cross_matrix(new_locations, new_locations)
+        new_count = old_count + len(new_locations)
+        if new_count > len(self._buffer):
+            # Grow with room to spare, so adding a few locations at a time
+            # doesn't copy the whole matrix every time
+            buffer = np.empty((min(max(new_count, 2 * len(self._buffer)), self.max_locations),) * 2, dtype=np.int32)
+            buffer[:old_count, :old_count] = self._matrix
+            self._buffer = buffer
+        matrix = self._buffer[:new_count, :new_count]
+        matrix[:old_count, old_count:] = to_new
+        matrix[old_count:, :old_count] = from_new
+        matrix[old_count:, old_count:] = among_new
+        self._matrix = matrix
+        self._locations = np.vstack([self._locations, new_locations])
+        for offset, location in enumerate(new_locations.tolist()):
+            self._index[tuple(location)] = old_count + offset
+
+    def save(self):
+        """Write the cache to disk, replacing the old file atomically."""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary, 'wb') as handle:
+            np.savez(handle, locations=self._locations, matrix=self._matrix, signature=self.signature)
+        os.replace(temporary, self.path)
+        self._dirty = False
+
+    def flush(self):
+        """Save the cache if locations were added since it was loaded or last saved."""
+        with self._lock:
+            if self._dirty:
+                self.save()
+
+    def clear(self):
+        with self._lock:
+            self._locations = np.empty((0, 2), dtype=np.float64)
+            self._index = {}
+            self._matrix = self._buffer = np.empty((0, 0), dtype=np.int32)
+            self._dirty = False
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+
+class RouteCache:
+    """
+    Solved plans keyed on a hash of the rounded stops and solver parameters,
+    in an in-process LRU with a SQLite table behind it.
+    """
+
+    def __init__(self, path=ROUTE_CACHE_FILE, lru_size=DEFAULT_LRU_SIZE, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.lru_size = lru_size
+        self.ttl_seconds = ttl_seconds
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS routes (key TEXT PRIMARY KEY, result TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self._connection.commit()
+
+    def _remember(self, key, result):
+        self._lru[key] = result
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get(self, key):
+        """Return (hit, result) for a cache key."""
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return True, self._lru[key]
+            row = self._connection.execute('SELECT result, updated_at FROM routes WHERE key = ?', (key,)).fetchone()
+            if row is None or time.time() - row[1] >= self.ttl_seconds:
+                return False, None
+            result = json.loads(row[0])
+            self._remember(key, result)
+            return True, result
+
+    def set(self, key, result):
+        """Store a JSON-serializable result under a cache key."""
+        result = json.loads(json.dumps(result, default=_to_json))
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO routes (key, result, updated_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(result), time.time())
+                )
+            self._remember(key, result)
+
+    def clear(self):
+        with self._lock:
+            with self._connection:
+                self._connection.execute('DELETE FROM routes')
+            self._lru.clear()
+
+    def close(self):
+        self._connection.close()
+
+def cached_solver(function, cache, signature=''):
+    """
+    Wrap an optimize_* style function so repeated calls with the same stops
+    and parameters return the stored plan. Failed solves (None) aren't stored.
+    `signature` names the distance model, so plans from another one aren't reused.
+    """
+    name = function.__name__
+    parameters = inspect.signature(function)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        arguments = parameters.bind(*args, **kwargs).arguments
+        key = cache_key(name, dict(arguments, distance_model=signature))
+        hit, result = cache.get(key)
+        increment('route_cache_hits' if hit else 'route_cache_misses')
+        if hit:
+            return tuple(result)
+        result = function(*args, **kwargs)
+        if result[0] is not None:
+            cache.set(key, list(result))
+        return result
+    return wrapper
+
+_default_distance_cache = None
+_default_route_cache = None
+_default_lock = threading.Lock()
+
+def get_default_distance_cache():
+    """Shared DistanceCache backed by data/distance_cache.npz."""
+    global _default_distance_cache
+    with _default_lock:
+        if _default_distance_cache is None:
+            _default_distance_cache = DistanceCache()
+        return _default_distance_cache
+
+def get_default_route_cache():
+    """Shared RouteCache backed by data/route_cache.sqlite."""
+    global _default_route_cache
+    with _default_lock:
+        if _default_route_cache is None:
+            _default_route_cache = RouteCache()
+        return _default_route_cache
@@ -0,0 +1,158 @@
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+from optimizer import EARTH_RADIUS_KM
+
+# Points added or removed since the last tree build before it is rebuilt;
+# until then new points are searched by brute force and removed ones skipped
+DEFAULT_BUFFER_SIZE = 256
+
+def unit_vectors(coordinates):
+    """[lat, lon] degrees as points on the unit sphere, one row each."""
+    coordinates = np.radians(np.asarray(coordinates, dtype=np.float64).reshape(-1, 2))
+    lat, lon = coordinates[:, 0], coordinates[:, 1]
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def chord_length(distance_km):
+    """Straight-line distance through the unit sphere for a great-circle distance."""
+    return 2 * np.sin(np.minimum(np.asarray(distance_km, dtype=np.float64) / EARTH_RADIUS_KM, np.pi) / 2)
+
+def great_circle_km(chord):
+    """Great-circle distance in km for a chord of the unit sphere."""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord, dtype=np.float64) / 2, 1.0))
+
+class SpatialIndex:
+    """
+    k-nearest and radius queries over keyed [lat, lon] points (e.g. order
+    pickups by order id), with a KD-tree on unit-sphere coordinates so
+    queries take O(log n). Points can be added, moved and removed between
+    queries without rebuilding the tree each time.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._tree = None
+        self._tree_keys = []
+        self._tree_points = np.empty((0, 3))
+        self._alive = np.empty(0, dtype=bool)
+        self._positions = {}
+        self._buffer = {}
+        self._removed = 0
+
+    def __len__(self):
+        return len(self._positions) + len(self._buffer)
+
+    def __contains__(self, key):
+        return key in self._positions or key in self._buffer
+
+    def _discard(self, key):
+        position = self._positions.pop(key, None)
+        if position is not None:
+            self._alive[position] = False
+            self._removed += 1
+        self._buffer.pop(key, None)
+
+    def _rebuild(self):
+        """Rebuild the tree over every live point, emptying the buffer."""
+        keys = [key for key, alive in zip(self._tree_keys, self._alive) if alive] + list(self._buffer)
+        points = np.vstack([self._tree_points[self._alive]] + list(self._buffer.values())) if keys else np.empty((0, 3))
+        self._tree = cKDTree(points) if keys else None
+        self._tree_keys = keys
+        self._tree_points = points
+        self._alive = np.ones(len(keys), dtype=bool)
+        self._positions = {key: position for position, key in enumerate(keys)}
+        self._buffer = {}
+        self._removed = 0
+
+    def _maybe_rebuild(self):
+        if len(self._buffer) + self._removed > self.buffer_size:
+            self._rebuild()
+
+    def add(self, keys, coordinates):
+        """Add points (or move existing keys) from parallel lists of keys and [lat, lon]."""
+        points = unit_vectors(coordinates)
+        with self._lock:
+            for key, point in zip(keys, points):
+                self._discard(key)
+                self._buffer[key] = point[None, :]
+            self._maybe_rebuild()
+
+    def remove(self, keys):
+        """Remove points by key; unknown keys are ignored."""
+        with self._lock:
+            for key in keys:
+                self._discard(key)
+            self._maybe_rebuild()
+
+    def sync(self, keys, coordinates):
+        """
+        Make the index hold exactly these points, adding and removing only
+        what changed since the last call (e.g. once per store version).
+        """
+        keys = list(keys)
+        wanted = set(keys)
+        with self._lock:
+            stale = [key for key in list(self._positions) + list(self._buffer) if key not in wanted]
+            for key in stale:
+                self._discard(key)
+        new = [position for position, key in enumerate(keys) if key not in self]
+        if new:
+            coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+            self.add([keys[position] for position in new], coordinates[new])
+        elif stale:
+            with self._lock:
+                self._maybe_rebuild()
+
+    def _candidates(self, points, tree_hits):
+        """Live (key, chord) pairs from tree hits plus the whole buffer, per query point."""
+        buffer_keys = list(self._buffer)
+        buffer_points = np.vstack(list(self._buffer.values())) if buffer_keys else np.empty((0, 3))
+        results = []
+        for point, (chords, positions) in zip(points, tree_hits):
+            found = [(self._tree_keys[position], chord) for chord, position in zip(chords, positions)
+                     if position < len(self._tree_keys) and self._alive[position]]
+            if buffer_keys:
+                found += list(zip(buffer_keys, np.linalg.norm(buffer_points - point, axis=1)))
+            results.append(found)
+        return results
+
+    def nearest(self, coordinates, k=1):
+        """
+        The `k` nearest points to each [lat, lon] query point, as lists of
+        (key, distance_km) sorted by distance. One list per query point.
+        """
+        points = unit_vectors(coordinates)
+        with self._lock:
+            if self._tree is not None and k > 0 and not self._buffer and not self._removed:
+                # Nothing added or removed since the tree was built: take its answers as they are
+                chords, positions = self._tree.query(points, k=min(k, len(self._tree_keys)))
+                chords, positions = chords.reshape(len(points), -1), positions.reshape(len(points), -1)
+                return [[(self._tree_keys[position], distance) for position, distance in zip(row_positions, row_distances)]
+                        for row_positions, row_distances in zip(positions.tolist(), great_circle_km(chords).tolist())]
+            tree_hits = [([], [])] * len(points)
+            if self._tree is not None and k > 0:
+                # Removed points may take some of the k places
+                count = min(len(self._tree_keys), k + self._removed)
+                chords, positions = self._tree.query(points, k=count)
+                tree_hits = zip(np.asarray(chords).reshape(len(points), -1), np.asarray(positions).reshape(len(points), -1))
+            results = self._candidates(points, tree_hits)
+        return [[(key, float(great_circle_km(chord))) for key, chord in sorted(found, key=lambda hit: hit[1])[:k]]
+                for found in results]
+
+    def within(self, coordinates, radius_km):
+        """
+        Every point within `radius_km` of each [lat, lon] query point, as lists
+        of (key, distance_km) sorted by distance. One list per query point.
+        """
+        points = unit_vectors(coordinates)
+        radius = chord_length(radius_km)
+        with self._lock:
+            tree_hits = [([], [])] * len(points)
+            if self._tree is not None:
+                neighbours = self._tree.query_ball_point(points, radius)
+                tree_hits = [(np.linalg.norm(self._tree_points[hits] - point, axis=1) if hits else [], hits)
+                             for point, hits in zip(points, neighbours)]
+            results = self._candidates(points, tree_hits)
+        return [[(key, float(great_circle_km(chord))) for key, chord in sorted(found, key=lambda hit: hit[1])
+                 if chord <= radius] for found in results]
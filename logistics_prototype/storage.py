@@ -0,0 +1,319 @@
+import glob
+import os
+import sqlite3
+import threading
+import uuid
+import pandas as pd
+from instrumentation import increment, timed
+
+# Get the absolute path to the orders database, and to the CSV file it replaces
+DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'orders.sqlite')
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'orders.csv')
+
+ORDER_COLUMNS = ['id', 'pickup_address', 'delivery_address', 'assigned_to', 'status', 'lat_pick', 'lon_pick', 'lat_drop', 'lon_drop', 'eta', 'created_at']
+
+# How long a writer waits for another session's transaction before giving up, in seconds
+BUSY_TIMEOUT_SECONDS = 30
+
+UUID_PATTERN = r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'
+
+COLUMN_TYPES = {
+    'id': 'TEXT PRIMARY KEY',
+    'pickup_address': 'TEXT',
+    'delivery_address': 'TEXT',
+    'assigned_to': 'TEXT',
+    'status': 'TEXT',
+    'lat_pick': 'REAL',
+    'lon_pick': 'REAL',
+    'lat_drop': 'REAL',
+    'lon_drop': 'REAL',
+    'eta': 'TEXT',
+    'created_at': 'TEXT',
+}
+
+# Format of created_at; sorts and compares correctly as text
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# In-memory dtypes of the orders table: ids as one Arrow string buffer,
+# repeated values (statuses, partners, addresses, ETAs) as categoricals that
+# store each distinct string once, and float32 coordinates (under a metre of
+# error around Delhi)
+ORDER_DTYPES = {
+    'id': 'string[pyarrow]',
+    'pickup_address': 'category',
+    'delivery_address': 'category',
+    'assigned_to': 'category',
+    'status': 'category',
+    'lat_pick': 'float32',
+    'lon_pick': 'float32',
+    'lat_drop': 'float32',
+    'lon_drop': 'float32',
+    'eta': 'category',
+    'created_at': 'category',
+}
+
+# Get the absolute path to the directory of Parquet snapshots of the orders table
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'snapshots')
+
+class OrderStore:
+    """
+    Orders table in an embedded SQLite database (WAL mode), indexed on id,
+    status and assigned_to. Writes touch only the rows they change, and each
+    write is one transaction, so concurrent sessions don't overwrite each other.
+    Read-modify-write callers pass the values they read as `expected` to
+    update_orders, which skips and reports rows another session changed since.
+    """
+
+    def __init__(self, path=DB_FILE, legacy_csv=DATA_FILE):
+        self.path = path
+        self._local = threading.local()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = self._connection()
+        columns = ', '.join(f'{column} {COLUMN_TYPES[column]}' for column in ORDER_COLUMNS)
+        with connection:
+            connection.execute(f'CREATE TABLE IF NOT EXISTS orders ({columns})')
+            # Add columns introduced after the table was first created
+            existing = {row[1] for row in connection.execute('PRAGMA table_info(orders)')}
+            for column in ORDER_COLUMNS:
+                if column not in existing:
+                    connection.execute(f'ALTER TABLE orders ADD COLUMN {column} {COLUMN_TYPES[column]}')
+            connection.execute('CREATE INDEX IF NOT EXISTS orders_status ON orders (status)')
+            connection.execute('CREATE INDEX IF NOT EXISTS orders_assigned_to ON orders (assigned_to)')
+            connection.execute('CREATE INDEX IF NOT EXISTS orders_created_at ON orders (created_at)')
+            # Bumped by every write so readers can cache the table between changes
+            connection.execute('CREATE TABLE IF NOT EXISTS store_version (version INTEGER NOT NULL)')
+            if connection.execute('SELECT COUNT(*) FROM store_version').fetchone()[0] == 0:
+                connection.execute('INSERT INTO store_version (version) VALUES (0)')
+
+        # One-off import of the old CSV "database"
+        if legacy_csv and os.path.exists(legacy_csv) and self.count() == 0:
+            try:
+                # Keep the literal 'N/A' the old app wrote for unassigned orders and unknown
+                # ETAs; only empty cells are missing
+                legacy_orders = pd.read_csv(legacy_csv, keep_default_na=False, na_values=[''])
+            except pd.errors.EmptyDataError:
+                legacy_orders = pd.DataFrame(columns=ORDER_COLUMNS)
+            self.insert_orders(ensure_valid_ids(legacy_orders))
+
+    def _connection(self):
+        """One connection per thread; SQLite connections must not be shared across threads."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _bump_version(self, connection):
+        connection.execute('UPDATE store_version SET version = version + 1')
+
+    def version(self):
+        """Counter that changes whenever any session writes to the orders table."""
+        return self._connection().execute('SELECT version FROM store_version').fetchone()[0]
+
+    def _where(self, status=None, assigned_to=None, created_from=None, created_to=None):
+        clauses, params = [], []
+        # Dates compare as 'YYYY-MM-DD' prefixes of created_at; created_to is exclusive
+        if created_from is not None:
+            clauses.append('created_at >= ?')
+            params.append(str(created_from))
+        if created_to is not None:
+            clauses.append('created_at < ?')
+            params.append(str(created_to))
+        for column, value in [('status', status), ('assigned_to', assigned_to)]:
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                value = list(value)
+                clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+                params += value
+            else:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        return where, params
+
+    @timed('store.query')
+    def query(self, status=None, assigned_to=None, created_from=None, created_to=None, limit=None, offset=0):
+        """
+        Return orders as a DataFrame, filtered by status and/or partner (single
+        values or lists) and creation date, `limit` rows from `offset`.
+        """
+        where, params = self._where(status, assigned_to, created_from, created_to)
+        sql = f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders{where} ORDER BY rowid"
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [int(limit), int(offset)]
+        return pd.read_sql_query(sql, self._connection(), params=params)
+
+    def all_orders(self):
+        """Return the whole orders table."""
+        return self.query()
+
+    @timed('store.snapshot')
+    def snapshot(self, version=None, directory=SNAPSHOT_DIR):
+        """
+        The whole orders table with compact dtypes, read from the Parquet
+        snapshot of the current version, or written to it if there is none.
+        Older snapshots are removed.
+        """
+        version = self.version() if version is None else version
+        path = os.path.join(directory, f'orders-{version}.parquet')
+        try:
+            orders_df = pd.read_parquet(path)
+            # A recreated database starts counting versions again
+            if len(orders_df) == self.count():
+                return orders_df
+        except OSError:
+            # Not written yet, or replaced by a newer version meanwhile
+            pass
+        orders_df = compact_orders(self.all_orders())
+        os.makedirs(directory, exist_ok=True)
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        orders_df.to_parquet(temporary, index=False)
+        os.replace(temporary, path)
+        for old_path in glob.glob(os.path.join(directory, 'orders-*.parquet')):
+            if old_path != path:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+        return orders_df
+
+    def get_order(self, order_id):
+        """Return one order as a dict, or None if it doesn't exist."""
+        row = self._connection().execute(
+            f"SELECT {', '.join(ORDER_COLUMNS)} FROM orders WHERE id = ?", (order_id,)
+        ).fetchone()
+        return dict(zip(ORDER_COLUMNS, row)) if row else None
+
+    def count(self, status=None, assigned_to=None, created_from=None, created_to=None):
+        """Count orders with the same filters as query."""
+        where, params = self._where(status, assigned_to, created_from, created_to)
+        return self._connection().execute(f'SELECT COUNT(*) FROM orders{where}', params).fetchone()[0]
+
+    @timed('store.insert_orders')
+    def insert_orders(self, orders_df, replace=False):
+        """Insert many orders in one transaction; with `replace`, existing ids are overwritten."""
+        if orders_df.empty:
+            return
+        orders_df = with_created_at(orders_df)
+        orders_df = orders_df.astype(object).where(orders_df.notna(), None)
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT'
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                f"{verb} INTO orders ({', '.join(ORDER_COLUMNS)}) VALUES ({', '.join('?' * len(ORDER_COLUMNS))})",
+                orders_df.itertuples(index=False, name=None)
+            )
+            self._bump_version(connection)
+
+    def update_order(self, order_id, expected=None, **values):
+        """
+        Update some columns of a single order. With `expected` ({column: value}),
+        only if the order still holds those values; returns whether it was updated.
+        """
+        return not self.update_orders([(order_id, values, expected)])
+
+    @timed('store.update_orders')
+    def update_orders(self, updates):
+        """
+        Apply many (order_id, {column: value}) updates in one transaction.
+        An update given as (order_id, values, expected) only applies if the order
+        still holds the `expected` {column: value} pairs, so a session can't
+        overwrite a change made since it read the order. Returns the ids of the
+        orders left unchanged because they had changed or no longer exist.
+        """
+        conflicts = []
+        connection = self._connection()
+        with connection:
+            for update in updates:
+                order_id, values = update[:2]
+                expected = (update[2] if len(update) > 2 else None) or {}
+                columns = [column for column in values if column in COLUMN_TYPES and column != 'id']
+                if not columns:
+                    continue
+                # IS compares NULLs as equal, so an expected missing value matches too
+                checks = [column for column in expected if column in COLUMN_TYPES]
+                cursor = connection.execute(
+                    f"UPDATE orders SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?"
+                    + ''.join(f' AND {column} IS ?' for column in checks),
+                    [values[column] for column in columns] + [order_id] + [expected[column] for column in checks]
+                )
+                if cursor.rowcount == 0:
+                    conflicts.append(order_id)
+            self._bump_version(connection)
+        if conflicts:
+            increment('store_update_conflicts', len(conflicts))
+        return conflicts
+
+    @timed('store.set_column')
+    def set_column(self, column, values):
+        """Set one column for many orders in one transaction, from a {order_id: value} mapping."""
+        if column not in COLUMN_TYPES or column == 'id':
+            raise ValueError(f"Unknown order column: {column}")
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                f'UPDATE orders SET {column} = ? WHERE id = ?',
+                [(value, order_id) for order_id, value in dict(values).items()]
+            )
+            self._bump_version(connection)
+
+    def replace_all(self, orders_df):
+        """Replace the whole table with `orders_df` in one transaction."""
+        orders_df = with_created_at(ensure_valid_ids(orders_df))
+        orders_df = orders_df.astype(object).where(orders_df.notna(), None)
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM orders')
+            connection.executemany(
+                f"INSERT INTO orders ({', '.join(ORDER_COLUMNS)}) VALUES ({', '.join('?' * len(ORDER_COLUMNS))})",
+                orders_df.itertuples(index=False, name=None)
+            )
+            self._bump_version(connection)
+
+    def delete_all(self):
+        """Remove every order."""
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM orders')
+            self._bump_version(connection)
+
+def compact_orders(orders_df):
+    """Convert an orders DataFrame to the compact ORDER_DTYPES."""
+    return orders_df.astype({column: dtype for column, dtype in ORDER_DTYPES.items() if column in orders_df.columns})
+
+def with_created_at(orders_df):
+    """Return the orders in ORDER_COLUMNS order, stamping missing created_at values with now."""
+    orders_df = orders_df.reindex(columns=ORDER_COLUMNS)
+    orders_df['created_at'] = orders_df['created_at'].fillna(pd.Timestamp.now().strftime(TIMESTAMP_FORMAT))
+    return orders_df
+
+def ensure_valid_ids(orders_df):
+    """
+    Give every order whose id is missing, not a UUID or a duplicate a fresh
+    UUID, in one vectorized pass.
+    """
+    if orders_df.empty or 'id' not in orders_df.columns:
+        return orders_df
+    ids = orders_df['id'].astype(str)
+    invalid = ~ids.str.fullmatch(UUID_PATTERN) | orders_df['id'].isna() | ids.duplicated()
+    if not invalid.any():
+        return orders_df
+    orders_df = orders_df.copy()
+    orders_df.loc[invalid, 'id'] = [str(uuid.uuid4()) for _ in range(int(invalid.sum()))]
+    return orders_df
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_default_store():
+    """Shared OrderStore backed by data/orders.sqlite."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = OrderStore()
+        return _default_store
@@ -1,35 +1,31 @@
-import pandas as pd
-from geopy.geocoders import Nominatim
-import os
 from optimizer import haversine_distance # Import the distance calculator
+from geocoding import get_default_geocoder
+from eta import direct_delivery_times, format_eta
+from instrumentation import timed
+from dispatch import dispatch_status_changes
+from storage import ORDER_COLUMNS, get_default_store
 
-# Get the absolute path to the data file
-DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'orders.csv')
-
+@timed('geocode')
 def get_lat_lon(address):
-    """Geocode an address to get latitude and longitude."""
-    geolocator = Nominatim(user_agent="logistics_prototype")
-    try:
-        location = geolocator.geocode(address)
-        if location:
-            return location.latitude, location.longitude
-    except:
-        return None, None
-    return None, None
+    """Geocode an address to get latitude and longitude (cached on disk)."""
+    return get_default_geocoder().geocode(address)
+
+@timed('geocode_batch')
+def get_lat_lon_batch(addresses, progress_callback=None):
+    """Geocode many addresses concurrently, looking each distinct address up only once."""
+    return get_default_geocoder().geocode_batch(addresses, progress_callback=progress_callback)
 
+@timed()
 def update_order_status(order_id, new_status):
-    """Update the status of an order in the CSV file."""
-    orders_df = pd.read_csv(DATA_FILE)
-    orders_df.loc[orders_df['id'] == order_id, 'status'] = new_status
-    orders_df.to_csv(DATA_FILE, index=False)
+    """Update the status of an order in the orders database, and take finished stops off its route."""
+    store = get_default_store()
+    store.update_order(order_id, status=new_status)
+    dispatch_status_changes(store, {order_id: new_status})
 
 def get_estimated_delivery_time(distance_km):
-    """Calculate estimated delivery time based on distance."""
-    if distance_km < 100:
-        return "1 day"
-    elif distance_km < 1000:
-        return "3 days"
-    elif distance_km < 5000:
-        return "5 days"
-    else:
-        return "7 days"
\ No newline at end of file
+    """Estimated delivery time of an order taken straight from pickup to drop, leaving now."""
+    return format_eta(direct_delivery_times(distance_km))
+
+def get_estimated_delivery_times(distances_km):
+    """Estimated delivery times for an array of direct pickup-to-drop distances at once."""
+    return format_eta(direct_delivery_times(distances_km))